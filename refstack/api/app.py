@@ -20,19 +20,26 @@ import logging
 import os
 
 from beaker.middleware import SessionMiddleware
+from cryptography import fernet
 from oslo_config import cfg
 from oslo_log import log
 import pecan
 import six
 import webob
 
+from refstack.api import cache
 from refstack.api import exceptions as api_exc
+from refstack.api import guidelines
+from refstack.api import session
 from refstack.api import utils as api_utils
 from refstack.api import constants as const
 from refstack import db
 
 LOG = log.getLogger(__name__)
 
+# Number of seconds after which UI user sessions expire.
+SESSION_TIMEOUT = 604800
+
 PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
                             os.pardir)
 UI_OPTS = [
@@ -101,12 +108,87 @@ API_OPTS = [
                     'specific capability files. Capability file names will '
                     'be appended to this URL to get the contents of that file.'
                ),
+    cfg.IntOpt('guideline_sources_timeout',
+               default=15,
+               help='Maximum number of seconds to wait for the listings of '
+                    'all guideline sources. Sources are listed '
+                    'concurrently, and guidelines of sources which did not '
+                    'respond in time are left out.'
+               ),
+    cfg.StrOpt('guidelines_mirror_path',
+               default='',
+               help='Path of a local mirror of the Interop WG guidelines '
+                    'repository: a directory with a checkout of the '
+                    'repository, or a tarball (.tar, .tar.gz or .tgz) of it. '
+                    'If set, guidelines are read from the mirror instead of '
+                    'GitHub, and are reloaded when the mirror changes. The '
+                    'mirror can be updated with "refstack-manage '
+                    'sync-guidelines", in which case a directory mirror must '
+                    'be a symbolic link or not exist yet.'
+               ),
+    cfg.IntOpt('guidelines_refresh_interval',
+               default=3600,
+               help='Interval in seconds between background refreshes of '
+                    'the guideline list and all guideline files by the API '
+                    'server. Guidelines are first fetched when the server '
+                    'starts, and requests are served from the last refresh. '
+                    'Set to 0 to fetch guidelines when they are requested.'
+               ),
+    cfg.StrOpt('guidelines_mirror_source_url',
+               default='https://github.com/openstack/interop/archive/'
+                       'master.tar.gz',
+               help='URL of the tarball of the guidelines repository which '
+                    'is downloaded by "refstack-manage sync-guidelines".'
+               ),
     cfg.BoolOpt('enable_anonymous_upload',
                 default=True,
                 help='Enable or disable anonymous uploads. If set to False, '
                      'all clients will need to authenticate and sign with a '
                      'public/private keypair previously uploaded to their '
                      'user account.'
+                ),
+    cfg.IntOpt('verified_token_cache_ttl',
+               default=300,
+               help='Maximum number of seconds for which a verified JWT '
+                    'token is cached by every process. A token is never '
+                    'cached beyond its expiration time. Tokens signed with '
+                    'a key deleted through another process are accepted '
+                    'until their entries expire. Set to 0 to verify the '
+                    'signature of every token.'
+               ),
+    cfg.IntOpt('upload_key_cache_ttl',
+               default=300,
+               help='Maximum number of seconds for which the owner of a '
+                    'public key signing uploaded results is cached by every '
+                    'process. Keys deleted through another process are '
+                    'accepted until their entries expire. Set to 0 to look '
+                    'up the key of every upload.'
+               ),
+    cfg.StrOpt('session_backend',
+               default='database',
+               choices=['database', 'cookie'],
+               help='Storage of UI user sessions. "database" stores '
+                    'sessions in the RefStack database. "cookie" stores '
+                    'them in encrypted and signed cookies, so no database '
+                    'queries are needed for sessions and sessions are valid '
+                    'in every API process sharing the session_cookie_keys.'
+               ),
+    cfg.ListOpt('session_cookie_keys',
+                default=[],
+                secret=True,
+                help='Fernet keys used to encrypt and sign session cookies '
+                     'if session_backend is "cookie". New sessions are '
+                     'encrypted with the first key, and all keys are used '
+                     'to decrypt sessions, so that keys can be rotated. '
+                     'A key can be generated with: python -c "from '
+                     'cryptography.fernet import Fernet; '
+                     'print(Fernet.generate_key())". If no key is given, '
+                     'a random key is generated by every process.'
+                ),
+    cfg.BoolOpt('session_cookie_secure',
+                default=False,
+                help='Send session cookies over HTTPS connections only, '
+                     'if session_backend is "cookie".'
                 )
 ]
 
@@ -123,6 +205,34 @@ CONF.register_opts(API_OPTS, opt_group)
 log.register_options(CONF)
 
 
+class ConditionalGetHook(pecan.hooks.PecanHook):
+    """A pecan hook that answers conditional GET requests.
+
+    Controllers set the ETag of their responses with api_utils.check_etag.
+    If the client already has the current response body, the response is
+    turned into 304 Not Modified without a body.
+    """
+
+    def after(self, state):
+        """Answer the request with 304 if the client's copy is current."""
+        request = state.request
+        response = state.response
+        if (request.method not in ('GET', 'HEAD') or
+                response.status_int != 200 or not response.etag):
+            return
+        if 'HTTP_IF_NONE_MATCH' in request.environ:
+            not_modified = response.etag in request.if_none_match
+        else:
+            not_modified = bool(request.if_modified_since and
+                                response.last_modified and
+                                response.last_modified <=
+                                request.if_modified_since)
+        if not_modified:
+            response.status = 304
+            response.body = b''
+            del response.content_type
+
+
 class JSONErrorHook(pecan.hooks.PecanHook):
     """A pecan hook that translates webob HTTP errors into a JSON format."""
 
@@ -214,6 +324,30 @@ class JWTAuthHook(pecan.hooks.PecanHook):
             state.request.environ[const.JWT_TOKEN_ENV] = token
 
 
+class AuthContextHook(pecan.hooks.PecanHook):
+    """A pecan hook that resolves the user's identity once per request.
+
+    The hook also logs the number of database queries of each request.
+    """
+
+    _QUERY_COUNT_ENV = 'refstack.query_count'
+
+    def on_route(self, state):
+        """Create the authentication context of the request."""
+        state.request.environ[const.AUTH_CONTEXT_ENV] = \
+            api_utils.AuthContext(api_utils.get_user_id())
+        state.request.environ[self._QUERY_COUNT_ENV] = db.get_query_count()
+
+    def after(self, state):
+        """Log the number of database queries of the request."""
+        start_count = state.request.environ.get(self._QUERY_COUNT_ENV)
+        if start_count is not None:
+            LOG.debug('%(method)s %(path)s: %(count)d DB queries',
+                      {'method': state.request.method,
+                       'path': state.request.path,
+                       'count': db.get_query_count() - start_count})
+
+
 def setup_app(config):
     """App factory."""
     # By default we expect path to oslo config file in environment variable
@@ -244,7 +378,8 @@ def setup_app(config):
         static_root=static_root,
         template_path=template_path,
         hooks=[
-            JWTAuthHook(), JSONErrorHook(), CORSHook(),
+            JWTAuthHook(), AuthContextHook(), ConditionalGetHook(),
+            JSONErrorHook(), CORSHook(),
             pecan.hooks.RequestViewerHook(
                 {'items': ['status', 'method', 'controller', 'path', 'body']},
                 headers=False, writer=WritableLogger(LOG, logging.DEBUG)
@@ -252,15 +387,32 @@ def setup_app(config):
         ]
     )
 
-    beaker_conf = {
-        'session.key': 'refstack',
-        'session.type': 'ext:database',
-        'session.url': CONF.database.connection,
-        'session.timeout': 604800,
-        'session.validate_key': api_utils.get_token(),
-        'session.sa.pool_recycle': 600
-    }
-    app = SessionMiddleware(app, beaker_conf)
+    if CONF.api.session_backend == 'cookie':
+        keys = CONF.api.session_cookie_keys
+        if not keys:
+            LOG.warning('No session_cookie_keys are configured, sessions '
+                        'are only valid in this process.')
+            keys = [fernet.Fernet.generate_key()]
+        app = session.CookieSessionMiddleware(
+            app, keys, cookie_name='refstack', timeout=SESSION_TIMEOUT,
+            secure=CONF.api.session_cookie_secure)
+    else:
+        beaker_conf = {
+            'session.key': 'refstack',
+            'session.type': 'ext:database',
+            'session.url': CONF.database.connection,
+            'session.timeout': SESSION_TIMEOUT,
+            'session.validate_key': api_utils.get_token(),
+            'session.sa.pool_recycle': 600
+        }
+        app = SessionMiddleware(app, beaker_conf)
+
+    # Cached API data is invalidated when it changes through the DB API.
+    db.add_change_listener(cache.invalidate)
+
+    if CONF.api.guidelines_refresh_interval > 0:
+        guidelines.start_guideline_refresh(
+            CONF.api.guidelines_refresh_interval)
 
     if CONF.api.app_dev_mode:
         LOG.debug('\n\n <<< Refstack UI is available at %s >>>\n\n',
@@ -0,0 +1,44 @@
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Process-wide in-memory caches of the API."""
+
+from refstack.api import response_cache
+from refstack import cache
+from refstack import db
+
+# Verified JWT token payloads keyed by the SHA-256 digest of the token.
+verified_tokens = cache.TTLCache(maxsize=4096)
+
+# Parsed user public keys keyed by pubkey id.
+parsed_pubkeys = cache.TTLCache(maxsize=4096)
+
+# Public keys which signed uploaded results keyed by key fingerprint.
+upload_keys = cache.TTLCache(maxsize=4096)
+
+
+def invalidate(*kinds):
+    """Invalidate cached data of the kinds changed through the DB API.
+
+    It is registered as a change listener of the DB API by the app.
+    """
+    if db.PUBKEYS in kinds:
+        # Tokens and uploads signed with a deleted key must not be
+        # accepted anymore.
+        parsed_pubkeys.clear()
+        verified_tokens.clear()
+        upload_keys.clear()
+    response_cache.invalidate(*[kind for kind in kinds
+                                if kind in response_cache.ENDPOINTS])
@@ -0,0 +1,445 @@
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Vectorized evaluation of test runs against guidelines.
+
+Passed tests of every test run are stored as a packed bitset in which each
+test name has a fixed bit position (see db.get_test_name_bits). Required
+tests of a guideline target are compiled to bit masks over the same
+positions, so a whole batch of test runs can be evaluated with a few
+AND/popcount operations over a 2D array of bytes.
+"""
+
+import hashlib
+import json
+import re
+import threading
+
+import numpy
+from oslo_log import log
+
+from refstack import cache
+from refstack import db
+from refstack.api import guidelines
+
+LOG = log.getLogger(__name__)
+
+# Number of set bits in every possible byte value.
+_POPCOUNT = numpy.array([bin(i).count('1') for i in range(256)],
+                        dtype=numpy.uint8)
+
+_TEST_STR_REGEX = re.compile(r'^(?P<name>.*?)(\[(?P<id>[^\]]*)\])?$')
+
+# Targets of the OpenStack Powered guidelines. Each add-on guideline has a
+# single target named after the add-on.
+POWERED_TARGETS = ('platform', 'compute', 'object')
+
+# Statuses of guideline capabilities, in the order they are reported.
+CAPABILITY_STATUSES = ('required', 'advisory', 'deprecated', 'removed')
+
+# Maximum number of test runs with a cached eligibility.
+_MAX_CACHED_ELIGIBILITY = 1024
+
+# Maximum number of guideline targets with cached report structures.
+_MAX_CACHED_REPORT_TARGETS = 256
+
+# Number of test runs evaluated at once by the analytics job.
+_STATS_BATCH_SIZE = 1000
+
+_lock = threading.Lock()
+_compiled_guidelines = {'digest': None, 'targets': {}, 'last_bit': None}
+_eligibility_cache = cache.TTLCache(maxsize=_MAX_CACHED_ELIGIBILITY)
+_report_targets = cache.TTLCache(maxsize=_MAX_CACHED_REPORT_TARGETS)
+
+
+def to_bitset_matrix(bitsets, width=0):
+    """Stack packed bitsets into a 2D array with one row per test run.
+
+    :param bitsets: List of packed bitsets.
+    :param width: Minimum width of a row in bytes.
+    """
+    width = max([width] + [len(bits) for bits in bitsets])
+    matrix = numpy.zeros((len(bitsets), width), dtype=numpy.uint8)
+    for row, bits in enumerate(bitsets):
+        matrix[row, :len(bits)] = numpy.frombuffer(bits, dtype=numpy.uint8)
+    return matrix
+
+
+def _to_mask(positions, width):
+    """Build a byte mask with the given bit positions set."""
+    mask = numpy.zeros(width, dtype=numpy.uint8)
+    for position in positions:
+        mask[position >> 3] |= 1 << (position & 7)
+    return mask
+
+
+def _group_tests(test_list):
+    """Group test strings of a guideline test list by idempotent id.
+
+    Aliases of a test share its idempotent id, and passing any name of a
+    group passes the test.
+    """
+    groups = {}
+    for test_str in test_list:
+        match = _TEST_STR_REGEX.match(test_str)
+        name, test_uuid = match.group('name'), match.group('id')
+        groups.setdefault(test_uuid or name, set()).add(name)
+    return list(groups.values())
+
+
+class CompiledTarget(object):
+    """Tests of a guideline target or capability compiled to bit masks."""
+
+    def __init__(self, tests, name_bits):
+        """Compile the given tests.
+
+        :param tests: List of tests, each given as a set of equivalent
+                      test names.
+        :param name_bits: Dict with bit positions of test names.
+        """
+        self.tests = tests
+        single_bits = []
+        alias_bits = []
+        self.unknown_count = 0
+        # Names which were never passed have no bit position yet.
+        self.unknown_names = set()
+        for names in tests:
+            bits = [name_bits[name] for name in names if name in name_bits]
+            self.unknown_names.update(name for name in names
+                                      if name not in name_bits)
+            if not bits:
+                # None of the names has ever been passed.
+                self.unknown_count += 1
+            elif len(bits) == 1:
+                single_bits.extend(bits)
+            else:
+                alias_bits.append(bits)
+        all_bits = single_bits + [bit for bits in alias_bits for bit in bits]
+        self.width = max(all_bits) // 8 + 1 if all_bits else 0
+        self.mask = _to_mask(single_bits, self.width)
+        self.alias_masks = [_to_mask(bits, self.width)
+                            for bits in alias_bits]
+
+    @property
+    def test_count(self):
+        """Number of compiled tests."""
+        return len(self.tests)
+
+    def count_passed(self, matrix):
+        """Count passed tests for each row of a bitset matrix."""
+        if matrix.shape[1] < self.width:
+            matrix = numpy.pad(
+                matrix, ((0, 0), (0, self.width - matrix.shape[1])),
+                'constant')
+        # Only the bytes covered by the masks can contribute.
+        columns = numpy.flatnonzero(self.mask)
+        passed = _POPCOUNT[matrix[:, columns] & self.mask[columns]].sum(
+            axis=1, dtype=numpy.int64)
+        for alias_mask in self.alias_masks:
+            columns = numpy.flatnonzero(alias_mask)
+            passed += (matrix[:, columns] & alias_mask[columns]).any(axis=1)
+        return passed
+
+    def count_missing(self, matrix):
+        """Count missing tests for each row of a bitset matrix."""
+        return self.test_count - self.count_passed(matrix)
+
+
+def compile_target(guideline_json, target='platform', types=('required',)):
+    """Compile non-flagged tests of a guideline target to bit masks.
+
+    :param guideline_json: Guideline contents.
+    :param target: Guideline target, e.g. 'platform' or 'compute'.
+    :param types: Statuses of capabilities to include.
+    """
+    guidelines_obj = guidelines.Guidelines()
+    capabilities = guidelines_obj.get_target_capabilities(
+        guideline_json, types=list(types), target=target)
+    test_list = guidelines_obj.get_test_list(
+        guideline_json, capabilities, alias=True, show_flagged=False)
+    tests = _group_tests(test_list)
+    # Names are only registered by uploads. Tests without a bit position
+    # can't be passed by any stored test run.
+    name_bits = db.get_test_name_bits(set().union(*tests))
+    return CompiledTarget(tests, name_bits)
+
+
+def compile_capabilities(guideline_json):
+    """Compile non-flagged tests of every capability of a guideline.
+
+    :param guideline_json: Guideline contents.
+    :returns: Dict of compiled capabilities keyed by capability name.
+    """
+    guidelines_obj = guidelines.Guidelines()
+    capability_tests = {}
+    for capability in guideline_json['capabilities']:
+        test_list = guidelines_obj.get_test_list(
+            guideline_json, [capability], alias=True, show_flagged=False)
+        capability_tests[capability] = _group_tests(test_list)
+    names = set()
+    for tests in capability_tests.values():
+        names.update(*tests)
+    name_bits = db.get_test_name_bits(names)
+    return dict((capability, CompiledTarget(tests, name_bits))
+                for capability, tests in capability_tests.items())
+
+
+def evaluate_test_runs(test_ids, compiled_targets):
+    """Count missing required tests of test runs for each compiled target.
+
+    :param test_ids: The IDs of the tests.
+    :param compiled_targets: Dict of compiled targets.
+    :returns: Dict with a {test_id: missing count} dict for each target.
+    """
+    bitsets = db.get_test_result_bitsets(test_ids)
+    test_ids = [test_id for test_id in test_ids if test_id in bitsets]
+    matrix = to_bitset_matrix([bitsets[test_id] for test_id in test_ids])
+    result = {}
+    for key, compiled in compiled_targets.items():
+        missing = compiled.count_missing(matrix)
+        result[key] = dict(zip(test_ids, missing.tolist()))
+    return result
+
+
+def _get_guidelines_contents():
+    """Get contents of all powered and add-on guidelines with targets."""
+    guidelines_obj = guidelines.Guidelines()
+    contents = []
+    for program, files in sorted(guidelines_obj.get_guideline_list().items()):
+        targets = POWERED_TARGETS if program == 'powered' else (program,)
+        for guideline in files:
+            guideline_json = guidelines_obj.get_guideline_contents(
+                guideline['file'])
+            if guideline_json:
+                contents.append((guideline['file'], targets, guideline_json))
+    return contents
+
+
+def _has_new_names(compiled_targets, compiled_bit, last_bit):
+    """Check whether unknown names of compiled targets got registered.
+
+    :param compiled_targets: Dict of compiled targets.
+    :param compiled_bit: Last bit position of the registry when the
+                         targets were compiled or last checked.
+    :param last_bit: Current last bit position of the registry.
+    """
+    if last_bit == compiled_bit:
+        return False
+    unknown_names = set()
+    for compiled in compiled_targets.values():
+        unknown_names.update(compiled.unknown_names)
+    return bool(unknown_names and db.get_test_name_bits(unknown_names))
+
+
+def get_compiled_guidelines():
+    """Get compiled targets of all guidelines.
+
+    Targets are compiled once for a set of guidelines and recompiled
+    only when the guidelines change, or when tests which had no bit
+    position get registered by an upload.
+    Returns a digest of the guideline set and a dict of compiled targets
+    keyed by (guideline file, target) pairs.
+    """
+    guidelines_obj = guidelines.Guidelines()
+    contents = _get_guidelines_contents()
+    # Digests of refreshed guidelines are computed once per refresh, so
+    # the guidelines aren't serialized again on every call.
+    file_digests = [(guideline_file, targets,
+                     guidelines_obj.get_guideline_digest(guideline_file,
+                                                         guideline_json))
+                    for guideline_file, targets, guideline_json in contents]
+    digest = hashlib.sha1(
+        json.dumps(file_digests).encode('utf-8')).hexdigest()
+    # Read before compiling, so names registered meanwhile are checked
+    # on the next call.
+    last_bit = db.get_last_test_name_bit()
+    with _lock:
+        compiled = dict(_compiled_guidelines)
+    if compiled['digest'] == digest and \
+            not _has_new_names(compiled['targets'], compiled['last_bit'],
+                               last_bit):
+        with _lock:
+            if _compiled_guidelines['targets'] is compiled['targets']:
+                _compiled_guidelines['last_bit'] = last_bit
+        return digest, compiled['targets']
+
+    compiled_targets = {}
+    for guideline_file, targets, guideline_json in contents:
+        for target in targets:
+            try:
+                compiled_targets[(guideline_file, target)] = compile_target(
+                    guideline_json, target)
+            except KeyError:
+                # The target is not defined in this guideline.
+                continue
+
+    with _lock:
+        _compiled_guidelines['digest'] = digest
+        _compiled_guidelines['targets'] = compiled_targets
+        _compiled_guidelines['last_bit'] = last_bit
+        _eligibility_cache.clear()
+    return digest, compiled_targets
+
+
+def get_eligibility(test_id):
+    """Get guidelines and targets which are satisfied by a test run.
+
+    Returns the passed (guideline file, target) combinations and the
+    number of missing required tests for each combination.
+    """
+    digest, compiled_targets = get_compiled_guidelines()
+    eligibility = _eligibility_cache.get((digest, test_id))
+    if eligibility is not None:
+        return eligibility
+
+    missing = evaluate_test_runs([test_id], compiled_targets)
+    eligibility = {'passing': [], 'missing_required': {}}
+    for (guideline_file, target), counts in sorted(missing.items()):
+        count = counts.get(test_id)
+        if count is None:
+            continue
+        eligibility['missing_required'].setdefault(
+            guideline_file, {})[target] = count
+        if not count:
+            eligibility['passing'].append({'guideline': guideline_file,
+                                           'target': target})
+
+    _eligibility_cache.set((digest, test_id), eligibility)
+    return eligibility
+
+
+def _compile_report_target(guideline_json, target):
+    """List capabilities of a guideline target with their tests.
+
+    Returns a list of (capability, status, tests) tuples, in which every
+    test is a (test name, set of equivalent test names, flagged) tuple.
+    """
+    guidelines_obj = guidelines.Guidelines()
+    report_target = []
+    for status in CAPABILITY_STATUSES:
+        capabilities = guidelines_obj.get_target_capabilities(
+            guideline_json, types=[status], target=target)
+        for capability in sorted(capabilities):
+            # Test strings without aliases name the tests of a capability,
+            # and aliases are matched through the idempotent ids.
+            test_list = guidelines_obj.get_test_list(
+                guideline_json, [capability], alias=False)
+            not_flagged = set(guidelines_obj.get_test_list(
+                guideline_json, [capability], alias=False,
+                show_flagged=False))
+            names = {}
+            for test_str in guidelines_obj.get_test_list(
+                    guideline_json, [capability], alias=True):
+                match = _TEST_STR_REGEX.match(test_str)
+                names.setdefault(match.group('id') or match.group('name'),
+                                 set()).add(match.group('name'))
+            tests = []
+            for test_str in test_list:
+                match = _TEST_STR_REGEX.match(test_str)
+                tests.append((match.group('name'),
+                              names[match.group('id') or match.group('name')],
+                              test_str not in not_flagged))
+            report_target.append((capability, status, tests))
+    return report_target
+
+
+def get_compliance_report(guideline_json, digest, target, passed_names):
+    """Get a compact report of a test run against a guideline target.
+
+    For every capability of the target, the report gives its status, the
+    number of passed and total tests and the names of missing tests. A
+    capability is passed if all of its non-flagged tests are passed.
+    Raises a KeyError if the target is not defined in the guideline.
+
+    :param guideline_json: Guideline contents.
+    :param digest: Digest of the guideline contents, the capabilities and
+                   tests of the target are cached under it.
+    :param target: Guideline target, e.g. 'platform' or 'dns'.
+    :param passed_names: Set of names of the tests passed by the test run.
+    """
+    report_target = _report_targets.get((digest, target))
+    if report_target is None:
+        report_target = _compile_report_target(guideline_json, target)
+        _report_targets.set((digest, target), report_target)
+
+    capabilities = []
+    summary = dict((status, {'capabilities': 0, 'passed_capabilities': 0,
+                             'tests': 0, 'passed_tests': 0})
+                   for status in CAPABILITY_STATUSES)
+    for capability, status, tests in report_target:
+        missing = [name for name, names, flagged in tests
+                   if not flagged and not names & passed_names]
+        flagged = [name for name, names, is_flagged in tests if is_flagged]
+        passed_count = sum(1 for _name, names, _flagged in tests
+                           if names & passed_names)
+        capabilities.append({'id': capability,
+                             'status': status,
+                             'passed_count': passed_count,
+                             'test_count': len(tests),
+                             'missing': missing,
+                             'flagged': flagged})
+        counts = summary[status]
+        counts['capabilities'] += 1
+        counts['passed_capabilities'] += 0 if missing else 1
+        counts['tests'] += len(tests)
+        counts['passed_tests'] += passed_count
+    return {'capabilities': capabilities, 'summary': summary}
+
+
+def compute_capability_stats():
+    """Compute pass rates of guideline capabilities across shared runs.
+
+    A capability is passed by a test run if the run passed all of its
+    non-flagged tests. Shared and verified test runs are evaluated in
+    batches, so memory use does not grow with the number of runs.
+    """
+    compiled_capabilities = {}
+    for guideline_file, _targets, guideline_json in \
+            _get_guidelines_contents():
+        try:
+            capabilities = compile_capabilities(guideline_json)
+        except KeyError:
+            LOG.warning('Skipping malformed guideline %s.' % guideline_file)
+            continue
+        for capability, compiled in capabilities.items():
+            compiled_capabilities[(guideline_file, capability)] = compiled
+
+    pass_counts = dict.fromkeys(compiled_capabilities, 0)
+    run_count = 0
+    test_ids = db.get_shared_test_result_ids()
+    for i in range(0, len(test_ids), _STATS_BATCH_SIZE):
+        bitsets = db.get_test_result_bitsets(
+            test_ids[i:i + _STATS_BATCH_SIZE])
+        matrix = to_bitset_matrix(list(bitsets.values()))
+        run_count += len(bitsets)
+        for key, compiled in compiled_capabilities.items():
+            pass_counts[key] += int(
+                numpy.count_nonzero(compiled.count_missing(matrix) == 0))
+
+    return [{'guideline': guideline_file,
+             'capability': capability,
+             'run_count': run_count,
+             'pass_count': pass_count}
+            for (guideline_file, capability), pass_count
+            in sorted(pass_counts.items())]
+
+
+def update_capability_stats():
+    """Compute and store pass rates of guideline capabilities."""
+    stats = compute_capability_stats()
+    db.save_capability_stats(stats)
+    LOG.info('Capability statistics updated for %d capabilities.'
+             % len(stats))
+    return stats
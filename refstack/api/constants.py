@@ -25,12 +25,24 @@ PRODUCT_ID = 'product_id'
 ALL_PRODUCT_TESTS = 'all_product_tests'
 OPENID = 'openid'
 USER_PUBKEYS = 'pubkeys'
+PASSED_TEST = 'passed_test'
+PREFIX = 'prefix'
+IDS = 'ids'
+GUIDELINE = 'guideline'
+PAGINATION = 'pagination'
+
+# Pagination modes of test results
+PAGINATION_EXACT = 'exact'
+PAGINATION_HAS_MORE = 'has_more'
+PAGINATION_APPROXIMATE = 'approximate'
 
 # Guidelines tests requests parameters
 ALIAS = 'alias'
 FLAG = 'flag'
 TYPE = 'type'
 TARGET = 'target'
+FIELDS = 'fields'
+GUIDELINES = 'guidelines'
 
 # OpenID parameters
 OPENID_MODE = 'openid.mode'
@@ -83,5 +95,8 @@ PUBLIC_CLOUD = 1
 HOSTED_PRIVATE_CLOUD = 2
 
 JWT_TOKEN_HEADER = 'Authorization'
+JWT_KEY_ID_HEADER = 'X-Key-Id'
 JWT_TOKEN_ENV = 'jwt.token'
 JWT_VALIDATION_LEEWAY = 42
+
+AUTH_CONTEXT_ENV = 'refstack.auth_context'
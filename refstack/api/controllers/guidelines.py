@@ -16,13 +16,83 @@
 
 """Interop WG guidelines controller."""
 
+import hashlib
+import re
+import zlib
+
 import pecan
 from pecan import rest
 
 from refstack.api import constants as const
+from refstack.api import exceptions as api_exc
 from refstack.api import guidelines
 from refstack.api import utils as api_utils
 
+# Number of seconds for which clients may use guidelines without checking
+# whether they changed.
+_GUIDELINE_MAX_AGE = 300
+
+# Number of test names sent in each chunk of a streamed test list.
+_TEST_LIST_CHUNK_SIZE = 1000
+
+# Add-on guideline files are named after their single target.
+_ADDON_FILE_REGEX = re.compile(
+    r'^(?P<target>[a-z]+)\.([0-9]{4}\.[0-9]{2}|next)(\.json)?$')
+
+
+def _get_test_list_params():
+    """Get the statuses, alias and flag parameters of test list requests."""
+    if pecan.request.GET.get(const.TYPE):
+        types = pecan.request.GET.get(const.TYPE).split(',')
+    else:
+        types = None
+
+    if pecan.request.GET.get(const.ALIAS):
+        alias = api_utils.str_to_bool(pecan.request.GET.get(const.ALIAS))
+    else:
+        alias = True
+
+    if pecan.request.GET.get(const.FLAG):
+        flag = api_utils.str_to_bool(pecan.request.GET.get(const.FLAG))
+    else:
+        flag = True
+    return types, alias, flag
+
+
+def _iter_test_list(test_names):
+    """Generate chunks of a newline separated test list."""
+    for i in range(0, len(test_names), _TEST_LIST_CHUNK_SIZE):
+        chunk = '\n'.join(test_names[i:i + _TEST_LIST_CHUNK_SIZE])
+        yield ('\n' + chunk if i else chunk).encode('utf-8')
+
+
+def _iter_gzip(chunks):
+    """Compress generated chunks into a gzip stream."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _accepts_gzip():
+    """Check whether the client accepts gzip encoded responses."""
+    codings = pecan.request.headers.get('Accept-Encoding', '')
+    for coding in codings.split(','):
+        params = [param.strip() for param in coding.split(';')]
+        if params[0].lower() != 'gzip':
+            continue
+        for param in params[1:]:
+            name, _sep, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
 
 class TestsController(rest.RestController):
     """v1/guidelines/<version>/tests handler.
@@ -42,21 +112,15 @@ class TestsController(rest.RestController):
         if not json:
             return 'Error getting JSON content for version: ' + version
 
-        if pecan.request.GET.get(const.TYPE):
-            types = pecan.request.GET.get(const.TYPE).split(',')
-        else:
-            types = None
-
-        if pecan.request.GET.get('alias'):
-            alias = api_utils.str_to_bool(pecan.request.GET.get('alias'))
-        else:
-            alias = True
-
-        if pecan.request.GET.get('flag'):
-            flag = api_utils.str_to_bool(pecan.request.GET.get('flag'))
-        else:
-            flag = True
+        # The test list only depends on the guideline and the parameters.
+        etag = hashlib.sha1(('%s?%s' % (
+            g.get_guideline_digest(version, json),
+            pecan.request.query_string)).encode('utf-8')).hexdigest()
+        if api_utils.check_etag(etag, max_age=_GUIDELINE_MAX_AGE,
+                                per_user=False):
+            return ''
 
+        types, alias, flag = _get_test_list_params()
         target = pecan.request.GET.get('target', 'platform')
         try:
             target_caps = g.get_target_capabilities(json, types, target)
@@ -76,24 +140,131 @@ class GuidelinesController(rest.RestController):
 
     tests = TestsController()
 
+    _custom_actions = {
+        "test_list": ["GET"],
+    }
+
     @pecan.expose('json')
     def get(self):
-        """Get a list of all available guidelines."""
+        """Get a list of all available guidelines.
+
+        Guidelines of sources which didn't respond in time are left out,
+        with a Warning header naming each of these sources.
+        """
         g = guidelines.Guidelines()
         version_list = g.get_guideline_list()
         if version_list is None:
             pecan.abort(500, 'The server was unable to get a list of '
                              'guidelines from the external source.')
         else:
+            if g.skipped_sources:
+                pecan.response.headers['Warning'] = ', '.join(
+                    '199 - "Guideline source %s did not respond in time"'
+                    % src_url for src_url in g.skipped_sources)
             return version_list
 
     @pecan.expose('json')
     def get_one(self, file_name):
-        """Handler for getting contents of specific guideline file."""
+        """Handler for getting contents of specific guideline file.
+
+        The contents can be sliced with the 'target', 'type' and 'fields'
+        parameters. For example, the required capabilities of the compute
+        target are given by:
+            /v1/guidelines/2017.09.json?target=compute&type=required&
+            fields=capabilities
+        """
         g = guidelines.Guidelines()
         json = g.get_guideline_contents(file_name)
-        if json:
-            return json
-        else:
+        if not json:
             pecan.abort(500, 'The server was unable to get the JSON '
                              'content for the specified guideline file.')
+            return
+
+        target = pecan.request.GET.get(const.TARGET)
+        types = fields = None
+        if pecan.request.GET.get(const.TYPE):
+            types = pecan.request.GET.get(const.TYPE).split(',')
+        if pecan.request.GET.get(const.FIELDS):
+            fields = pecan.request.GET.get(const.FIELDS).split(',')
+
+        digest = g.get_guideline_digest(file_name, json)
+        etag = digest
+        if target or types or fields:
+            # Slices only depend on the guideline and the parameters.
+            etag = hashlib.sha1(('%s?%s' % (
+                digest, pecan.request.query_string)).encode('utf-8')
+            ).hexdigest()
+        if api_utils.check_etag(etag, max_age=_GUIDELINE_MAX_AGE,
+                                per_user=False):
+            return None
+
+        if not (target or types or fields):
+            return json
+        try:
+            return g.get_guideline_slice(json, digest, target=target,
+                                         types=types, fields=fields)
+        except KeyError:
+            raise api_exc.ParseInputsError('Invalid target: %s' % target)
+
+    @pecan.expose(content_type='text/plain')
+    def test_list(self):
+        """Get the merged test list of several guidelines and targets.
+
+        Guidelines are given as a comma separated list of guideline files,
+        each optionally followed by a colon and a target. The target
+        defaults to the add-on of add-on guidelines and to 'platform'
+        otherwise. The 'type', 'alias' and 'flag' parameters apply to all
+        guidelines, as for /v1/guidelines/<version>/tests. For example:
+            /v1/guidelines/test_list?guidelines=2017.09.json:platform,
+            dns.2018.02.json
+        The list is sorted, without duplicates, and gzip encoded if the
+        client accepts it.
+        """
+        param = pecan.request.GET.get(const.GUIDELINES)
+        if not param:
+            raise api_exc.ParseInputsError(
+                'At least one guideline is required.')
+        types, alias, flag = _get_test_list_params()
+
+        g = guidelines.Guidelines()
+        test_sets = []
+        digests = []
+        for item in param.split(','):
+            file_name, _sep, target = item.strip().partition(':')
+            if not target:
+                match = _ADDON_FILE_REGEX.match(file_name)
+                target = match.group('target') if match else 'platform'
+            json = g.get_guideline_contents(file_name)
+            if not json:
+                pecan.abort(500, 'The server was unable to get the JSON '
+                                 'content for guideline %s.' % file_name)
+            digest = g.get_guideline_digest(file_name, json)
+            try:
+                test_sets.append(g.get_target_test_set(
+                    json, digest, target, types, alias, flag))
+            except KeyError:
+                raise api_exc.ParseInputsError(
+                    'Invalid target %s of guideline %s.' %
+                    (target, file_name))
+            digests.append(digest)
+
+        gzip = _accepts_gzip()
+        response = pecan.response
+        # The test list only depends on the guidelines, the parameters
+        # and the encoding.
+        etag = hashlib.sha1(('%s?%s;%s' % (
+            ','.join(digests), pecan.request.query_string,
+            'gzip' if gzip else 'identity')).encode('utf-8')).hexdigest()
+        response.headers['Vary'] = 'Accept-Encoding'
+        if api_utils.check_etag(etag, max_age=_GUIDELINE_MAX_AGE,
+                                per_user=False):
+            return ''
+
+        chunks = _iter_test_list(sorted(frozenset().union(*test_sets)))
+        if gzip:
+            chunks = _iter_gzip(chunks)
+            response.content_encoding = 'gzip'
+        response.content_type = 'text/plain'
+        response.charset = 'utf-8'
+        response.app_iter = chunks
+        return response
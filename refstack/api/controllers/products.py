@@ -15,6 +15,7 @@
 
 """Product controller."""
 
+import hashlib
 import json
 import uuid
 
@@ -26,6 +27,7 @@ import six
 
 from refstack.api import constants as const
 from refstack.api.controllers import validation
+from refstack.api import response_cache
 from refstack.api import utils as api_utils
 from refstack.api import validators
 from refstack import db
@@ -142,6 +144,7 @@ class ProductsController(validation.BaseRestControllerWithValidation):
     versions = VersionsController()
 
     @pecan.expose('json')
+    @api_utils.cache_anonymous_response(response_cache.PRODUCTS)
     def get(self):
         """Get information of all products."""
         filters = api_utils.parse_input_params(['organization_id'])
@@ -149,7 +152,7 @@ class ProductsController(validation.BaseRestControllerWithValidation):
         allowed_keys = ['id', 'name', 'description', 'product_ref_id', 'type',
                         'product_type', 'public', 'organization_id']
         user = api_utils.get_user_id()
-        is_admin = user in db.get_foundation_users()
+        is_admin = api_utils.check_user_is_foundation_admin()
         try:
             if is_admin:
                 products = db.get_products(allowed_keys=allowed_keys,
@@ -198,6 +201,11 @@ class ProductsController(validation.BaseRestControllerWithValidation):
                     api_utils.check_user_is_vendor_admin(vendor_id))
         if not is_admin and not product['public']:
             pecan.abort(403, 'Forbidden.')
+        etag = hashlib.sha1(('%s:%s:%s:%s' % (
+            id, product['created_at'], product['updated_at'],
+            is_admin)).encode('utf-8'))
+        if api_utils.check_etag(etag.hexdigest()):
+            return None
         if not is_admin:
             admin_only_keys = ['created_by_user', 'created_at', 'updated_at',
                                'properties']
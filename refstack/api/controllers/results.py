@@ -15,6 +15,8 @@
 
 """Test results controller."""
 import functools
+import hashlib
+import json
 
 from oslo_config import cfg
 from oslo_log import log
@@ -24,7 +26,11 @@ from pecan import rest
 from six.moves.urllib import parse
 
 from refstack import db
+from refstack.api import compliance
 from refstack.api import constants as const
+from refstack.api import exceptions as api_exc
+from refstack.api import guidelines
+from refstack.api import response_cache
 from refstack.api import utils as api_utils
 from refstack.api import validators
 from refstack.api.controllers import validation
@@ -34,6 +40,45 @@ LOG = log.getLogger(__name__)
 CONF = cfg.CONF
 
 
+def compare_test_results(test_ids, get_results_by_name):
+    """Generate the comparison of passed tests of several test runs.
+
+    :param test_ids: (list) IDs of the compared test runs, in the order
+                     they should be compared.
+    :param get_results_by_name: Function returning an iterable of (test
+                                name, set of IDs of the test runs which
+                                passed the test) pairs for a list of test
+                                run IDs.
+    Generates chunks of a JSON document with the tests passed by all of
+    the test runs, the tests passed by only one of them, and the tests
+    gained or lost between each pair of consecutive test runs. The tests
+    gained or lost are compared and generated one pair at a time, so the
+    memory used doesn't grow with the number of test runs.
+    """
+    common = []
+    unique = dict((test_id, []) for test_id in test_ids)
+    for name, passed_in in get_results_by_name(test_ids):
+        if len(passed_in) == len(test_ids):
+            common.append(name)
+        elif len(passed_in) == 1:
+            unique[next(iter(passed_in))].append(name)
+    yield ('{"results": %s, "common": %s, "unique": %s, "changes": [' % (
+        json.dumps(test_ids), json.dumps(common),
+        json.dumps(unique))).encode('utf-8')
+    common = unique = None
+
+    for i in range(1, len(test_ids)):
+        prev_id, test_id = test_ids[i - 1], test_ids[i]
+        change = {'from': prev_id, 'to': test_id, 'gained': [], 'lost': []}
+        for name, passed_in in get_results_by_name([prev_id, test_id]):
+            if prev_id not in passed_in:
+                change['gained'].append(name)
+            elif test_id not in passed_in:
+                change['lost'].append(name)
+        yield ((', ' if i > 1 else '') + json.dumps(change)).encode('utf-8')
+    yield b']}'
+
+
 class MetadataController(rest.RestController):
     """/v1/results/<test_id>/meta handler."""
 
@@ -96,19 +141,176 @@ class MetadataController(rest.RestController):
         pecan.response.status = 204
 
 
+def _get_test_info(test_id, user_role):
+    """Get a test run with the passed tests, as seen by the user."""
+    if user_role in (const.ROLE_FOUNDATION, const.ROLE_OWNER):
+        test_info = db.get_test_result(
+            test_id, allowed_keys=['id', 'cpid', 'created_at',
+                                   'duration_seconds', 'meta',
+                                   'product_version',
+                                   'verification_status']
+        )
+    else:
+        test_info = db.get_test_result(test_id)
+    test_list = db.get_test_results(test_id)
+    test_name_list = [test_dict['name'] for test_dict in test_list]
+    test_info.update({'results': test_name_list,
+                      'user_role': user_role})
+
+    if user_role not in (const.ROLE_FOUNDATION, const.ROLE_OWNER):
+        # Don't expose product information if product is not public.
+        if (test_info.get('product_version') and
+                not test_info['product_version']
+                ['product_info']['public']):
+
+            test_info['product_version'] = None
+
+        test_info['meta'] = {
+            k: v for k, v in test_info['meta'].items()
+            if k in MetadataController.rw_access_keys
+        }
+    return test_info
+
+
+def _get_guideline_info(guideline_json):
+    """Get the schema, status and releases of a guideline."""
+    if 'metadata' in guideline_json and \
+            guideline_json['metadata'].get('schema', '') >= '2.0':
+        approval = guideline_json['metadata'].get('os_trademark_approval', {})
+        return {'schema': guideline_json['metadata']['schema'],
+                'status': approval.get('status'),
+                'releases': approval.get('releases')}
+    return {'schema': guideline_json.get('schema'),
+            'status': guideline_json.get('status'),
+            'releases': guideline_json.get('releases')}
+
+
+class ViewController(rest.RestController):
+    """/v1/results/<test_id>/view handler."""
+
+    @pecan.expose('json')
+    @api_utils.check_permissions(level=const.ROLE_USER)
+    def get(self, test_id):
+        """Get everything the results report page shows in one response.
+
+        The response contains the test run as returned by
+        /v1/results/<test_id>, the guidelines of the program of the target,
+        and a compact report of the test run against the selected
+        guideline and target. The guideline and target are given by the
+        'guideline' and 'target' parameters, or by the metadata of the
+        test run. By default, the latest approved guideline of the
+        'platform' target is selected.
+        For example:
+            /v1/results/<test_id>/view?guideline=2017.09.json&target=compute
+        Product versions the test run can be associated with are listed
+        for owners and Foundation admins.
+        """
+        user_role = api_utils.get_user_role(test_id)
+        test_info = _get_test_info(test_id, user_role)
+        meta = test_info['meta']
+        target = (pecan.request.GET.get(const.TARGET) or
+                  meta.get(const.TARGET) or 'platform')
+
+        g = guidelines.Guidelines()
+        guideline_list = g.get_guideline_list()
+        if guideline_list is None:
+            pecan.abort(500, 'The server was unable to get a list of '
+                             'guidelines from the external source.')
+        program = 'powered' if target in compliance.POWERED_TARGETS \
+            else target
+        if program not in guideline_list:
+            raise api_exc.ParseInputsError('Invalid target: %s' % target)
+        program_guidelines = sorted(guideline_list[program],
+                                    key=lambda gl: gl['name'], reverse=True)
+
+        requested = pecan.request.GET.get(const.GUIDELINE)
+        name = requested or meta.get(const.GUIDELINE)
+        selected = [gl for gl in program_guidelines
+                    if name in (gl['name'], gl['file'])]
+        if requested and not selected:
+            pecan.abort(404, 'Guideline %s not found.' % requested)
+        if not selected:
+            # The latest approved guideline is preferred over the 'next'
+            # draft, which is only selected when there is nothing else.
+            approved = [gl for gl in program_guidelines
+                        if gl['name'].split('.')[0] != 'next']
+            selected = approved[:1] or program_guidelines[:1]
+
+        view = {'result': test_info,
+                'guidelines': program_guidelines,
+                'guideline': None,
+                'target': target,
+                'report': None,
+                'product_versions': None}
+        if selected:
+            guideline_file = selected[0]['file']
+            guideline_json = g.get_guideline_contents(guideline_file)
+            if not guideline_json:
+                pecan.abort(500, 'The server was unable to get the JSON '
+                                 'content for the specified guideline '
+                                 'file.')
+            view['guideline'] = dict(selected[0],
+                                     **_get_guideline_info(guideline_json))
+            try:
+                view['report'] = compliance.get_compliance_report(
+                    guideline_json,
+                    g.get_guideline_digest(guideline_file, guideline_json),
+                    target, set(test_info['results']))
+            except KeyError:
+                raise api_exc.ParseInputsError(
+                    'Target %s is not defined in guideline %s.' %
+                    (target, guideline_file))
+
+        product_version = test_info.get('product_version')
+        if product_version and \
+                user_role in (const.ROLE_FOUNDATION, const.ROLE_OWNER):
+            view['product_versions'] = db.get_product_versions(
+                product_version['product_id'],
+                allowed_keys=['id', 'version', 'cpid'])
+
+        if api_utils.check_etag(api_utils.get_etag(view)):
+            return None
+        return view
+
+
+class EligibilityController(rest.RestController):
+    """/v1/results/<test_id>/eligibility handler."""
+
+    @pecan.expose('json')
+    @api_utils.check_permissions(level=const.ROLE_USER)
+    def get(self, test_id):
+        """Get guidelines and targets which the test run satisfies.
+
+        The test run is evaluated against every target of every powered
+        and add-on guideline. The response lists the passed guideline and
+        target combinations, and the number of missing required tests for
+        every combination.
+        """
+        db.get_test_result(test_id, allowed_keys=['id'])
+        return compliance.get_eligibility(test_id)
+
+
 class ResultsController(validation.BaseRestControllerWithValidation):
     """/v1/results handler."""
 
     __validator__ = validators.TestResultValidator
 
+    _custom_actions = {
+        "schema": ["GET"],
+        "test_names": ["GET"],
+        "compare": ["GET"],
+    }
+
     meta = MetadataController()
+    eligibility = EligibilityController()
+    view = ViewController()
 
     def _check_authentication(self):
         x_public_key = pecan.request.headers.get('X-Public-Key')
         if x_public_key:
-            public_key = x_public_key.strip().split()[1]
-            stored_public_key = db.get_pubkey(public_key)
-            if not stored_public_key:
+            # The key was already looked up while validating the signature.
+            stored_public_key = api_utils.get_upload_key(x_public_key)
+            if not stored_public_key.openid:
                 pecan.abort(401, 'User with specified key not found. '
                                  'Please log into the RefStack server to '
                                  'upload your key.')
@@ -124,17 +326,15 @@ class ResultsController(validation.BaseRestControllerWithValidation):
 
     def _auto_version_associate(self, test, test_, pubkey):
         if test.get('cpid'):
-            version = db.get_product_version_by_cpid(
-                test['cpid'], allowed_keys=['id', 'product_id'])
+            versions = db.get_product_version_admins_by_cpid(test['cpid'])
             # Only auto-associate if there is a single product version
             # with the given cpid.
-            if len(version) == 1:
-                is_foundation = api_utils.check_user_is_foundation_admin(
-                    pubkey.openid)
-                is_product_admin = api_utils.check_user_is_product_admin(
-                    version[0]['product_id'], pubkey.openid)
-                if is_foundation or is_product_admin:
-                    test_['product_version_id'] = version[0]['id']
+            if len(versions) == 1:
+                is_product_admin = pubkey.openid in versions[0]['admins']
+                if is_product_admin or \
+                        api_utils.check_user_is_foundation_admin(
+                            pubkey.openid):
+                    test_['product_version_id'] = versions[0]['id']
         return test_
 
     @pecan.expose('json')
@@ -142,33 +342,16 @@ class ResultsController(validation.BaseRestControllerWithValidation):
     def get_one(self, test_id):
         """Handler for getting item."""
         user_role = api_utils.get_user_role(test_id)
-        if user_role in (const.ROLE_FOUNDATION, const.ROLE_OWNER):
-            test_info = db.get_test_result(
-                test_id, allowed_keys=['id', 'cpid', 'created_at',
-                                       'duration_seconds', 'meta',
-                                       'product_version',
-                                       'verification_status']
-            )
-        else:
-            test_info = db.get_test_result(test_id)
-        test_list = db.get_test_results(test_id)
-        test_name_list = [test_dict['name'] for test_dict in test_list]
-        test_info.update({'results': test_name_list,
-                          'user_role': user_role})
-
-        if user_role not in (const.ROLE_FOUNDATION, const.ROLE_OWNER):
-            # Don't expose product information if product is not public.
-            if (test_info.get('product_version') and
-                    not test_info['product_version']
-                    ['product_info']['public']):
-
-                test_info['product_version'] = None
-
-            test_info['meta'] = {
-                k: v for k, v in test_info['meta'].items()
-                if k in MetadataController.rw_access_keys
-            }
-        return test_info
+        # Even verified test runs may be unverified by Foundation admins,
+        # so clients always revalidate them.
+        version = db.get_test_result_version(test_id)
+        etag = hashlib.sha1(('%s:%s:%s' % (
+            test_id, version['version'], user_role)).encode('utf-8'))
+        if api_utils.check_etag(etag.hexdigest(),
+                                last_modified=version['updated_at']):
+            return None
+
+        return _get_test_info(test_id, user_role)
 
     def store_item(self, test):
         """Handler for storing item. Should return new item id."""
@@ -199,6 +382,7 @@ class ResultsController(validation.BaseRestControllerWithValidation):
         pecan.response.status = 204
 
     @pecan.expose('json')
+    @api_utils.cache_anonymous_response(response_cache.RESULTS)
     def get(self):
         """Get information of all uploaded test results.
 
@@ -209,6 +393,14 @@ class ResultsController(validation.BaseRestControllerWithValidation):
             /v1/results?page=<page number>&cpid=1234.
         By default, page is set to page number 1,
         if the page parameter is not specified.
+        Test runs which passed a specific test can be found by the test
+        name or idempotent id:
+            /v1/results?passed_test=<test name or idempotent id>.
+        Counting all matching test runs for the total number of pages can
+        take longer than getting the page. With pagination=has_more, they
+        aren't counted, and the pagination tells whether there are more
+        pages instead. With pagination=approximate, the total number of
+        pages is given too, from a count which may be a few minutes old.
         """
         expected_input_params = [
             const.START_DATE,
@@ -216,7 +408,8 @@ class ResultsController(validation.BaseRestControllerWithValidation):
             const.CPID,
             const.SIGNED,
             const.VERIFICATION_STATUS,
-            const.PRODUCT_ID
+            const.PRODUCT_ID,
+            const.PASSED_TEST
         ]
 
         filters = api_utils.parse_input_params(expected_input_params)
@@ -231,14 +424,38 @@ class ResultsController(validation.BaseRestControllerWithValidation):
             elif not product['public']:
                 pecan.abort(403, 'Forbidden.')
 
-        records_count = db.get_test_result_records_count(filters)
-        page_number, total_pages_number = \
-            api_utils.get_page_number(records_count)
+        pagination = pecan.request.GET.get(const.PAGINATION,
+                                           const.PAGINATION_EXACT)
+        if pagination == const.PAGINATION_EXACT:
+            records_count = db.get_test_result_records_count(filters)
+            page_number, total_pages_number = \
+                api_utils.get_page_number(records_count)
+        elif pagination in (const.PAGINATION_HAS_MORE,
+                            const.PAGINATION_APPROXIMATE):
+            page_number = api_utils.get_requested_page_number()
+        else:
+            raise api_exc.ParseInputsError(
+                'Invalid pagination: %s' % pagination)
 
         try:
             per_page = CONF.api.results_per_page
-            results = db.get_test_result_records(
-                page_number, per_page, filters)
+            if pagination == const.PAGINATION_EXACT:
+                results = db.get_test_result_records(
+                    page_number, per_page, filters)
+                page_info = {'current_page': page_number,
+                             'total_pages': total_pages_number}
+            else:
+                # An extra record tells whether there is a next page.
+                results = db.get_test_result_records(
+                    page_number, per_page, filters, limit=per_page + 1)
+                page_info = {'current_page': page_number,
+                             'has_more': len(results) > per_page}
+                results = results[:per_page]
+                if pagination == const.PAGINATION_APPROXIMATE:
+                    records_count = \
+                        db.get_approximate_test_result_records_count(filters)
+                    page_info['approximate_total_pages'] = \
+                        (records_count + per_page - 1) // per_page
             is_foundation = api_utils.check_user_is_foundation_admin()
             for result in results:
 
@@ -261,10 +478,7 @@ class ResultsController(validation.BaseRestControllerWithValidation):
                 ) % result['id']})
 
             page = {'results': results,
-                    'pagination': {
-                        'current_page': page_number,
-                        'total_pages': total_pages_number
-                    }}
+                    'pagination': page_info}
         except Exception as ex:
             LOG.debug('An error occurred during '
                       'operation with database: %s' % str(ex))
@@ -272,6 +486,60 @@ class ResultsController(validation.BaseRestControllerWithValidation):
 
         return page
 
+    @pecan.expose('json')
+    def test_names(self):
+        """Get names of passed tests which start with the given prefix.
+
+        For example:
+            /v1/results/test_names?prefix=tempest.api.compute.servers
+        At most 'results_per_page' names are returned in alphabetical order.
+        Only test runs listed by /v1/results are searched, and signed test
+        runs of the user with signed=true.
+        """
+        filters = api_utils.parse_input_params([const.SIGNED])
+        if (const.SIGNED not in filters and
+                api_utils.check_user_is_foundation_admin()):
+            filters[const.ALL_PRODUCT_TESTS] = True
+        prefix = pecan.request.GET.get(const.PREFIX, '')
+        return {'test_names': db.get_test_names(
+            prefix, CONF.api.results_per_page, filters=filters)}
+
+    @pecan.expose('json')
+    def compare(self):
+        """Compare passed tests of several test runs.
+
+        For example:
+            /v1/results/compare?ids=<test id>,<test id>,<test id>
+        Test runs are compared in the given order. The response contains
+        the tests passed by all of the test runs, the tests passed by only
+        one of them, and the tests gained or lost between each pair of
+        consecutive test runs. The response is streamed, so any number of
+        test runs can be compared.
+        """
+        test_ids = [test_id.strip() for test_id in
+                    pecan.request.GET.get(const.IDS, '').split(',')
+                    if test_id.strip()]
+        if len(test_ids) < 2:
+            raise api_exc.ParseInputsError(
+                'At least two test run ids are required for comparison.')
+        if len(set(test_ids)) != len(test_ids):
+            raise api_exc.ParseInputsError(
+                'Test run ids for comparison must be unique.')
+        for test_id in test_ids:
+            if not validators.is_uuid(test_id):
+                raise api_exc.ParseInputsError(
+                    'Invalid test run id: %s' % test_id)
+            # Make sure the test run exists before checking permissions.
+            db.get_test_result(test_id, allowed_keys=['id'])
+            api_utils.enforce_permissions(test_id, const.ROLE_USER)
+
+        response = pecan.response
+        response.content_type = 'application/json'
+        response.charset = 'utf-8'
+        response.app_iter = compare_test_results(test_ids,
+                                                 db.get_test_results_by_name)
+        return response
+
     @api_utils.check_permissions(level=const.ROLE_OWNER)
     @pecan.expose('json')
     def put(self, test_id, **kw):
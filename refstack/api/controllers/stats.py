@@ -0,0 +1,83 @@
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Statistics controller."""
+
+import pecan
+from pecan import rest
+
+from refstack import db
+from refstack.api import constants as const
+from refstack.api import guidelines
+from refstack.api import http_client
+from refstack.api import response_cache
+from refstack.api import utils as api_utils
+
+
+class StatsController(rest.RestController):
+    """/v1/stats handler."""
+
+    _custom_actions = {
+        "capabilities": ["GET"],
+        "guidelines": ["GET"],
+        "http": ["GET"],
+        "responses": ["GET"],
+    }
+
+    @pecan.expose('json')
+    def capabilities(self):
+        """Get pass rates of guideline capabilities across shared runs.
+
+        For example:
+            /v1/stats/capabilities?guideline=2017.09.json
+        Statistics are computed periodically or with
+        'refstack-manage update-capability-stats'.
+        """
+        guideline = pecan.request.GET.get(const.GUIDELINE)
+        stats = db.get_capability_stats(guideline)
+        for item in stats:
+            item['pass_rate'] = (float(item['pass_count']) / item['run_count']
+                                 if item['run_count'] else None)
+        return {'capabilities': stats}
+
+    @pecan.expose('json')
+    def guidelines(self):
+        """Get metrics of background guideline refreshes of this process.
+
+        Only foundation admins can see the metrics.
+        """
+        if not api_utils.check_user_is_foundation_admin():
+            pecan.abort(403, 'Forbidden.')
+        return guidelines.get_refresh_metrics()
+
+    @pecan.expose('json')
+    def http(self):
+        """Get metrics of outbound HTTP requests of this API process.
+
+        Only foundation admins can see the metrics.
+        """
+        if not api_utils.check_user_is_foundation_admin():
+            pecan.abort(403, 'Forbidden.')
+        return {'targets': http_client.get_metrics()}
+
+    @pecan.expose('json')
+    def responses(self):
+        """Get hit ratios of the anonymous list page cache of this process.
+
+        Only foundation admins can see the metrics.
+        """
+        if not api_utils.check_user_is_foundation_admin():
+            pecan.abort(403, 'Forbidden.')
+        return {'endpoints': response_cache.get_metrics()}
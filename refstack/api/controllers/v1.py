@@ -19,6 +19,7 @@ from refstack.api.controllers import auth
 from refstack.api.controllers import guidelines
 from refstack.api.controllers import products
 from refstack.api.controllers import results
+from refstack.api.controllers import stats
 from refstack.api.controllers import user
 from refstack.api.controllers import vendors
 
@@ -32,3 +33,4 @@ class V1Controller(object):
     profile = user.ProfileController()
     products = products.ProductsController()
     vendors = vendors.VendorsController()
+    stats = stats.StatsController()
@@ -15,6 +15,7 @@
 """Vendors controller."""
 
 import base64
+import hashlib
 import json
 import six
 
@@ -28,6 +29,7 @@ from pecan.secure import secure
 from refstack.api import constants as const
 from refstack.api.controllers import validation
 from refstack.api import exceptions as api_exc
+from refstack.api import response_cache
 from refstack.api import utils as api_utils
 from refstack.api import validators
 from refstack import db
@@ -87,10 +89,72 @@ class UsersController(rest.RestController):
         pecan.response.status = 204
 
 
+class DashboardController(rest.RestController):
+    """/v1/vendors/<vendor_id>/dashboard handler."""
+
+    @pecan.expose('json')
+    def get(self, vendor_id):
+        """Get the vendor with its users, products and product versions.
+
+        Every product version comes with its latest verified or shared
+        test run. Users and private products are only listed for
+        Foundation and vendor admins.
+        """
+        is_admin = (api_utils.check_user_is_foundation_admin()
+                    or api_utils.check_user_is_vendor_admin(vendor_id))
+        allowed_keys = None
+        if not is_admin:
+            allowed_keys = ['id', 'type', 'name', 'description']
+        vendor = db.get_organization(vendor_id, allowed_keys=allowed_keys)
+
+        allowed_types = [const.FOUNDATION, const.OFFICIAL_VENDOR]
+        if not is_admin and vendor['type'] not in allowed_types:
+            pecan.abort(403, 'Forbidden.')
+        version = db.get_organization_version(vendor_id)
+        etag = hashlib.sha1(('%s:%s:%s' % (
+            vendor_id, version['version'], is_admin)).encode('utf-8'))
+        if api_utils.check_etag(etag.hexdigest(),
+                                last_modified=version['updated_at']):
+            return None
+        vendor['can_manage'] = is_admin
+
+        filters = {'organization_id': vendor_id}
+        if not is_admin:
+            filters['public'] = True
+        products = db.get_products(
+            allowed_keys=['id', 'name', 'description', 'product_ref_id',
+                          'type', 'product_type', 'public',
+                          'organization_id'],
+            filters=filters)
+        products.sort(key=lambda x: x['name'])
+        products_by_id = {}
+        for product in products:
+            product['can_manage'] = is_admin
+            product['versions'] = []
+            products_by_id[product['id']] = product
+
+        versions = db.get_product_versions_by_products(
+            list(products_by_id),
+            allowed_keys=['id', 'product_id', 'version', 'cpid'])
+        latest_results = db.get_latest_test_results_by_versions(
+            [version['id'] for version in versions])
+        for version in versions:
+            version['latest_result'] = latest_results.get(version['id'])
+            products_by_id[version['product_id']]['versions'].append(version)
+
+        users = None
+        if is_admin:
+            users = list(six.itervalues(
+                db.get_organization_users(vendor_id)))
+
+        return {'vendor': vendor, 'users': users, 'products': products}
+
+
 class VendorsController(validation.BaseRestControllerWithValidation):
     """/v1/vendors handler."""
 
     users = UsersController()
+    dashboard = DashboardController()
 
     __validator__ = validators.VendorValidator
 
@@ -139,6 +203,7 @@ class VendorsController(validation.BaseRestControllerWithValidation):
         return vendor
 
     @pecan.expose('json')
+    @api_utils.cache_anonymous_response(response_cache.VENDORS)
     def get(self):
         """Get information of vendors."""
         allowed_keys = ['id', 'type', 'name', 'description']
@@ -182,12 +247,19 @@ class VendorsController(validation.BaseRestControllerWithValidation):
         if not is_admin:
             allowed_keys = ['id', 'type', 'name', 'description']
 
-        vendor = db.get_organization(vendor_id, allowed_keys=allowed_keys)
+        vendor = db.get_organization(vendor_id)
 
         allowed_types = [const.FOUNDATION, const.OFFICIAL_VENDOR]
         if not is_admin and vendor['type'] not in allowed_types:
             pecan.abort(403, 'Forbidden.')
 
+        etag = hashlib.sha1(('%s:%s:%s:%s' % (
+            vendor_id, vendor['created_at'], vendor['updated_at'],
+            is_admin)).encode('utf-8'))
+        if api_utils.check_etag(etag.hexdigest()):
+            return None
+        if allowed_keys:
+            vendor = {key: vendor[key] for key in allowed_keys}
         vendor['can_manage'] = is_admin
         return vendor
 
@@ -0,0 +1,206 @@
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Local mirror of the Interop WG guidelines repository.
+
+A mirror is either a directory with a checkout of the openstack/interop
+repository, or a tarball of it. Guideline files of the mirror are loaded
+into memory once, and loaded again only when the modification time of the
+mirror changes, e.g. after 'refstack-manage sync-guidelines'.
+"""
+
+import io
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+
+from oslo_log import log
+
+from refstack.api import http_client
+
+LOG = log.getLogger(__name__)
+
+# Paths of guideline files relative to the root of the repository.
+_GUIDELINE_PATH_REGEX = re.compile(
+    r'^(add-ons/)?[^/]*([0-9]{4}\.[0-9]{2}|next)\.json$')
+
+_ARCHIVE_SUFFIXES = ('.tar', '.tar.gz', '.tgz')
+
+_lock = threading.Lock()
+_loaded = {'key': None, 'files': None}
+
+
+def is_archive(path):
+    """Check whether a mirror path is a tarball."""
+    return path.endswith(_ARCHIVE_SUFFIXES)
+
+
+def _get_key(path):
+    """Get a key which changes whenever the mirror changes."""
+    real_path = os.path.realpath(path)
+    if is_archive(path):
+        stat = os.stat(real_path)
+        return real_path, stat.st_mtime, stat.st_size
+    # Adding, removing or replacing files changes the directory mtime.
+    addons_path = os.path.join(real_path, 'add-ons')
+    return (real_path, os.stat(real_path).st_mtime,
+            os.stat(addons_path).st_mtime
+            if os.path.isdir(addons_path) else None)
+
+
+def _strip_prefix(names):
+    """Get the common top-level directory of archive members, if any.
+
+    Archives of GitHub and other code hosting sites put all files into a
+    directory named after the repository and revision.
+    """
+    prefixes = set(name.split('/', 1)[0] for name in names)
+    if len(prefixes) == 1 and all('/' in name for name in names):
+        return prefixes.pop() + '/'
+    return ''
+
+
+def _read_archive(fileobj=None, path=None):
+    """Read guideline files of a tarball.
+
+    Returns a dict with the contents of the files keyed by their paths
+    relative to the root of the repository.
+    """
+    with tarfile.open(name=path, fileobj=fileobj) as archive:
+        members = [member for member in archive.getmembers()
+                   if member.isfile()]
+        prefix = _strip_prefix([member.name for member in members])
+        files = {}
+        for member in members:
+            name = member.name[len(prefix):]
+            if member.name.startswith(prefix) and \
+                    _GUIDELINE_PATH_REGEX.match(name):
+                files[name] = archive.extractfile(member).read()
+        return files
+
+
+def _read_directory(path):
+    """Read guideline files of a directory.
+
+    Returns a dict with the contents of the files keyed by their paths
+    relative to the directory.
+    """
+    files = {}
+    for subdir in ('', 'add-ons'):
+        dir_path = os.path.join(path, subdir)
+        if not os.path.isdir(dir_path):
+            continue
+        for file_name in os.listdir(dir_path):
+            name = '/'.join((subdir, file_name)) if subdir else file_name
+            if _GUIDELINE_PATH_REGEX.match(name):
+                with open(os.path.join(dir_path, file_name), 'rb') as f:
+                    files[name] = f.read()
+    return files
+
+
+def load(path):
+    """Get the parsed guideline files of a mirror.
+
+    Returns a dict with the guideline contents keyed by their paths
+    relative to the root of the repository. The dict and the guidelines
+    are shared and must not be modified. Raises an EnvironmentError or a
+    tarfile.TarError if the mirror can't be read.
+    """
+    key = _get_key(path)
+    with _lock:
+        if _loaded['key'] == key:
+            return _loaded['files']
+
+    raw_files = (_read_archive(path=key[0]) if is_archive(path)
+                 else _read_directory(key[0]))
+    files = {}
+    for name, content in raw_files.items():
+        try:
+            files[name] = json.loads(content.decode('utf-8'))
+        except ValueError:
+            LOG.warning('Skipping malformed guideline %s of mirror %s.' %
+                        (name, path))
+    LOG.info('Loaded %d guidelines from mirror %s.' % (len(files), path))
+
+    with _lock:
+        _loaded['key'] = key
+        _loaded['files'] = files
+    return files
+
+
+def list_files(files):
+    """List guideline files in the format of the GitHub contents API."""
+    listing = []
+    for name in sorted(files):
+        if name.startswith('add-ons/'):
+            listing.append({'name': name.split('/', 1)[1], 'path': name,
+                            'type': 'file'})
+        else:
+            listing.append({'name': name, 'path': name, 'type': 'file'})
+    return listing
+
+
+def sync(path, source_url):
+    """Replace a mirror with a fresh tarball of the guidelines repository.
+
+    The mirror is replaced atomically, so API processes read either the
+    old or the new mirror. A directory mirror must be a symbolic link
+    managed by this function: the tarball is extracted into a new sibling
+    directory, and the link is switched to it.
+    Returns the number of guideline files in the new mirror.
+    """
+    response = http_client.get(source_url, target='github')
+    response.raise_for_status()
+    files = _read_archive(fileobj=io.BytesIO(response.content))
+    if not files:
+        raise ValueError('No guidelines found in %s' % source_url)
+
+    path = os.path.abspath(path)
+    parent, base_name = os.path.split(path)
+    if is_archive(path):
+        fd, tmp_path = tempfile.mkstemp(prefix='.' + base_name, dir=parent)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(response.content)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+        return len(files)
+
+    if os.path.isdir(path) and not os.path.islink(path):
+        raise ValueError('%s is a directory. Directory mirrors updated with '
+                         'sync-guidelines must be symbolic links.' % path)
+    old_dir = os.path.realpath(path) if os.path.islink(path) else None
+    new_dir = tempfile.mkdtemp(
+        prefix='%s.%s.' % (base_name, time.strftime('%Y%m%d%H%M%S')),
+        dir=parent)
+    os.chmod(new_dir, 0o755)
+    os.mkdir(os.path.join(new_dir, 'add-ons'))
+    for name, content in files.items():
+        with open(os.path.join(new_dir, *name.split('/')), 'wb') as f:
+            f.write(content)
+
+    tmp_link = os.path.join(parent, '.%s.tmp' % base_name)
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(new_dir, tmp_link)
+    os.rename(tmp_link, path)
+    if old_dir and os.path.dirname(old_dir) == parent and \
+            os.path.basename(old_dir).startswith(base_name + '.'):
+        shutil.rmtree(old_dir, ignore_errors=True)
+    return len(files)
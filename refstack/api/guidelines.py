@@ -15,21 +15,65 @@
 
 """Class for retrieving Interop WG guideline information."""
 
+from concurrent import futures
+import hashlib
 import itertools
+import json
 from oslo_config import cfg
 from oslo_log import log
-from operator import itemgetter
 import re
 import requests
-import requests_cache
+import tarfile
+import threading
+import time
+
+from refstack.api import guideline_mirror
+from refstack.api import http_client
+from refstack import cache
 
 CONF = cfg.CONF
 LOG = log.getLogger(__name__)
 
-# Cached requests will expire after 12 hours.
-requests_cache.install_cache(cache_name='github_cache',
-                             backend='memory',
-                             expire_after=43200)
+# Number of guideline sources listed and guideline files fetched at once.
+_FETCH_WORKERS = 8
+
+# Maximum number of cached guideline slices.
+_MAX_CACHED_SLICES = 256
+
+# Maximum number of cached test sets of guideline targets.
+_MAX_CACHED_TEST_SETS = 256
+
+_lock = threading.Lock()
+# Threads listing guideline sources and fetching guideline files.
+_executor = futures.ThreadPoolExecutor(max_workers=_FETCH_WORKERS)
+# Guidelines of the last background refresh, replaced as a whole.
+_snapshot = {'key': None, 'list': None, 'skipped_sources': [],
+             'contents': {}, 'digests': {}}
+_refresh_metrics = {'refreshes': 0,
+                    'failures': 0,
+                    'consecutive_failures': 0,
+                    'last_attempt': None,
+                    'last_refresh': None,
+                    'last_duration': None,
+                    'last_error': None,
+                    'guideline_count': 0,
+                    'stale_count': 0}
+_slices = cache.TTLCache(maxsize=_MAX_CACHED_SLICES)
+_test_sets = cache.TTLCache(maxsize=_MAX_CACHED_TEST_SETS)
+
+
+def get_digest(guideline_json):
+    """Get a digest of guideline contents."""
+    return hashlib.sha1(json.dumps(guideline_json, sort_keys=True)
+                        .encode('utf-8')).hexdigest()
+
+
+def _get_snapshot(key):
+    """Get the refreshed guidelines, if they are of the given sources."""
+    snapshot = _snapshot
+    if snapshot['key'] == key:
+        return snapshot
+    return None
 
 
 class Guidelines:
@@ -38,13 +82,16 @@ class Guidelines:
     def __init__(self,
                  repo_url=None,
                  raw_url=None,
-                 additional_capability_urls=None):
+                 additional_capability_urls=None,
+                 mirror_path=None):
         """Initialize class with needed URLs.
 
         The URL for the guidelines repository is specified with 'repo_url'.
         The URL for where raw files are served is specified with 'raw_url'.
-        These values will default to the values specified in the RefStack
-        config file.
+        The path of a local mirror of the repository, which is used
+        instead of the URLs if it can be read, is specified with
+        'mirror_path'. These values will default to the values specified
+        in the RefStack config file.
         """
         self.guideline_sources = list()
         if additional_capability_urls:
@@ -63,49 +110,129 @@ class Guidelines:
             self.raw_url = raw_url
         else:
             self.raw_url = CONF.api.github_raw_base_url
+        if mirror_path:
+            self.mirror_path = mirror_path
+        else:
+            self.mirror_path = CONF.api.guidelines_mirror_path
+        # Sources left out of the last guideline list, because they didn't
+        # respond in time.
+        self.skipped_sources = []
+
+    def _get_snapshot(self):
+        """Return the refreshed guidelines of the sources of this instance.
+
+        A readable local mirror is served directly instead, so changes of
+        the mirror show up without waiting for the next refresh.
+        """
+        if self._load_mirror() is not None:
+            return None
+        return _get_snapshot(self._source_key())
+
+    def _load_mirror(self):
+        """Return guideline files of the local mirror, if there is one."""
+        if not self.mirror_path:
+            return None
+        try:
+            return guideline_mirror.load(self.mirror_path)
+        except (EnvironmentError, tarfile.TarError) as e:
+            LOG.warning('An error occurred trying to read the guidelines '
+                        'mirror %s, falling back to %s: %s' %
+                        (self.mirror_path, self.repo_url, e))
+            return None
+
+    def _list_source(self, src_url):
+        """Return JSON guideline files listed by a guideline source."""
+        try:
+            resp = http_client.get(src_url, target='github')
+
+            LOG.debug("Response Status: %s" % resp.status_code)
+            if resp.status_code == 200:
+                regex = re.compile('([0-9]{4}\.[0-9]{2}|next)\.json')
+                return [rfile for rfile in resp.json()
+                        if rfile["type"] == "file" and
+                        regex.search(rfile["name"])]
+            else:
+                LOG.warning('Guidelines repo URL (%s) returned '
+                            'non-success HTTP code: %s' %
+                            (src_url, resp.status_code))
+
+        except requests.exceptions.RequestException as e:
+            LOG.warning('An error occurred trying to get repository '
+                        'contents through %s: %s' % (src_url, e))
+        return []
+
+    def _list_sources(self):
+        """Return the listings of all guideline sources, in order.
+
+        All guideline sources are listed concurrently. Sources which don't
+        respond within the guideline_sources_timeout are left out.
+        Returns the listings and the URLs of the sources left out.
+        """
+        listings = [_executor.submit(self._list_source, src_url)
+                    for src_url in self.guideline_sources]
+        done, _not_done = futures.wait(
+            listings, timeout=CONF.api.guideline_sources_timeout)
+
+        results = []
+        skipped_sources = []
+        for src_url, listing in zip(self.guideline_sources, listings):
+            if listing in done:
+                results.append(listing.result())
+            else:
+                LOG.warning('Guideline source %s did not respond within %s '
+                            'seconds, its guidelines are left out.' %
+                            (src_url, CONF.api.guideline_sources_timeout))
+                skipped_sources.append(src_url)
+        return results, skipped_sources
+
+    def _source_key(self):
+        """Return the key of the guideline sources of this instance."""
+        return (tuple(self.guideline_sources), self.raw_url,
+                self.mirror_path)
 
     def get_guideline_list(self):
         """Return a list of a guideline files.
 
         The repository url specificed in class instantiation is checked
         for a list of JSON guideline files. A list of these is returned.
+        If a local mirror is configured, its files are listed instead.
+        If the guidelines are refreshed in the background, the list of
+        the last refresh is returned.
+        Sources left out of the list are given by 'skipped_sources'.
         """
+        snapshot = self._get_snapshot()
+        if snapshot is not None:
+            self.skipped_sources = snapshot['skipped_sources']
+            return snapshot['list']
+        return self._fetch_guideline_list()
+
+    def _fetch_guideline_list(self):
+        """Return a list of guideline files fetched from the sources."""
         capability_files = {}
         capability_list = []
         powered_files = []
         addon_files = []
-        for src_url in self.guideline_sources:
-            try:
-                resp = requests.get(src_url)
-
-                LOG.debug("Response Status: %s / Used Requests Cache: %s" %
-                          (resp.status_code,
-                           getattr(resp, 'from_cache', False)))
-                if resp.status_code == 200:
-                    regex = re.compile('([0-9]{4}\.[0-9]{2}|next)\.json')
-                    for rfile in resp.json():
-                        if rfile["type"] == "file" and \
-                                regex.search(rfile["name"]):
-                            if 'add-ons' in rfile['path'] and \
-                                    rfile[
-                                        'name'] not in map(itemgetter('name'),
-                                                           addon_files):
-                                file_dict = {'name': rfile['name']}
-                                addon_files.append(file_dict)
-                            elif 'add-ons' not in rfile['path'] and \
-                                rfile['name'] not in map(itemgetter('name'),
-                                                         powered_files):
-                                file_dict = {'name': rfile['name'],
-                                             'file': rfile['path']}
-                                powered_files.append(file_dict)
-                else:
-                    LOG.warning('Guidelines repo URL (%s) returned '
-                                'non-success HTTP code: %s' %
-                                (src_url, resp.status_code))
+        addon_names = set()
+        powered_names = set()
 
-            except requests.exceptions.RequestException as e:
-                LOG.warning('An error occurred trying to get repository '
-                            'contents through %s: %s' % (src_url, e))
+        mirror_files = self._load_mirror()
+        if mirror_files is not None:
+            listings = [guideline_mirror.list_files(mirror_files)]
+            self.skipped_sources = []
+        else:
+            listings, self.skipped_sources = self._list_sources()
+
+        # Sources are merged in order, so files of earlier sources win.
+        for listing in listings:
+            for rfile in listing:
+                if 'add-ons' in rfile['path']:
+                    if rfile['name'] not in addon_names:
+                        addon_names.add(rfile['name'])
+                        addon_files.append({'name': rfile['name']})
+                elif rfile['name'] not in powered_names:
+                    powered_names.add(rfile['name'])
+                    powered_files.append({'name': rfile['name'],
+                                          'file': rfile['path']})
         for k, v in itertools.groupby(addon_files,
                                       key=lambda x: x['name'].split('.')[0]):
             values = [{'name': x['name'].split('.', 1)[1], 'file': x['name']}
@@ -115,24 +242,51 @@ class Guidelines:
         capability_files = dict((x, y) for x, y in capability_list)
         return capability_files
 
-    def get_guideline_contents(self, gl_file):
-        """Get contents for a given guideline path."""
+    def _get_guideline_path(self, gl_file):
+        """Get the path of a guideline file in the repository."""
         if '.json' not in gl_file:
             gl_file = '.'.join((gl_file, 'json'))
         regex = re.compile("[a-z]*\.([0-9]{4}\.[0-9]{2}|next)\.json")
         if regex.search(gl_file):
-            guideline_path = 'add-ons/' + gl_file
+            return 'add-ons/' + gl_file
         else:
-            guideline_path = gl_file
+            return gl_file
+
+    def get_guideline_contents(self, gl_file):
+        """Get contents for a given guideline path."""
+        guideline_path = self._get_guideline_path(gl_file)
+        snapshot = self._get_snapshot()
+        if snapshot is not None and guideline_path in snapshot['contents']:
+            return snapshot['contents'][guideline_path]
+        return self._fetch_guideline_contents(guideline_path)
+
+    def get_guideline_digest(self, gl_file, guideline_json):
+        """Get a digest of the contents of a guideline file.
+
+        Digests of refreshed guidelines are computed once per refresh.
+        """
+        guideline_path = self._get_guideline_path(gl_file)
+        snapshot = _get_snapshot(self._source_key())
+        if snapshot is not None and \
+                snapshot['contents'].get(guideline_path) is guideline_json:
+            return snapshot['digests'][guideline_path]
+        return get_digest(guideline_json)
+
+    def _fetch_guideline_contents(self, guideline_path):
+        """Get contents of a guideline file fetched from the source."""
+        mirror_files = self._load_mirror()
+        if mirror_files is not None:
+            if guideline_path not in mirror_files:
+                LOG.warning('Guideline %s was not found in the guidelines '
+                            'mirror %s.' % (guideline_path, self.mirror_path))
+            return mirror_files.get(guideline_path)
 
         file_url = ''.join((self.raw_url.rstrip('/'),
                             '/', guideline_path))
         LOG.debug("file_url: %s" % (file_url))
         try:
-            response = requests.get(file_url)
-            LOG.debug("Response Status: %s / Used Requests Cache: %s" %
-                      (response.status_code,
-                       getattr(response, 'from_cache', False)))
+            response = http_client.get(file_url, target='github')
+            LOG.debug("Response Status: %s" % response.status_code)
             LOG.debug("Response body: %s" % str(response.text))
             if response.status_code == 200:
                 return response.json()
@@ -189,6 +343,61 @@ class Guidelines:
                     target_caps.update(capabilities)
         return list(target_caps)
 
+    def get_guideline_slice(self, guideline_json, digest, target=None,
+                            types=None, fields=None):
+        """Get the part of a guideline which is relevant to a client.
+
+        If a target or a list of capability statuses is given, only the
+        capabilities of the target ('platform' by default) with the given
+        statuses are kept. If a list of fields is given, only these
+        top-level fields of the guideline are kept. Slices are cached
+        under the digest of the guideline and the parameters, and must not
+        be modified. Raises a KeyError if the target is not defined in the
+        guideline.
+        """
+        key = (digest, target,
+               tuple(sorted(types)) if types else None,
+               tuple(sorted(fields)) if fields else None)
+        guideline_slice = _slices.get(key)
+        if guideline_slice is not None:
+            return guideline_slice
+
+        guideline_slice = dict(guideline_json)
+        if target or types:
+            target_caps = self.get_target_capabilities(
+                guideline_json, types, target or 'platform')
+            guideline_slice['capabilities'] = dict(
+                (cap, details)
+                for cap, details in guideline_json['capabilities'].items()
+                if cap in target_caps)
+        if fields:
+            guideline_slice = dict((field, value)
+                                   for field, value in guideline_slice.items()
+                                   if field in fields)
+        _slices.set(key, guideline_slice)
+        return guideline_slice
+
+    def get_target_test_set(self, guideline_json, digest, target='platform',
+                            types=None, alias=True, show_flagged=True):
+        """Get the set of test strings of a guideline target.
+
+        The parameters are those of get_target_capabilities and
+        get_test_list. Test sets are cached under the digest of the
+        guideline and the parameters, so test lists of several targets can
+        be merged with set operations. Raises a KeyError if the target is
+        not defined in the guideline.
+        """
+        key = (digest, target, tuple(sorted(types)) if types else None,
+               alias, show_flagged)
+        test_set = _test_sets.get(key)
+        if test_set is None:
+            target_caps = self.get_target_capabilities(guideline_json, types,
+                                                       target)
+            test_set = frozenset(self.get_test_list(
+                guideline_json, target_caps, alias, show_flagged))
+            _test_sets.set(key, test_set)
+        return test_set
+
     def get_test_list(self, guideline_json, capabilities=[],
                       alias=True, show_flagged=True):
         """Generate a test list based on input.
@@ -243,3 +452,97 @@ class Guidelines:
                                 test_list.append(test_str)
         test_list.sort()
         return test_list
+
+
+def refresh_guidelines():
+    """Fetch the list and contents of all guidelines, and swap them in.
+
+    The guidelines are fetched from the sources configured in the config
+    file. Until the next refresh, Guidelines instances using these sources
+    serve the fetched guidelines without any requests. A guideline file
+    which could not be fetched keeps the contents of the previous refresh.
+    Returns the number of guideline files.
+    """
+    global _snapshot
+    guidelines_obj = Guidelines()
+    key = guidelines_obj._source_key()
+    start = time.time()
+    with _lock:
+        _refresh_metrics['last_attempt'] = start
+    try:
+        guideline_list = guidelines_obj._fetch_guideline_list()
+        paths = sorted(set(guidelines_obj._get_guideline_path(gl['file'])
+                           for files in guideline_list.values()
+                           for gl in files))
+        if not paths:
+            raise ValueError('No guidelines were listed by the sources.')
+        fetched = list(_executor.map(
+            guidelines_obj._fetch_guideline_contents, paths))
+    except Exception as e:
+        with _lock:
+            _refresh_metrics['failures'] += 1
+            _refresh_metrics['consecutive_failures'] += 1
+            _refresh_metrics['last_error'] = str(e)
+        raise
+
+    previous = _get_snapshot(key)
+    contents = {}
+    digests = {}
+    stale_count = 0
+    for path, guideline_json in zip(paths, fetched):
+        if guideline_json is None and previous is not None:
+            guideline_json = previous['contents'].get(path)
+            stale_count += 1
+        if guideline_json is not None:
+            contents[path] = guideline_json
+            digests[path] = get_digest(guideline_json)
+
+    with _lock:
+        _snapshot = {'key': key, 'list': guideline_list,
+                     'skipped_sources': guidelines_obj.skipped_sources,
+                     'contents': contents, 'digests': digests}
+        _refresh_metrics['refreshes'] += 1
+        _refresh_metrics['consecutive_failures'] = 0
+        _refresh_metrics['last_refresh'] = time.time()
+        _refresh_metrics['last_duration'] = time.time() - start
+        _refresh_metrics['last_error'] = None
+        _refresh_metrics['guideline_count'] = len(contents)
+        _refresh_metrics['stale_count'] = stale_count
+    LOG.info('Refreshed %d guidelines in %.2f seconds.' %
+             (len(contents), time.time() - start))
+    return len(contents)
+
+
+def get_refresh_metrics():
+    """Get counters and timings of background guideline refreshes.
+
+    'lag_seconds' is the age of the served guidelines.
+    """
+    with _lock:
+        metrics = dict(_refresh_metrics)
+    metrics['lag_seconds'] = (time.time() - metrics['last_refresh']
+                              if metrics['last_refresh'] else None)
+    return metrics
+
+
+def _refresh_guidelines_periodically(interval):
+    """Refresh guidelines now and every 'interval' seconds."""
+    while True:
+        try:
+            refresh_guidelines()
+        except Exception:
+            LOG.exception('Failed to refresh guidelines.')
+        time.sleep(interval)
+
+
+def start_guideline_refresh(interval):
+    """Start refreshing guidelines in a background thread.
+
+    :param interval: Number of seconds between refreshes.
+    """
+    thread = threading.Thread(target=_refresh_guidelines_periodically,
+                              args=(interval,),
+                              name='guideline-refresh')
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -0,0 +1,336 @@
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Shared client for outbound HTTP requests.
+
+Requests to external services, such as GitHub and the OpenID provider, go
+through a single pooled requests session. Every target service has its own
+timeout and circuit breaker: after several consecutive failures, requests
+to the target fail fast for a while, and the last successful response for
+the URL is served instead if there is one.
+"""
+
+import random
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log
+import requests
+from requests import adapters
+
+from refstack import cache
+
+HTTP_OPTS = [
+    cfg.IntOpt('http_pool_size',
+               default=10,
+               help='Maximum number of connections kept open to every '
+                    'host by the outbound HTTP client.'),
+    cfg.DictOpt('http_timeouts',
+                default={'github': '10', 'openid': '10'},
+                help='Timeouts in seconds of outbound HTTP requests for '
+                     'every target service. "github" is used to retrieve '
+                     'guidelines, "openid" to verify OpenID logins.'),
+    cfg.IntOpt('http_retries',
+               default=2,
+               help='Number of times a failed outbound GET request is '
+                    'retried.'),
+    cfg.IntOpt('http_circuit_failure_threshold',
+               default=5,
+               help='Number of consecutive failed outbound requests to a '
+                    'target service after which requests to the service '
+                    'fail fast, serving the last successful responses if '
+                    'possible.'),
+    cfg.IntOpt('http_circuit_reset_timeout',
+               default=60,
+               help='Number of seconds after which a request to a failing '
+                    'target service is tried again.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(HTTP_OPTS, group='api')
+
+LOG = log.getLogger(__name__)
+
+# Timeout in seconds of requests to targets without a configured timeout.
+_DEFAULT_TIMEOUT = 10
+
+# Maximum delay in seconds before the first retry. The maximum delay is
+# doubled for every further retry, and the actual delay is random.
+_RETRY_BACKOFF = 0.5
+
+# Maximum number of URLs with a kept last successful response.
+_MAX_STALE_RESPONSES = 256
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised when requests to a target service fail fast."""
+
+    pass
+
+
+class CircuitBreaker(object):
+    """Circuit breaker of a target service.
+
+    The circuit opens after 'failure_threshold' consecutive failures. Once
+    'reset_timeout' seconds passed, the circuit is half-open and a single
+    trial request is let through, which closes the circuit if it succeeds.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold, reset_timeout, timer=time.time):
+        """Init the closed circuit breaker."""
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timer = timer
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """Current state of the circuit."""
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.timer() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        """Check whether a request may be sent."""
+        with self._lock:
+            state = self.state
+            if state == self.HALF_OPEN:
+                # Keep other requests failing fast until the trial
+                # request completes.
+                self.opened_at = self.timer()
+                return True
+            return state == self.CLOSED
+
+    def record_success(self):
+        """Record a successful request."""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        """Record a failed request."""
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = self.timer()
+
+
+class HTTPClient(object):
+    """Pooled HTTP client with per-target timeouts and circuit breakers."""
+
+    def __init__(self, pool_size=10, timeouts=None, retries=2,
+                 failure_threshold=5, reset_timeout=60, timer=time.time,
+                 sleep=time.sleep):
+        """Init the client.
+
+        :param pool_size: Maximum number of connections to every host.
+        :param timeouts: Dict of timeouts in seconds keyed by target.
+        :param retries: Number of retries of failed GET requests.
+        :param failure_threshold: Number of consecutive failures after
+                                  which the circuit of a target opens.
+        :param reset_timeout: Number of seconds after which a request to
+                              a target with an open circuit is tried.
+        """
+        self.session = requests.Session()
+        adapter = adapters.HTTPAdapter(pool_connections=pool_size,
+                                       pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.timeouts = dict((target, float(timeout))
+                             for target, timeout in (timeouts or {}).items())
+        self.retries = retries
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timer = timer
+        self.sleep = sleep
+        self._breakers = {}
+        self._metrics = {}
+        self._rate_limit_resets = {}
+        self._stale = cache.TTLCache(maxsize=_MAX_STALE_RESPONSES)
+        self._lock = threading.Lock()
+
+    def _get_breaker(self, target):
+        with self._lock:
+            if target not in self._breakers:
+                self._breakers[target] = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout,
+                    timer=self.timer)
+            return self._breakers[target]
+
+    def _update_metrics(self, target, seconds=None, **counts):
+        with self._lock:
+            metrics = self._metrics.setdefault(target, {
+                'requests': 0, 'errors': 0, 'retries': 0, 'stale': 0,
+                'rejected': 0, 'total_seconds': 0.0, 'max_seconds': 0.0,
+                'rate_limit_remaining': None})
+            for key, count in counts.items():
+                metrics[key] += count
+            if seconds is not None:
+                metrics['requests'] += 1
+                metrics['total_seconds'] += seconds
+                metrics['max_seconds'] = max(metrics['max_seconds'], seconds)
+
+    def _check_rate_limit(self, target, response):
+        """Track GitHub style X-RateLimit-* headers of a response.
+
+        Returns True if the rate limit of the target is exhausted.
+        """
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        if remaining is None:
+            return False
+        try:
+            remaining = int(remaining)
+            reset = int(response.headers.get('X-RateLimit-Reset', 0))
+        except ValueError:
+            return False
+        with self._lock:
+            self._metrics.get(target, {})['rate_limit_remaining'] = remaining
+            if remaining > 0:
+                self._rate_limit_resets.pop(target, None)
+                return False
+            self._rate_limit_resets[target] = reset
+        LOG.warning('Rate limit of %(target)s exhausted until %(reset)s.',
+                    {'target': target, 'reset': reset})
+        return True
+
+    def _is_rate_limited(self, target):
+        with self._lock:
+            reset = self._rate_limit_resets.get(target)
+        return reset is not None and self.timer() < reset
+
+    def _fallback(self, method, url, target, error, response=None):
+        """Serve the last successful response of a failed request."""
+        stale = self._stale.get(url) if method == 'GET' else None
+        if stale is not None:
+            LOG.warning('Serving the last successful response of %(url)s: '
+                        '%(error)s', {'url': url, 'error': error})
+            self._update_metrics(target, stale=1)
+            return stale
+        if response is not None:
+            return response
+        raise error
+
+    def request(self, method, url, target, **kwargs):
+        """Send a request to a target service.
+
+        GET requests are retried with a random exponential backoff.
+        Returns the response, or the last successful response of the URL
+        if the target service is failing or rate limited. If there is no
+        such response, the error response is returned, or the
+        requests.exceptions.RequestException of the failure is raised.
+        """
+        kwargs.setdefault('timeout',
+                          self.timeouts.get(target, _DEFAULT_TIMEOUT))
+        breaker = self._get_breaker(target)
+        if self._is_rate_limited(target) or not breaker.allow():
+            self._update_metrics(target, rejected=1)
+            return self._fallback(method, url, target, CircuitOpenError(
+                'Requests to %s are suspended' % target))
+
+        attempts = 1 + self.retries if method == 'GET' else 1
+        response = None
+        for attempt in range(attempts):
+            if attempt:
+                self._update_metrics(target, retries=1)
+                self.sleep(random.uniform(
+                    0, _RETRY_BACKOFF * 2 ** (attempt - 1)))
+            start = self.timer()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                error = e
+                response = None
+                continue
+            finally:
+                self._update_metrics(target, self.timer() - start)
+
+            if self._check_rate_limit(target, response) and \
+                    response.status_code in (403, 429):
+                breaker.record_success()
+                return self._fallback(method, url, target, CircuitOpenError(
+                    'Rate limit of %s exhausted' % target), response)
+            if response.status_code < 500:
+                breaker.record_success()
+                if method == 'GET' and response.status_code == 200:
+                    self._stale.set(url, response)
+                return response
+            error = requests.exceptions.HTTPError(
+                '%s returned HTTP code %s' % (url, response.status_code),
+                response=response)
+
+        breaker.record_failure()
+        self._update_metrics(target, errors=1)
+        return self._fallback(method, url, target, error, response)
+
+    def get(self, url, target, **kwargs):
+        """Send a GET request to a target service."""
+        return self.request('GET', url, target, **kwargs)
+
+    def post(self, url, target, **kwargs):
+        """Send a POST request to a target service."""
+        return self.request('POST', url, target, **kwargs)
+
+    def get_metrics(self):
+        """Get request counters and latencies of every target service."""
+        with self._lock:
+            metrics = dict((target, dict(values))
+                           for target, values in self._metrics.items())
+        for target, values in metrics.items():
+            values['avg_seconds'] = (values['total_seconds'] /
+                                     values['requests']
+                                     if values['requests'] else None)
+            values['circuit'] = self._get_breaker(target).state
+        return metrics
+
+
+def get_client():
+    """Get the HTTP client shared by the process."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HTTPClient(
+                pool_size=CONF.api.http_pool_size,
+                timeouts=CONF.api.http_timeouts,
+                retries=CONF.api.http_retries,
+                failure_threshold=CONF.api.http_circuit_failure_threshold,
+                reset_timeout=CONF.api.http_circuit_reset_timeout)
+        return _client
+
+
+def get(url, target, **kwargs):
+    """Send a GET request to a target service with the shared client."""
+    return get_client().get(url, target, **kwargs)
+
+
+def post(url, target, **kwargs):
+    """Send a POST request to a target service with the shared client."""
+    return get_client().post(url, target, **kwargs)
+
+
+def get_metrics():
+    """Get metrics of the shared client."""
+    return get_client().get_metrics()
@@ -0,0 +1,259 @@
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Cache of list pages served to anonymous users.
+
+Anonymous users all get the same responses, so a list page is cached
+under the endpoint and the normalized query parameters for a few seconds.
+Every endpoint has a generation, which is part of the keys of its pages,
+and changes of the listed data switch to a new generation, so the pages
+cached so far aren't used anymore.
+
+With the "memory" backend every API process has its own cache, and
+changes made by other processes become visible once the pages expire.
+With the "file" backend, API processes on the same host share cached
+pages and generations through a directory.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from oslo_config import cfg
+from oslo_log import log
+
+from refstack import cache
+from refstack import db
+
+RESPONSE_CACHE_OPTS = [
+    cfg.StrOpt('response_cache_backend',
+               default='memory',
+               choices=['memory', 'file'],
+               help='Storage of list pages cached for anonymous users. '
+                    '"memory" caches pages in every API process. "file" '
+                    'caches pages in response_cache_path, shared by all '
+                    'API processes of the host, so that changes made by '
+                    'any process are visible immediately.'),
+    cfg.StrOpt('response_cache_path',
+               default='',
+               help='Directory of cached list pages if '
+                    'response_cache_backend is "file". A temporary '
+                    'directory is used if it is empty.'),
+    cfg.IntOpt('response_cache_ttl',
+               default=30,
+               help='Number of seconds for which list pages of results, '
+                    'products and vendors are cached for anonymous users. '
+                    'With the "memory" backend, pages changed through '
+                    'another API process are served stale until they '
+                    'expire. Set to 0 to disable the cache.'),
+    cfg.IntOpt('response_cache_size',
+               default=1024,
+               help='Maximum number of list pages cached by every API '
+                    'process if response_cache_backend is "memory".'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(RESPONSE_CACHE_OPTS, group='api')
+
+LOG = log.getLogger(__name__)
+
+# Endpoints with cached pages, named after the kinds of data changed
+# through the DB API.
+RESULTS = db.RESULTS
+PRODUCTS = db.PRODUCTS
+VENDORS = db.VENDORS
+ENDPOINTS = (RESULTS, PRODUCTS, VENDORS)
+
+# Files of expired pages are removed after this number of stores.
+_PRUNE_INTERVAL = 256
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class FileBackend(object):
+    """Cache entries stored as JSON files of a directory.
+
+    Files are replaced atomically, so processes sharing the directory
+    never read partially written entries.
+    """
+
+    def __init__(self, path, timer=time.time):
+        """Init the backend, creating the directory if needed."""
+        self.path = path
+        self.timer = timer
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._stores = 0
+
+    def _get_file_path(self, key):
+        return os.path.join(self.path, hashlib.sha1(
+            key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, key, default=None):
+        """Get the value stored for the key."""
+        try:
+            with open(self._get_file_path(key)) as f:
+                entry = json.load(f)
+        except (EnvironmentError, ValueError):
+            return default
+        if entry['expires_at'] is not None and \
+                entry['expires_at'] <= self.timer():
+            return default
+        return entry['value']
+
+    def set(self, key, value, ttl=None):
+        """Store the value for the key."""
+        entry = {'expires_at': self.timer() + ttl if ttl else None,
+                 'value': value}
+        fd, tmp_path = tempfile.mkstemp(prefix='.', dir=self.path)
+        with os.fdopen(fd, 'w') as f:
+            # Dates are rendered as strings, just like in JSON responses.
+            json.dump(entry, f, default=str)
+        os.rename(tmp_path, self._get_file_path(key))
+
+        self._stores += 1
+        if self._stores % _PRUNE_INTERVAL == 0:
+            self.prune()
+
+    def prune(self):
+        """Remove files of expired entries."""
+        now = self.timer()
+        for file_name in os.listdir(self.path):
+            file_path = os.path.join(self.path, file_name)
+            try:
+                with open(file_path) as f:
+                    expires_at = json.load(f)['expires_at']
+                if expires_at is not None and expires_at <= now:
+                    os.remove(file_path)
+            except (EnvironmentError, ValueError, KeyError):
+                pass
+
+
+class ResponseCache(object):
+    """Cache of responses keyed by endpoint and query parameters."""
+
+    def __init__(self, backend, ttl):
+        """Init the cache.
+
+        :param backend: Storage of the cache with the get and set methods
+                        of cache.TTLCache.
+        :param ttl: Number of seconds for which responses are cached.
+        """
+        self.backend = backend
+        self.ttl = ttl
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _count(self, endpoint, counter):
+        with self._lock:
+            counters = self._counters.setdefault(
+                endpoint, {'hits': 0, 'misses': 0})
+            counters[counter] += 1
+
+    def _get_generation(self, endpoint):
+        key = 'generation:%s' % endpoint
+        generation = self.backend.get(key)
+        if generation is None:
+            # A random generation never matches pages cached before the
+            # generation got lost, e.g. evicted from memory.
+            generation = self.invalidate(endpoint)
+        return generation
+
+    def _get_key(self, endpoint, params):
+        """Get the key of a page from its normalized query parameters."""
+        query = sorted((name, value) for name, value in params.items()
+                       if value not in (None, ''))
+        return 'page:%s:%s:%s' % (endpoint, self._get_generation(endpoint),
+                                  json.dumps(query))
+
+    def get_or_set(self, endpoint, params, func, *args, **kwargs):
+        """Get the cached response, or cache the response built by func.
+
+        The key is computed once, so a response built while the endpoint
+        is invalidated is cached under the previous generation, and never
+        served.
+        """
+        key = self._get_key(endpoint, params)
+        response = self.backend.get(key)
+        if response is not None:
+            self._count(endpoint, 'hits')
+            return response
+        self._count(endpoint, 'misses')
+        response = func(*args, **kwargs)
+        self.backend.set(key, response, ttl=self.ttl)
+        return response
+
+    def invalidate(self, *endpoints):
+        """Stop using the responses cached so far for the endpoints.
+
+        Returns the new generation of the last endpoint.
+        """
+        generation = None
+        for endpoint in endpoints:
+            generation = uuid.uuid4().hex
+            self.backend.set('generation:%s' % endpoint, generation)
+        return generation
+
+    def get_metrics(self):
+        """Get hit and miss counters of every endpoint in this process."""
+        with self._lock:
+            metrics = dict((endpoint, dict(counters))
+                           for endpoint, counters in self._counters.items())
+        for counters in metrics.values():
+            lookups = counters['hits'] + counters['misses']
+            counters['hit_ratio'] = (float(counters['hits']) / lookups
+                                     if lookups else None)
+        return metrics
+
+
+def get_cache():
+    """Get the response cache of the process.
+
+    Returns None if the cache is disabled.
+    """
+    global _cache
+    if not CONF.api.response_cache_ttl:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            if CONF.api.response_cache_backend == 'file':
+                path = (CONF.api.response_cache_path or
+                        os.path.join(tempfile.gettempdir(),
+                                     'refstack-response-cache'))
+                backend = FileBackend(path)
+                LOG.info('Caching anonymous list pages in %s.' % path)
+            else:
+                backend = cache.TTLCache(
+                    maxsize=CONF.api.response_cache_size)
+            _cache = ResponseCache(backend, CONF.api.response_cache_ttl)
+        return _cache
+
+
+def invalidate(*endpoints):
+    """Stop using cached responses of the endpoints after data changes."""
+    response_cache = get_cache()
+    if response_cache:
+        response_cache.invalidate(*endpoints)
+
+
+def get_metrics():
+    """Get hit and miss counters of the response cache of this process."""
+    response_cache = get_cache()
+    return response_cache.get_metrics() if response_cache else {}
@@ -0,0 +1,126 @@
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Stateless sessions stored in encrypted cookies."""
+
+import json
+
+from cryptography import fernet
+from six.moves import http_cookies
+
+# WSGI environment key of the session, shared with Beaker sessions.
+SESSION_ENV = 'beaker.session'
+
+
+class CookieSession(dict):
+    """Session data which is sent back to the client in a cookie.
+
+    The session provides the subset of the Beaker session interface used
+    by RefStack.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Init the session with the given data."""
+        super(CookieSession, self).__init__(*args, **kwargs)
+        self.modified = False
+
+    def save(self):
+        """Send the session data to the client with the response."""
+        self.modified = True
+
+    def delete(self):
+        """Remove all session data."""
+        self.clear()
+        self.modified = True
+
+    invalidate = delete
+
+
+class CookieSessionMiddleware(object):
+    """WSGI middleware keeping sessions in encrypted and signed cookies.
+
+    Session data is serialized to JSON and encrypted with Fernet, so no
+    server-side storage is needed and any process holding the keys can
+    read the session. New cookies are encrypted with the first key, while
+    all keys are tried for decryption, which makes it possible to rotate
+    keys without invalidating existing sessions.
+    """
+
+    def __init__(self, app, keys, cookie_name='refstack', timeout=604800,
+                 secure=False):
+        """Init the middleware.
+
+        :param app: Wrapped WSGI application.
+        :param keys: List of Fernet keys.
+        :param cookie_name: Name of the session cookie.
+        :param timeout: Number of seconds after which a session expires
+                        unless it is saved again.
+        :param secure: Whether the cookie is sent over HTTPS only.
+        """
+        self.app = app
+        self.fernet = fernet.MultiFernet([fernet.Fernet(key) for key in keys])
+        self.cookie_name = cookie_name
+        self.timeout = timeout
+        self.secure = secure
+
+    def load(self, environ):
+        """Get the session sent with the request."""
+        try:
+            cookie = http_cookies.SimpleCookie(environ.get('HTTP_COOKIE', ''))
+        except http_cookies.CookieError:
+            return CookieSession()
+        morsel = cookie.get(self.cookie_name)
+        if morsel is None:
+            return CookieSession()
+        try:
+            data = json.loads(self.fernet.decrypt(
+                morsel.value.encode('ascii'),
+                ttl=self.timeout).decode('utf-8'))
+        except (fernet.InvalidToken, TypeError, ValueError):
+            # The session expired, or was created with a key which is not
+            # used anymore.
+            return CookieSession()
+        if not isinstance(data, dict):
+            return CookieSession()
+        return CookieSession(data)
+
+    def dump(self, session):
+        """Get the Set-Cookie header value for the session."""
+        cookie = http_cookies.SimpleCookie()
+        if session:
+            cookie[self.cookie_name] = self.fernet.encrypt(
+                json.dumps(dict(session)).encode('utf-8')).decode('ascii')
+            cookie[self.cookie_name]['max-age'] = self.timeout
+        else:
+            # Make the client drop the cookie of an empty session.
+            cookie[self.cookie_name] = ''
+            cookie[self.cookie_name]['max-age'] = 0
+        cookie[self.cookie_name]['path'] = '/'
+        cookie[self.cookie_name]['httponly'] = True
+        if self.secure:
+            cookie[self.cookie_name]['secure'] = True
+        return cookie[self.cookie_name].OutputString()
+
+    def __call__(self, environ, start_response):
+        """Handle a request."""
+        session = self.load(environ)
+        environ[SESSION_ENV] = session
+
+        def session_start_response(status, headers, exc_info=None):
+            if session.modified:
+                headers.append(('Set-Cookie', self.dump(session)))
+            return start_response(status, headers, exc_info)
+
+        return self.app(environ, session_start_response)
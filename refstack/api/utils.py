@@ -14,12 +14,16 @@
 #    under the License.
 
 """Refstack API's utils."""
+import base64
 import binascii
+import collections
 import copy
 import functools
+import hashlib
+import json
 import random
-import requests
 import string
+import time
 import types
 
 from cryptography.hazmat import backends
@@ -30,12 +34,16 @@ from oslo_utils import timeutils
 import pecan
 import pecan.rest
 import jwt
+import six
 
 from six.moves.urllib import parse
 
 from refstack import db
+from refstack.api import cache
 from refstack.api import constants as const
 from refstack.api import exceptions as api_exc
+from refstack.api import http_client
+from refstack.api import response_cache
 
 LOG = log.getLogger(__name__)
 CONF = cfg.CONF
@@ -113,18 +121,12 @@ def _calculate_pages_number(per_page, records_count):
     return quotient
 
 
-def get_page_number(records_count):
-    """Get page number from request.
-
-    :param records_count: (int) total records count.
-    """
+def get_requested_page_number():
+    """Get the page number from request, regardless of the total pages."""
     page_number = pecan.request.GET.get(const.PAGE)
-    per_page = CONF.api.results_per_page
-
-    total_pages = _calculate_pages_number(per_page, records_count)
     # The first page exists in any case
     if page_number is None:
-        return (1, total_pages)
+        return 1
     try:
         page_number = int(page_number)
     except (ValueError, TypeError):
@@ -132,14 +134,22 @@ def get_page_number(records_count):
             'Invalid page number: The page number can not be converted to '
             'an integer')
 
-    if page_number == 1:
-        return (page_number, total_pages)
-
     if page_number <= 0:
         raise api_exc.ParseInputsError('Invalid page number: '
                                        'The page number less or equal zero.')
+    return page_number
+
 
-    if page_number > total_pages:
+def get_page_number(records_count):
+    """Get page number from request.
+
+    :param records_count: (int) total records count.
+    """
+    per_page = CONF.api.results_per_page
+
+    total_pages = _calculate_pages_number(per_page, records_count)
+    page_number = get_requested_page_number()
+    if page_number > 1 and page_number > total_pages:
         raise api_exc.ParseInputsError(
             'Invalid page number: '
             'The page number is greater than the total number of pages.')
@@ -185,8 +195,82 @@ def get_token_data():
     return pecan.request.environ.get(const.JWT_TOKEN_ENV)
 
 
+class AuthContext(object):
+    """Identity of the user making a request.
+
+    The context is created once per request. The openid is resolved when
+    the context is created, while the user record and group memberships
+    are loaded on first use and then reused for the rest of the request.
+    """
+
+    __slots__ = ('_openid', '_user', '_user_loaded', '_foundation_admin',
+                 '_vendor_admin')
+
+    def __init__(self, openid):
+        """Init the context of the user with the given openid."""
+        self._openid = openid
+        self._user = None
+        self._user_loaded = False
+        self._foundation_admin = None
+        self._vendor_admin = {}
+
+    @property
+    def openid(self):
+        """Openid of the user, None for anonymous requests."""
+        return self._openid
+
+    @property
+    def user(self):
+        """DB record of the user, None if there is no such user."""
+        if not self._user_loaded:
+            self._user_loaded = True
+            if self._openid:
+                try:
+                    self._user = db.user_get(self._openid)
+                except db.NotFound:
+                    pass
+        return self._user
+
+    @property
+    def is_authenticated(self):
+        """Whether the user is authenticated."""
+        return self.user is not None
+
+    @property
+    def is_foundation_admin(self):
+        """Whether the user belongs to the foundation group."""
+        if self._foundation_admin is None:
+            self._foundation_admin = bool(
+                self._openid and db.is_foundation_user(self._openid))
+        return self._foundation_admin
+
+    def is_vendor_admin(self, vendor_id):
+        """Check whether the user belongs to the group of the vendor."""
+        if vendor_id not in self._vendor_admin:
+            self._vendor_admin[vendor_id] = bool(
+                self._openid and
+                db.is_organization_user(vendor_id, self._openid))
+        return self._vendor_admin[vendor_id]
+
+
+def get_auth_context():
+    """Return the authentication context of the current request.
+
+    Returns None if the context was not created for the request, or if
+    there is no request being handled.
+    """
+    try:
+        context = pecan.request.environ.get(const.AUTH_CONTEXT_ENV)
+    except AttributeError:
+        return None
+    return context if isinstance(context, AuthContext) else None
+
+
 def get_user_id(from_session=True, from_token=True):
     """Return authenticated user id."""
+    context = get_auth_context()
+    if context and from_session and from_token:
+        return context.openid
     session = get_user_session()
     token = get_token_data()
     if from_session and session.get(const.USER_OPENID):
@@ -198,6 +282,9 @@ def get_user_id(from_session=True, from_token=True):
 def get_user(user_id=None):
     """Return db record for authenticated user."""
     if not user_id:
+        context = get_auth_context()
+        if context and context.user is not None:
+            return context.user
         user_id = get_user_id()
     return db.user_get(user_id)
 
@@ -209,6 +296,9 @@ def get_user_public_keys():
 
 def is_authenticated(by_session=True, by_token=True):
     """Return True if user is authenticated."""
+    context = get_auth_context()
+    if context and by_session and by_token:
+        return context.is_authenticated
     user_id = get_user_id(from_session=by_session, from_token=by_token)
     if user_id:
         try:
@@ -311,14 +401,66 @@ def check_permissions(level):
     return decorator
 
 
+def cache_anonymous_response(endpoint):
+    """Decorator caching list pages served to anonymous users.
+
+    Pages are cached under the endpoint and the query parameters of the
+    request. Pages of logged in users are never cached, since they depend
+    on the user.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapped(*args, **kwargs):
+            page_cache = response_cache.get_cache()
+            if not page_cache or is_authenticated():
+                return method(*args, **kwargs)
+            return page_cache.get_or_set(endpoint, pecan.request.GET.mixed(),
+                                         method, *args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def get_etag(body):
+    """Get a strong ETag of a JSON response body."""
+    return hashlib.sha1(json.dumps(body, sort_keys=True, default=str)
+                        .encode('utf-8')).hexdigest()
+
+
+def check_etag(etag, max_age=0, per_user=True, last_modified=None):
+    """Set the cache validators and Cache-Control header of the response.
+
+    Returns True if the client already has the current response body, in
+    which case the controller doesn't need to build it again:
+    ConditionalGetHook turns the response into 304 Not Modified.
+
+    :param etag: Strong ETag of the response body.
+    :param max_age: Number of seconds for which the response may be used
+                    without revalidation. 0 means always revalidate.
+    :param per_user: Whether the response body depends on the user.
+    :param last_modified: Time of the last change of the response body.
+    """
+    response = pecan.response
+    response.etag = etag
+    if last_modified:
+        response.last_modified = last_modified
+    if per_user:
+        directives = ['private' if is_authenticated() else 'public']
+        response.headers['Vary'] = 'Cookie, Authorization'
+    else:
+        directives = ['public']
+    directives.append('max-age=%d' % max_age if max_age else 'no-cache')
+    response.headers['Cache-Control'] = ', '.join(directives)
+    return etag in pecan.request.if_none_match
+
+
 def verify_openid_request(request):
     """Verify OpenID returned request in OpenID."""
     verify_params = dict(request.params.copy())
     verify_params["openid.mode"] = "check_authentication"
 
-    verify_response = requests.post(
-        CONF.osid.openstack_openid_endpoint, data=verify_params,
-        verify=not CONF.api.app_dev_mode
+    verify_response = http_client.post(
+        CONF.osid.openstack_openid_endpoint, target='openid',
+        data=verify_params, verify=not CONF.api.app_dev_mode
     )
 
     vrc = verify_response.content.decode('utf-8') if isinstance(
@@ -350,16 +492,22 @@ def verify_openid_request(request):
 
 def check_user_is_foundation_admin(user_id=None):
     """Check is user in foundation group or not."""
+    if not user_id:
+        context = get_auth_context()
+        if context:
+            return context.is_foundation_admin
     user = user_id if user_id else get_user_id()
-    org_users = db.get_foundation_users()
-    return user in org_users
+    return db.is_foundation_user(user)
 
 
 def check_user_is_vendor_admin(vendor_id, user_id=None):
     """Check is user in vendor group or not."""
+    if not user_id:
+        context = get_auth_context()
+        if context:
+            return context.is_vendor_admin(vendor_id)
     user = user_id if user_id else get_user_id()
-    org_users = db.get_organization_users(vendor_id)
-    return user in org_users
+    return db.is_organization_user(vendor_id, user)
 
 
 def check_user_is_product_admin(product_id, user_id=None):
@@ -369,10 +517,147 @@ def check_user_is_product_admin(product_id, user_id=None):
     return check_user_is_vendor_admin(vendor_id, user_id=user_id)
 
 
+def _parse_pubkey(pubkey):
+    """Parse a stored public key into a key object.
+
+    Returns None if the key can not be parsed.
+    """
+    try:
+        pubkey_string = '%s %s' % (pubkey['format'], pubkey['pubkey'])
+        return serialization.load_ssh_public_key(
+            pubkey_string.encode('utf-8'),
+            backend=backends.default_backend()
+        )
+    except (ValueError, IndexError, TypeError, binascii.Error):
+        return None
+
+
+def get_pubkey_fingerprint(pubkey):
+    """Get the SHA-256 fingerprint of a public key, as shown by ssh-keygen.
+
+    :param pubkey: Base64 encoded public key.
+    """
+    digest = hashlib.sha256(base64.b64decode(pubkey)).digest()
+    return 'SHA256:%s' % base64.b64encode(digest).decode('ascii').rstrip('=')
+
+
+UploadKey = collections.namedtuple('UploadKey', ['id', 'openid', 'key'])
+
+
+def _load_ssh_public_key(public_key):
+    """Parse a public key in OpenSSH format."""
+    try:
+        return serialization.load_ssh_public_key(
+            public_key.encode('utf-8'),
+            backend=backends.default_backend()
+        )
+    except (binascii.Error, ValueError) as e:
+        raise api_exc.ValidationError('Malformed public key', e)
+
+
+def get_upload_key(public_key, parse=False):
+    """Get the stored public key which signed an upload.
+
+    Stored keys are cached by fingerprint together with the openid of
+    their owner and the parsed key object, so repeated uploads signed
+    with the same key neither parse the key nor query the database again.
+    Entries expire after upload_key_cache_ttl seconds, so keys deleted
+    through other processes stop being accepted.
+
+    :param public_key: Public key in OpenSSH format, as sent in the
+                       X-Public-Key header.
+    :param parse: Whether the parsed key object is needed.
+    :returns: UploadKey tuple. Its id and openid are None if the key is
+              not stored, its key is None if it was not parsed yet.
+    """
+    if isinstance(public_key, six.binary_type):
+        public_key = public_key.decode('utf-8', 'replace')
+    try:
+        key_blob = public_key.strip().split()[1]
+        fingerprint = get_pubkey_fingerprint(key_blob)
+    except (IndexError, TypeError, ValueError, binascii.Error):
+        # Malformed keys can not be stored.
+        fingerprint = None
+
+    upload_key = cache.upload_keys.get(fingerprint) if fingerprint else None
+    if upload_key is not None and (upload_key.key is not None or not parse):
+        return upload_key
+
+    # The owner is looked up again whenever an entry is stored, so that
+    # entries never outlive the lookup by more than the TTL.
+    pubkey = db.get_pubkey(key_blob) if fingerprint else None
+    if pubkey:
+        upload_key = UploadKey(pubkey.id, pubkey.openid, None)
+    else:
+        upload_key = UploadKey(None, None, None)
+    if parse and upload_key.key is None:
+        upload_key = upload_key._replace(key=_load_ssh_public_key(public_key))
+    if upload_key.id is not None and CONF.api.upload_key_cache_ttl > 0:
+        cache.upload_keys.set(fingerprint, upload_key,
+                              ttl=CONF.api.upload_key_cache_ttl)
+    return upload_key
+
+
+def _get_user_pubkeys_by_key_id(openid, key_id):
+    """Get public keys of the user matching the key id.
+
+    The key id is either the md5 hash of the key, in hex optionally
+    prefixed with 'MD5:' and separated by colons, or the SHA-256
+    fingerprint of the key prefixed with 'SHA256:'.
+    """
+    if not isinstance(key_id, six.string_types):
+        raise api_exc.ValidationError("Key id is not valid")
+    if key_id.startswith('SHA256:'):
+        return [pubkey for pubkey in db.get_user_pubkeys(openid)
+                if get_pubkey_fingerprint(pubkey['pubkey']) == key_id]
+    md5_hash = key_id.lower()
+    if md5_hash.startswith('md5:'):
+        md5_hash = md5_hash[4:]
+    md5_hash = md5_hash.replace(':', '')
+    if len(md5_hash) != 32:
+        raise api_exc.ValidationError("Key id is not valid")
+    return db.get_user_pubkeys(openid, md5_hash=md5_hash)
+
+
+def _verify_token(token, openid, key_id=None):
+    """Verify the token signature with public keys of the user.
+
+    If the key id is given, only the matching key is tried.
+    """
+    if key_id:
+        pubkeys = _get_user_pubkeys_by_key_id(openid, key_id)
+    else:
+        pubkeys = db.get_user_pubkeys(openid)
+    for pubkey in pubkeys:
+        # Key objects are passed to PyJWT, so keys are only parsed once.
+        pubkey_obj = cache.parsed_pubkeys.get_or_set(
+            pubkey['id'], _parse_pubkey, pubkey)
+        if pubkey_obj is None:
+            continue
+        try:
+            # NOTE(sslipushenko) If at least one key is valid, let
+            # the validation pass
+            return jwt.decode(
+                token, key=pubkey_obj,
+                options={'verify_signature': True,
+                         'verify_exp': True,
+                         'require_exp': True},
+                leeway=const.JWT_VALIDATION_LEEWAY)
+        except jwt.InvalidTokenError:
+            pass
+
+    # NOTE(sslipushenko) If all user's keys are not valid, the validation fails
+    raise api_exc.ValidationError("Token is not valid")
+
+
 def decode_token(request):
     """Validate request signature.
 
     ValidationError rises if request is not valid.
+    The signing key can be identified by the 'kid' field of the token header
+    or by the X-Key-Id request header. Otherwise all public keys of the user
+    are tried. Verified tokens are cached until they expire, so the
+    signature of a token is not verified again for every request.
     """
     if not request.headers.get(const.JWT_TOKEN_HEADER):
         return
@@ -384,40 +669,26 @@ def decode_token(request):
     if auth_schema != 'Bearer':
         raise api_exc.ValidationError(
             "Authorization schema 'Bearer' should be used")
+
+    digest = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    token_data = cache.verified_tokens.get(digest)
+    if token_data is not None:
+        return token_data
+
     try:
         token_data = jwt.decode(token, algorithms='RS256', verify=False)
+        key_id = jwt.get_unverified_header(token).get('kid')
     except jwt.InvalidTokenError:
         raise api_exc.ValidationError("Token is not valid")
 
     openid = token_data.get(const.USER_OPENID)
     if not openid:
         raise api_exc.ValidationError("Token does not contain user's openid")
-    pubkeys = db.get_user_pubkeys(openid)
-    for pubkey in pubkeys:
-        try:
-            pubkey_string = '%s %s' % (pubkey['format'], pubkey['pubkey'])
-            pubkey_obj = serialization.load_ssh_public_key(
-                pubkey_string.encode('utf-8'),
-                backend=backends.default_backend()
-            )
-            pem_pubkey = pubkey_obj.public_bytes(
-                serialization.Encoding.PEM,
-                serialization.PublicFormat.SubjectPublicKeyInfo)
-        except (ValueError, IndexError, TypeError, binascii.Error):
-            pass
-        else:
-            try:
-                token_data = jwt.decode(
-                    token, key=pem_pubkey,
-                    options={'verify_signature': True,
-                             'verify_exp': True,
-                             'require_exp': True},
-                    leeway=const.JWT_VALIDATION_LEEWAY)
-                # NOTE(sslipushenko) If at least one key is valid, let
-                # the validation pass
-                return token_data
-            except jwt.InvalidTokenError:
-                pass
-
-    # NOTE(sslipushenko) If all user's keys are not valid, the validation fails
-    raise api_exc.ValidationError("Token is not valid")
+    key_id = key_id or request.headers.get(const.JWT_KEY_ID_HEADER)
+    token_data = _verify_token(token, openid, key_id=key_id)
+
+    ttl = min(CONF.api.verified_token_cache_ttl,
+              token_data['exp'] + const.JWT_VALIDATION_LEEWAY - time.time())
+    if ttl > 0:
+        cache.verified_tokens.set(digest, token_data, ttl=ttl)
+    return token_data
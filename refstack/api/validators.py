@@ -28,6 +28,7 @@ from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives.serialization import load_ssh_public_key
 
 from refstack.api import exceptions as api_exc
+from refstack.api import utils as api_utils
 
 ext_format_checker = jsonschema.FormatChecker()
 
@@ -126,13 +127,8 @@ class TestResultValidator(BaseValidator):
             except (binascii.Error, TypeError) as e:
                 raise api_exc.ValidationError('Malformed signature', e)
 
-            try:
-                key = load_ssh_public_key(
-                    request.headers.get('X-Public-Key', ''),
-                    backend=backends.default_backend()
-                )
-            except (binascii.Error, ValueError) as e:
-                raise api_exc.ValidationError('Malformed public key', e)
+            key = api_utils.get_upload_key(
+                request.headers.get('X-Public-Key', ''), parse=True).key
 
             verifier = key.verifier(sign, padding.PKCS1v15(), hashes.SHA256())
             verifier.update(request.body)
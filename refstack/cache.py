@@ -0,0 +1,108 @@
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Process-wide in-memory cache."""
+
+import collections
+import threading
+import time
+
+# Marker for values which are not in a cache.
+_MISSING = object()
+
+
+class TTLCache(object):
+    """Thread-safe LRU cache with optionally expiring entries.
+
+    Hits and misses are counted to make it possible to judge how
+    effective the cache is.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, timer=time.time):
+        """Initialize the cache.
+
+        :param maxsize: Maximum number of entries. The least recently used
+                        entries are evicted first.
+        :param ttl: Default number of seconds after which entries expire.
+                    Entries never expire if it is None.
+        :param timer: Function returning the current time in seconds.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Get the value cached for the key."""
+        with self._lock:
+            value, expires_at = self._data.pop(key, (_MISSING, None))
+            if value is _MISSING or (expires_at is not None and
+                                     expires_at <= self.timer()):
+                self.misses += 1
+                return default
+            # Move the entry to the end as the most recently used one.
+            self._data[key] = (value, expires_at)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Cache the value for the key.
+
+        :param ttl: Number of seconds after which the entry expires,
+                    overrides the default of the cache.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = self.timer() + ttl if ttl is not None else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires_at)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, func, *args, **kwargs):
+        """Get the value cached for the key, or cache the result of func.
+
+        :param ttl: Number of seconds after which a new entry expires.
+        """
+        ttl = kwargs.pop('ttl', None)
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = func(*args, **kwargs)
+            self.set(key, value, ttl=ttl)
+        return value
+
+    def pop(self, key):
+        """Remove the entry for the key, if any."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Get hit and miss counters and the number of entries."""
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': len(self._data)}
+
+    def __len__(self):
+        """Get the number of entries, including expired ones."""
+        return len(self._data)
@@ -19,8 +19,16 @@ Functions in this module are imported into the refstack.db namespace.
 Call these functions from refstack.db namespace, not the refstack.db.api
 namespace.
 """
+import json
+import threading
+import time
+
+from concurrent import futures
 from oslo_config import cfg
 from oslo_db import api as db_api
+from oslo_log import log
+
+from refstack import cache
 
 
 db_opts = [
@@ -33,11 +41,28 @@ db_opts = [
                     'database. To allow RefStack to upload and store ' +
                     'the full set of subunit data, set this option to ' +
                     'refstack_alembic_version.'),
+    cfg.IntOpt('membership_cache_ttl',
+               default=5,
+               help='Number of seconds for which group memberships and '
+                    'vendor admins of cloud provider ids, used for '
+                    'authorization, are cached by every process. '
+                    'Memberships changed by the same process are updated '
+                    'immediately, but other API processes keep granting '
+                    'or denying access based on the old memberships until '
+                    'their entries expire, so keep this value low. Set to '
+                    '0 to look up memberships on every check.'),
+    cfg.IntOpt('records_count_cache_ttl',
+               default=300,
+               help='Number of seconds after which approximate test result '
+                    'counts, used by the "approximate" pagination of test '
+                    'results, are refreshed in the background.'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(db_opts)
 
+LOG = log.getLogger(__name__)
+
 _BACKEND_MAPPING = {'sqlalchemy': 'refstack.db.sqlalchemy.api'}
 IMPL = db_api.DBAPI.from_config(cfg.CONF, backend_mapping=_BACKEND_MAPPING,
                                 lazy=True)
@@ -45,13 +70,59 @@ IMPL = db_api.DBAPI.from_config(cfg.CONF, backend_mapping=_BACKEND_MAPPING,
 NotFound = IMPL.NotFound
 Duplication = IMPL.Duplication
 
+# Kinds of data passed to change listeners.
+RESULTS = 'results'
+PRODUCTS = 'products'
+VENDORS = 'vendors'
+PUBKEYS = 'pubkeys'
+
+# Functions called with the kinds of data changed through this module.
+_change_listeners = []
+
+# Group memberships rarely change, but are checked for authorization
+# several times per request.
+_membership_cache = cache.TTLCache(maxsize=4096)
+
+# Product versions with their vendor admins keyed by cloud provider id,
+# resolved for every signed upload of test results.
+_cpid_cache = cache.TTLCache(maxsize=4096)
+
+# Approximate test result counts, as (count, time of counting) pairs keyed
+# by the filters. Counts are refreshed one at a time in the background.
+_records_count_cache = cache.TTLCache(maxsize=1024)
+_records_count_refreshes = set()
+_records_count_lock = threading.Lock()
+_records_count_executor = futures.ThreadPoolExecutor(max_workers=1)
+
+
+def add_change_listener(listener):
+    """Call the listener with the kinds of data changed through this module.
+
+    The API uses it to invalidate its caches, so that the DB layer doesn't
+    depend on them.
+    """
+    if listener not in _change_listeners:
+        _change_listeners.append(listener)
+
+
+def _notify_change(*kinds):
+    """Call the change listeners with the kinds of changed data.
+
+    Only listeners of the calling process are notified. Caches of other
+    processes are updated when their entries expire.
+    """
+    for listener in _change_listeners:
+        listener(*kinds)
+
 
 def store_test_results(results):
     """Storing results into database.
 
     :param results: Dict describes test results.
     """
-    return IMPL.store_test_results(results)
+    result = IMPL.store_test_results(results)
+    _notify_change(RESULTS)
+    return result
 
 
 def get_test_result(test_id, allowed_keys=None):
@@ -62,12 +133,27 @@ def get_test_result(test_id, allowed_keys=None):
     return IMPL.get_test_result(test_id, allowed_keys=allowed_keys)
 
 
+def get_test_result_version(test_id):
+    """Get the version of a test run.
+
+    The version changes whenever the test run, its metadata or its product
+    change. Returns a dict with the opaque 'version', the
+    'verification_status' and the time the test run data was last
+    'updated_at'.
+
+    :param test_id: The ID of the test.
+    """
+    return IMPL.get_test_result_version(test_id)
+
+
 def delete_test_result(test_id):
     """Delete test run information from the database.
 
     :param test_id: The ID of the test.
     """
-    return IMPL.delete_test_result(test_id)
+    result = IMPL.delete_test_result(test_id)
+    _notify_change(RESULTS)
+    return result
 
 
 def update_test_result(test_info):
@@ -75,7 +161,9 @@ def update_test_result(test_info):
 
     :param test_info: The test
     """
-    return IMPL.update_test_result(test_info)
+    result = IMPL.update_test_result(test_info)
+    _notify_change(RESULTS)
+    return result
 
 
 def get_test_results(test_id):
@@ -86,6 +174,40 @@ def get_test_results(test_id):
     return IMPL.get_test_results(test_id)
 
 
+def get_test_results_by_name(test_ids):
+    """Get passed test names with the ids of the test runs passed them.
+
+    :param test_ids: The IDs of the tests.
+    """
+    return IMPL.get_test_results_by_name(test_ids)
+
+
+def get_test_name_bits(names, create=False):
+    """Get bit positions of test names in the test name registry.
+
+    :param names: Names of the tests.
+    :param create: Register the names which are not registered yet.
+    """
+    return IMPL.get_test_name_bits(names, create=create)
+
+
+def get_last_test_name_bit():
+    """Get the highest bit position of the test name registry.
+
+    It grows whenever test names are registered. Returns None if the
+    registry is empty.
+    """
+    return IMPL.get_last_test_name_bit()
+
+
+def get_test_result_bitsets(test_ids):
+    """Get packed bitsets of passed tests for the given test runs.
+
+    :param test_ids: The IDs of the tests.
+    """
+    return IMPL.get_test_result_bitsets(test_ids)
+
+
 def get_test_result_meta_key(test_id, key, default=None):
     """Get metadata value related to specified test run.
 
@@ -104,7 +226,9 @@ def save_test_result_meta_item(test_id, key, value):
     :param key: Metadata key
 
     """
-    return IMPL.save_test_result_meta_item(test_id, key, value)
+    result = IMPL.save_test_result_meta_item(test_id, key, value)
+    _notify_change(RESULTS)
+    return result
 
 
 def delete_test_result_meta_item(test_id, key):
@@ -116,17 +240,21 @@ def delete_test_result_meta_item(test_id, key):
 
     :raise NotFound if default value is not set and no value found
     """
-    return IMPL.delete_test_result_meta_item(test_id, key)
+    result = IMPL.delete_test_result_meta_item(test_id, key)
+    _notify_change(RESULTS)
+    return result
 
 
-def get_test_result_records(page_number, per_page, filters):
+def get_test_result_records(page_number, per_page, filters, limit=None):
     """Get page with applied filters for uploaded test records.
 
     :param page_number: The number of page.
     :param per_page: The number of results for one page.
     :param filters: (Dict) Filters that will be applied for records.
+    :param limit: The maximum number of records, per_page by default.
     """
-    return IMPL.get_test_result_records(page_number, per_page, filters)
+    return IMPL.get_test_result_records(page_number, per_page, filters,
+                                        limit=limit)
 
 
 def get_test_result_records_count(filters):
@@ -137,6 +265,78 @@ def get_test_result_records_count(filters):
     return IMPL.get_test_result_records_count(filters)
 
 
+def _refresh_records_count(key, filters):
+    try:
+        _records_count_cache.set(
+            key, (IMPL.get_test_result_records_count(filters), time.time()))
+    except Exception:
+        LOG.exception('Failed to count test results with filters %s.' % key)
+    finally:
+        with _records_count_lock:
+            _records_count_refreshes.discard(key)
+
+
+def get_approximate_test_result_records_count(filters):
+    """Get the number of uploaded test records, counted a while ago.
+
+    Only the first request with the given filters waits for the records
+    to be counted. Later requests get the cached count, which is counted
+    again in the background once it is older than records_count_cache_ttl
+    seconds.
+
+    :param filters: (Dict) Filters that will be applied for records.
+    """
+    key = json.dumps(sorted(filters.items()), default=str)
+    entry = _records_count_cache.get(key)
+    if entry is None:
+        count = IMPL.get_test_result_records_count(filters)
+        _records_count_cache.set(key, (count, time.time()))
+        return count
+
+    count, counted_at = entry
+    if time.time() - counted_at >= CONF.records_count_cache_ttl:
+        with _records_count_lock:
+            refresh = key not in _records_count_refreshes
+            _records_count_refreshes.add(key)
+        if refresh:
+            _records_count_executor.submit(_refresh_records_count, key,
+                                           dict(filters))
+    return count
+
+
+def get_test_names(prefix, limit, filters=None):
+    """Get distinct names of passed tests starting with the given prefix.
+
+    :param prefix: Prefix of the test name.
+    :param limit: The maximum number of names to return.
+    :param filters: Filters of the test runs searched, with the same
+                    visibility rules as get_test_result_records.
+    """
+    return IMPL.get_test_names(prefix, limit, filters=filters)
+
+
+def get_shared_test_result_ids():
+    """Get IDs of all shared or verified test runs."""
+    return IMPL.get_shared_test_result_ids()
+
+
+def save_capability_stats(stats):
+    """Replace stored capability pass rate statistics.
+
+    :param stats: List of dicts with guideline, capability, run_count and
+                  pass_count keys.
+    """
+    return IMPL.save_capability_stats(stats)
+
+
+def get_capability_stats(guideline=None):
+    """Get capability pass rate statistics.
+
+    :param guideline: Guideline file to get statistics for.
+    """
+    return IMPL.get_capability_stats(guideline)
+
+
 def user_get(user_openid):
     """Get user info.
 
@@ -168,32 +368,51 @@ def store_pubkey(pubkey_info):
 
 def delete_pubkey(pubkey_id):
     """Delete public key from DB."""
-    return IMPL.delete_pubkey(pubkey_id)
+    result = IMPL.delete_pubkey(pubkey_id)
+    _notify_change(PUBKEYS)
+    return result
+
 
+def get_user_pubkeys(user_openid, md5_hash=None):
+    """Get public pubkeys for specified user.
 
-def get_user_pubkeys(user_openid):
-    """Get public pubkeys for specified user."""
-    return IMPL.get_user_pubkeys(user_openid)
+    :param md5_hash: If given, only keys with this md5 hash are returned.
+    """
+    return IMPL.get_user_pubkeys(user_openid, md5_hash=md5_hash)
 
 
 def add_user_to_group(user_openid, group_id, created_by_user):
     """Add specified user to specified group."""
-    return IMPL.add_user_to_group(user_openid, group_id, created_by_user)
+    result = IMPL.add_user_to_group(user_openid, group_id, created_by_user)
+    _membership_cache.pop(('user', user_openid))
+    _cpid_cache.clear()
+    return result
 
 
 def remove_user_from_group(user_openid, group_id):
     """Remove specified user from specified group."""
-    return IMPL.remove_user_from_group(user_openid, group_id)
+    result = IMPL.remove_user_from_group(user_openid, group_id)
+    _membership_cache.pop(('user', user_openid))
+    _cpid_cache.clear()
+    return result
 
 
 def add_organization(organization_info, creator):
     """Add organization."""
-    return IMPL.add_organization(organization_info, creator)
+    result = IMPL.add_organization(organization_info, creator)
+    _membership_cache.pop(('user', creator))
+    _membership_cache.pop(('foundation',))
+    _notify_change(VENDORS)
+    return result
 
 
 def update_organization(organization_info):
     """Update organization."""
-    return IMPL.update_organization(organization_info)
+    result = IMPL.update_organization(organization_info)
+    # The organization type may have changed.
+    _membership_cache.pop(('foundation',))
+    _notify_change(VENDORS)
+    return result
 
 
 def get_organization(organization_id, allowed_keys=None):
@@ -201,19 +420,41 @@ def get_organization(organization_id, allowed_keys=None):
     return IMPL.get_organization(organization_id, allowed_keys=allowed_keys)
 
 
+def get_organization_version(organization_id):
+    """Get the version of an organization.
+
+    The version changes whenever the organization, its products, their
+    versions and test runs, or its users change. Returns a dict with the
+    opaque 'version' and the time the organization data was last
+    'updated_at'.
+
+    :param organization_id: The ID of the organization.
+    """
+    return IMPL.get_organization_version(organization_id)
+
+
 def delete_organization(organization_id):
     """delete organization by id."""
-    return IMPL.delete_organization(organization_id)
+    result = IMPL.delete_organization(organization_id)
+    _membership_cache.pop(('organization', organization_id))
+    _membership_cache.pop(('foundation',))
+    _cpid_cache.clear()
+    _notify_change(VENDORS, PRODUCTS)
+    return result
 
 
 def add_product(product_info, creator):
     """Add product from product_info dicionary with creator."""
-    return IMPL.add_product(product_info, creator)
+    result = IMPL.add_product(product_info, creator)
+    _notify_change(PRODUCTS)
+    return result
 
 
 def update_product(product_info):
     """Update product from prodict_info dicionary."""
-    return IMPL.update_product(product_info)
+    result = IMPL.update_product(product_info)
+    _notify_change(PRODUCTS, RESULTS)
+    return result
 
 
 def get_product(id, allowed_keys=None):
@@ -223,7 +464,11 @@ def get_product(id, allowed_keys=None):
 
 def delete_product(id):
     """delete product by id."""
-    return IMPL.delete_product(id)
+    result = IMPL.delete_product(id)
+    # Versions of the product are deleted with it.
+    _cpid_cache.clear()
+    _notify_change(PRODUCTS, RESULTS)
+    return result
 
 
 def get_foundation_users():
@@ -236,6 +481,39 @@ def get_organization_users(organization_id):
     return IMPL.get_organization_users(organization_id)
 
 
+def _get_membership(key, func, *args):
+    """Get a group membership item through the membership cache."""
+    return _membership_cache.get_or_set(key, func, *args,
+                                        ttl=CONF.membership_cache_ttl)
+
+
+def is_foundation_user(user_openid):
+    """Check that the user belongs to the group of foundation."""
+    group_id = _get_membership(('foundation',), IMPL.get_foundation_group_id)
+    return (group_id is not None and group_id in
+            _get_membership(('user', user_openid), IMPL.get_user_group_ids,
+                            user_openid))
+
+
+def is_organization_user(organization_id, user_openid):
+    """Check that the user belongs to the group of organization."""
+    group_id = _get_membership(('organization', organization_id),
+                               IMPL.get_organization_group_id,
+                               organization_id)
+    return group_id in _get_membership(('user', user_openid),
+                                       IMPL.get_user_group_ids, user_openid)
+
+
+def get_query_count():
+    """Get the number of queries executed by the current thread."""
+    return IMPL.get_query_count()
+
+
+def get_membership_cache_stats():
+    """Get hit and miss counters of the group membership cache."""
+    return _membership_cache.stats()
+
+
 def get_organizations(allowed_keys=None):
     """Get all organizations."""
     return IMPL.get_organizations(allowed_keys=allowed_keys)
@@ -280,23 +558,55 @@ def get_product_version_by_cpid(cpid, allowed_keys=None):
     return IMPL.get_product_version_by_cpid(cpid, allowed_keys=allowed_keys)
 
 
+def get_product_version_admins_by_cpid(cpid):
+    """Get product versions with a cloud provider id and their admins.
+
+    Returns a list with the id, the product id and the openids of the
+    vendor admins of each product version. Results are cached like group
+    memberships.
+    """
+    return _cpid_cache.get_or_set(cpid,
+                                  IMPL.get_product_version_admins_by_cpid,
+                                  cpid, ttl=CONF.membership_cache_ttl)
+
+
 def get_product_versions(product_id, allowed_keys=None):
     """Get all versions for a product."""
     return IMPL.get_product_versions(product_id, allowed_keys=allowed_keys)
 
 
+def get_product_versions_by_products(product_ids, allowed_keys=None):
+    """Get all versions of the given products."""
+    return IMPL.get_product_versions_by_products(product_ids,
+                                                 allowed_keys=allowed_keys)
+
+
+def get_latest_test_results_by_versions(product_version_ids):
+    """Get the latest verified or shared test run of each product version."""
+    return IMPL.get_latest_test_results_by_versions(product_version_ids)
+
+
 def add_product_version(product_id, version, creator, cpid=None,
                         allowed_keys=None):
     """Add a new product version."""
-    return IMPL.add_product_version(product_id, version, creator, cpid,
-                                    allowed_keys=allowed_keys)
+    result = IMPL.add_product_version(product_id, version, creator, cpid,
+                                      allowed_keys=allowed_keys)
+    _cpid_cache.pop(cpid)
+    return result
 
 
 def update_product_version(product_version_info):
     """Update product version from product_info_version dictionary."""
-    return IMPL.update_product_version(product_version_info)
+    result = IMPL.update_product_version(product_version_info)
+    # The previous cpid of the version is not known anymore.
+    _cpid_cache.clear()
+    _notify_change(RESULTS)
+    return result
 
 
 def delete_product_version(product_version_id):
     """Delete a product version."""
-    return IMPL.delete_product_version(product_version_id)
+    result = IMPL.delete_product_version(product_version_id)
+    _cpid_cache.clear()
+    _notify_change(RESULTS)
+    return result
@@ -0,0 +1,39 @@
+"""Add capability pass rate statistics table.
+
+Revision ID: 1f3a7c9d2e84
+Revises: 5c8e0a3f9b71
+Create Date: 2026-10-19 13:26:08.904415
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1f3a7c9d2e84'
+down_revision = '5c8e0a3f9b71'
+MYSQL_CHARSET = 'utf8'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    """Upgrade DB."""
+    op.create_table(
+        'capability_stats',
+        sa.Column('updated_at', sa.DateTime()),
+        sa.Column('deleted_at', sa.DateTime()),
+        sa.Column('deleted', sa.Integer, default=0),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('_id', sa.Integer(), nullable=False),
+        sa.Column('guideline', sa.String(length=64), nullable=False),
+        sa.Column('capability', sa.String(length=128), nullable=False),
+        sa.Column('run_count', sa.Integer(), nullable=False),
+        sa.Column('pass_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('_id'),
+        sa.UniqueConstraint('guideline', 'capability'),
+        mysql_charset=MYSQL_CHARSET
+    )
+
+
+def downgrade():
+    """Downgrade DB."""
+    op.drop_table('capability_stats')
@@ -0,0 +1,32 @@
+"""Index test results by test name and idempotent id.
+
+The 'results' table is only indexed by test_id, so looking up the test
+runs that passed a specific test requires a full table scan. These
+indexes allow answering such lookups (and test name prefix searches)
+with index range scans.
+
+Revision ID: 2a6fb2d0e5c1
+Revises: 434be17a6ec3
+Create Date: 2026-10-19 09:12:41.118370
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2a6fb2d0e5c1'
+down_revision = '434be17a6ec3'
+MYSQL_CHARSET = 'utf8'
+
+from alembic import op
+
+
+def upgrade():
+    """Upgrade DB."""
+    op.create_index('ix_results_name_test_id', 'results',
+                    ['name', 'test_id'])
+    op.create_index('ix_results_uuid', 'results', ['uuid'])
+
+
+def downgrade():
+    """Downgrade DB."""
+    op.drop_index('ix_results_uuid', 'results')
+    op.drop_index('ix_results_name_test_id', 'results')
@@ -0,0 +1,28 @@
+"""Index product versions by cloud provider id.
+
+Signed uploads of test results are associated with the product version
+of their cloud provider id, which requires a full scan of the
+'product_version' table without this index.
+
+Revision ID: 3b8d5e1a7c40
+Revises: 1f3a7c9d2e84
+Create Date: 2026-10-19 15:02:37.520193
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3b8d5e1a7c40'
+down_revision = '1f3a7c9d2e84'
+MYSQL_CHARSET = 'utf8'
+
+from alembic import op
+
+
+def upgrade():
+    """Upgrade DB."""
+    op.create_index('ix_product_version_cpid', 'product_version', ['cpid'])
+
+
+def downgrade():
+    """Downgrade DB."""
+    op.drop_index('ix_product_version_cpid', 'product_version')
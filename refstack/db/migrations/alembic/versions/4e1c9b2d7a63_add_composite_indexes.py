@@ -0,0 +1,54 @@
+"""Add indexes for the most frequent query shapes.
+
+- test(created_at): test run lists are ordered by creation time.
+- test(verification_status, created_at): verified test runs are listed
+  and counted by status.
+- meta(meta_key, value): the test runs of a user are found by the value
+  of their 'user' metadata. Only a prefix of the values is indexed.
+- user_to_group(group_id, user_openid): members of groups are listed and
+  checked for authorization.
+- organization(type): the Foundation and official vendors are found by
+  organization type.
+- product(organization_id, created_at): products of a vendor are listed
+  by creation time.
+
+The cloud provider id of product versions is indexed by revision
+3b8d5e1a7c40. InnoDB adds secondary indexes in place, without blocking
+reads and writes of the tables.
+
+Revision ID: 4e1c9b2d7a63
+Revises: 3b8d5e1a7c40
+Create Date: 2026-10-19 16:44:09.307718
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4e1c9b2d7a63'
+down_revision = '3b8d5e1a7c40'
+MYSQL_CHARSET = 'utf8'
+
+from alembic import op
+
+
+def upgrade():
+    """Upgrade DB."""
+    op.create_index('ix_test_created_at', 'test', ['created_at'])
+    op.create_index('ix_test_verification_status_created_at', 'test',
+                    ['verification_status', 'created_at'])
+    op.create_index('ix_meta_meta_key_value', 'meta', ['meta_key', 'value'],
+                    mysql_length={'value': 128})
+    op.create_index('ix_user_to_group_group_id_user_openid',
+                    'user_to_group', ['group_id', 'user_openid'])
+    op.create_index('ix_organization_type', 'organization', ['type'])
+    op.create_index('ix_product_organization_id_created_at', 'product',
+                    ['organization_id', 'created_at'])
+
+
+def downgrade():
+    """Downgrade DB."""
+    op.drop_index('ix_product_organization_id_created_at', 'product')
+    op.drop_index('ix_organization_type', 'organization')
+    op.drop_index('ix_user_to_group_group_id_user_openid', 'user_to_group')
+    op.drop_index('ix_meta_meta_key_value', 'meta')
+    op.drop_index('ix_test_verification_status_created_at', 'test')
+    op.drop_index('ix_test_created_at', 'test')
@@ -0,0 +1,51 @@
+"""Add test name registry and result bitsets.
+
+Revision ID: 5c8e0a3f9b71
+Revises: 2a6fb2d0e5c1
+Create Date: 2026-10-19 11:04:27.530112
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c8e0a3f9b71'
+down_revision = '2a6fb2d0e5c1'
+MYSQL_CHARSET = 'utf8'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    """Upgrade DB."""
+    op.create_table(
+        'test_name',
+        sa.Column('updated_at', sa.DateTime()),
+        sa.Column('deleted_at', sa.DateTime()),
+        sa.Column('deleted', sa.Integer, default=0),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=512,
+                                    collation='latin1_swedish_ci'),
+                  nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name'),
+        mysql_charset=MYSQL_CHARSET
+    )
+    op.create_table(
+        'results_bitset',
+        sa.Column('updated_at', sa.DateTime()),
+        sa.Column('deleted_at', sa.DateTime()),
+        sa.Column('deleted', sa.Integer, default=0),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('test_id', sa.String(36), nullable=False),
+        sa.Column('bits', sa.LargeBinary(), nullable=False),
+        sa.PrimaryKeyConstraint('test_id'),
+        sa.ForeignKeyConstraint(['test_id'], ['test.id'], ),
+        mysql_charset=MYSQL_CHARSET
+    )
+
+
+def downgrade():
+    """Downgrade DB."""
+    op.drop_table('results_bitset')
+    op.drop_table('test_name')
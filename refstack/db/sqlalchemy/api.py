@@ -17,14 +17,20 @@
 
 import base64
 import hashlib
+import itertools
 import sys
+import threading
 import uuid
 
 from oslo_config import cfg
+from oslo_db import exception as db_exc
 from oslo_db import options as db_options
 from oslo_db.sqlalchemy import session as db_session
 from oslo_log import log
-
+import six
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.ext import baked
 
 from refstack.api import constants as api_const
 from refstack.db.sqlalchemy import models
@@ -33,7 +39,15 @@ from refstack.db.sqlalchemy import models
 CONF = cfg.CONF
 
 _FACADE = None
+# Maximum number of values bound in a single IN clause.
+_IN_CHUNK_SIZE = 500
 LOG = log.getLogger(__name__)
+# Number of executed queries of each thread.
+_query_count = threading.local()
+# Queries of hot lookups are built and compiled once, then only executed
+# with new parameters. Baked queries are keyed by the code of the function
+# building them, so these functions must only use bound parameters.
+_bakery = baked.bakery()
 
 db_options.set_defaults(cfg.CONF)
 
@@ -50,14 +64,26 @@ class Duplication(Exception):
     pass
 
 
+def _count_query(*args, **kwargs):
+    """Count a query executed by the current thread."""
+    _query_count.value = getattr(_query_count, 'value', 0) + 1
+
+
 def _create_facade_lazily():
     """Create DB facade lazily."""
     global _FACADE
     if _FACADE is None:
         _FACADE = db_session.EngineFacade.from_config(CONF)
+        event.listen(_FACADE.get_engine(), 'before_cursor_execute',
+                     _count_query)
     return _FACADE
 
 
+def get_query_count():
+    """Get the number of queries executed by the current thread."""
+    return getattr(_query_count, 'value', 0)
+
+
 def get_engine():
     """Get DB engine."""
     facade = _create_facade_lazily()
@@ -109,8 +135,112 @@ def _to_dict(sqlalchemy_object, allowed_keys=None):
     return sqlalchemy_object
 
 
+def _chunks(items, size=_IN_CHUNK_SIZE):
+    """Split the given items into lists of at most 'size' items."""
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _encode_bitset(positions):
+    """Pack the given bit positions into a little-endian bitset."""
+    positions = list(positions)
+    bits = bytearray(max(positions) // 8 + 1 if positions else 0)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return bytes(bits)
+
+
+def _query_test_name_bits(session, names):
+    """Get bit positions of the registered test names."""
+    name_bits = {}
+    for chunk in _chunks(names):
+        name_bits.update(
+            session.query(models.TestName.name, models.TestName.id)
+            .filter(models.TestName.name.in_(chunk)))
+    return name_bits
+
+
+def _register_test_names(session, names):
+    """Add the given test names to the registry."""
+    try:
+        with session.begin():
+            for name in names:
+                test_name = models.TestName()
+                test_name.name = name
+                session.add(test_name)
+    except db_exc.DBDuplicateEntry:
+        # Some of the names were registered concurrently, so fall back
+        # to registering them one by one.
+        for name in names:
+            try:
+                with session.begin():
+                    test_name = models.TestName()
+                    test_name.name = name
+                    session.add(test_name)
+            except db_exc.DBDuplicateEntry:
+                pass
+
+
+def get_test_name_bits(names, create=False):
+    """Get bit positions of test names in the test name registry."""
+    names = set(names)
+    session = get_session()
+    name_bits = _query_test_name_bits(session, names)
+    missing = names.difference(name_bits)
+    if create and missing:
+        _register_test_names(session, missing)
+        name_bits.update(_query_test_name_bits(session, missing))
+    return name_bits
+
+
+def get_last_test_name_bit():
+    """Get the highest bit position of the test name registry."""
+    session = get_session()
+    return session.query(sqlalchemy.func.max(models.TestName.id)).scalar()
+
+
+def _build_test_result_bitset(session, test_id):
+    """Build and store the bitset of a test run from its results."""
+    names = [name for name, in session.query(models.TestResults.name)
+             .filter_by(test_id=test_id)]
+    bits = _encode_bitset(get_test_name_bits(names, create=True).values())
+    try:
+        with session.begin():
+            bitset = models.TestResultsBitset()
+            bitset.test_id = test_id
+            bitset.bits = bits
+            bitset.save(session)
+    except db_exc.DBDuplicateEntry:
+        pass
+    return bits
+
+
+def get_test_result_bitsets(test_ids):
+    """Get packed bitsets of passed tests for the given test runs."""
+    session = get_session()
+    bitsets = {}
+    for chunk in _chunks(test_ids):
+        bitsets.update(
+            session.query(models.TestResultsBitset.test_id,
+                          models.TestResultsBitset.bits)
+            .filter(models.TestResultsBitset.test_id.in_(chunk)))
+    missing = set(test_ids).difference(bitsets)
+    # Test runs stored before the registry existed get their bitsets
+    # built on first access.
+    for chunk in _chunks(missing):
+        query = session.query(models.Test.id).filter(
+            models.Test.id.in_(chunk))
+        for test_id, in query.all():
+            bitsets[test_id] = _build_test_result_bitset(session, test_id)
+    return bitsets
+
+
 def store_test_results(results):
     """Store test results."""
+    name_bits = get_test_name_bits(
+        [result['name'] for result in results.get('results', [])],
+        create=True)
     test = models.Test()
     test_id = str(uuid.uuid4())
     test.id = test_id
@@ -130,20 +260,55 @@ def store_test_results(results):
             meta.meta_key, meta.value = k, v
             test.meta.append(meta)
         test.save(session)
+        bitset = models.TestResultsBitset()
+        bitset.test_id = test_id
+        bitset.bits = _encode_bitset(name_bits.values())
+        bitset.save(session)
     return test_id
 
 
 def get_test_result(test_id, allowed_keys=None):
     """Get test info."""
     session = get_session()
-    test_info = session.query(models.Test). \
-        filter_by(id=test_id). \
-        first()
+    query = _bakery(lambda s: s.query(models.Test).filter_by(
+        id=sqlalchemy.bindparam('test_id')))
+    test_info = query(session).params(test_id=test_id).first()
     if not test_info:
         raise NotFound('Test result %s not found' % test_id)
     return _to_dict(test_info, allowed_keys)
 
 
+def get_test_result_version(test_id):
+    """Get the version of a test run and of the data shown with it."""
+    session = get_session()
+    row = session.query(
+        models.Test.verification_status,
+        models.Test.created_at,
+        models.Test.updated_at,
+        models.ProductVersion.updated_at,
+        models.Product.updated_at,
+        sqlalchemy.func.count(models.TestMeta._id),
+        sqlalchemy.func.max(models.TestMeta.created_at),
+        sqlalchemy.func.max(models.TestMeta.updated_at)). \
+        outerjoin(models.ProductVersion,
+                  models.Test.product_version_id ==
+                  models.ProductVersion.id). \
+        outerjoin(models.Product,
+                  models.ProductVersion.product_id == models.Product.id). \
+        outerjoin(models.TestMeta,
+                  models.TestMeta.test_id == models.Test.id). \
+        filter(models.Test.id == test_id). \
+        group_by(models.Test.id, models.ProductVersion.id,
+                 models.Product.id). \
+        first()
+    if not row:
+        raise NotFound('Test result %s not found' % test_id)
+    timestamps = [value for value in row[1:5] + row[6:] if value]
+    return {'verification_status': row[0],
+            'updated_at': max(timestamps),
+            'version': '|'.join(six.text_type(value) for value in row)}
+
+
 def delete_test_result(test_id):
     """Delete test information from the database."""
     session = get_session()
@@ -154,6 +319,8 @@ def delete_test_result(test_id):
                 .filter_by(test_id=test_id).delete()
             session.query(models.TestResults) \
                 .filter_by(test_id=test_id).delete()
+            session.query(models.TestResultsBitset) \
+                .filter_by(test_id=test_id).delete()
             session.delete(test)
         else:
             raise NotFound('Test result %s not found' % test_id)
@@ -180,10 +347,10 @@ def update_test_result(test_info):
 def get_test_result_meta_key(test_id, key, default=None):
     """Get metadata value related to specified test run."""
     session = get_session()
-    meta_item = session.query(models.TestMeta). \
-        filter_by(test_id=test_id). \
-        filter_by(meta_key=key). \
-        first()
+    query = _bakery(lambda s: s.query(models.TestMeta).filter_by(
+        test_id=sqlalchemy.bindparam('test_id'),
+        meta_key=sqlalchemy.bindparam('key')))
+    meta_item = query(session).params(test_id=test_id, key=key).first()
     value = meta_item.value if meta_item else default
     return value
 
@@ -225,6 +392,38 @@ def get_test_results(test_id):
     return [_to_dict(result) for result in results]
 
 
+def get_test_results_by_name(test_ids):
+    """Get passed test names with the ids of the test runs passed them.
+
+    Names are yielded in alphabetical order along with the set of ids of
+    the given test runs which passed the test. Rows are streamed from the
+    database, so only one name is held in memory at a time.
+    """
+    session = get_session()
+    rows = (session.query(models.TestResults.name,
+                          models.TestResults.test_id)
+            .filter(models.TestResults.test_id.in_(test_ids))
+            .order_by(models.TestResults.name)
+            .yield_per(1000))
+    for name, group in itertools.groupby(rows, key=lambda row: row.name):
+        yield name, set(row.test_id for row in group)
+
+
+def _get_passed_test_query(session, passed_test):
+    """Get query for ids of test runs which passed the given test.
+
+    The test may be given either by its name or by its idempotent id
+    (with or without the 'id-' prefix used by tempest).
+    """
+    query = session.query(models.TestResults.test_id)
+    try:
+        test_uuid = uuid.UUID(passed_test[3:] if passed_test.startswith('id-')
+                              else passed_test)
+    except ValueError:
+        return query.filter(models.TestResults.name == passed_test)
+    return query.filter(models.TestResults.uuid == str(test_uuid))
+
+
 def _apply_filters_for_query(query, filters):
     """Apply filters for DB query."""
     start_date = filters.get(api_const.START_DATE)
@@ -250,6 +449,11 @@ def _apply_filters_for_query(query, filters):
                  .filter(models.ProductVersion.product_id ==
                          filters[api_const.PRODUCT_ID]))
 
+    passed_test = filters.get(api_const.PASSED_TEST)
+    if passed_test:
+        query = query.filter(models.Test.id.in_(
+            _get_passed_test_query(query.session, passed_test)))
+
     all_product_tests = filters.get(api_const.ALL_PRODUCT_TESTS)
     signed = api_const.SIGNED in filters
     # If we only want to get the user's test results.
@@ -274,14 +478,14 @@ def _apply_filters_for_query(query, filters):
     return query
 
 
-def get_test_result_records(page, per_page, filters):
+def get_test_result_records(page, per_page, filters, limit=None):
     """Get page with list of test records."""
     session = get_session()
     query = session.query(models.Test)
     query = _apply_filters_for_query(query, filters)
     results = query.order_by(models.Test.created_at.desc()). \
         offset(per_page * (page - 1)). \
-        limit(per_page).all()
+        limit(limit or per_page).all()
     return _to_dict(results)
 
 
@@ -294,10 +498,70 @@ def get_test_result_records_count(filters):
     return records_count
 
 
+def get_test_names(prefix, limit, filters=None):
+    """Get distinct names of passed tests starting with the given prefix.
+
+    Only test runs matching the filters are searched, with the same
+    visibility rules as listings of test runs.
+    """
+    session = get_session()
+    escaped_prefix = (prefix.replace('\\', '\\\\')
+                      .replace('%', '\\%')
+                      .replace('_', '\\_'))
+    visible_tests = _apply_filters_for_query(session.query(models.Test.id),
+                                             filters or {})
+    names = (session.query(models.TestResults.name)
+             .filter(models.TestResults.name.like(escaped_prefix + '%',
+                                                  escape='\\'))
+             .filter(models.TestResults.test_id.in_(visible_tests))
+             .distinct()
+             .order_by(models.TestResults.name)
+             .limit(limit))
+    return [item.name for item in names]
+
+
+def get_shared_test_result_ids():
+    """Get IDs of all shared or verified test runs."""
+    session = get_session()
+    verified_results = (
+        session.query(models.Test.id)
+        .filter_by(verification_status=api_const.TEST_VERIFIED))
+    shared_results = (session.query(models.TestMeta.test_id)
+                      .filter_by(meta_key=api_const.SHARED_TEST_RUN))
+    return [test_id for test_id, in verified_results.union(shared_results)]
+
+
+def save_capability_stats(stats):
+    """Replace stored capability pass rate statistics."""
+    session = get_session()
+    with session.begin():
+        session.query(models.CapabilityStats).delete()
+        for item in stats:
+            capability_stats = models.CapabilityStats()
+            capability_stats.guideline = item['guideline']
+            capability_stats.capability = item['capability']
+            capability_stats.run_count = item['run_count']
+            capability_stats.pass_count = item['pass_count']
+            session.add(capability_stats)
+
+
+def get_capability_stats(guideline=None):
+    """Get capability pass rate statistics."""
+    session = get_session()
+    query = session.query(models.CapabilityStats)
+    if guideline:
+        query = query.filter_by(guideline=guideline)
+    query = query.order_by(models.CapabilityStats.guideline,
+                           models.CapabilityStats.capability)
+    return _to_dict(query.all())
+
+
 def user_get(user_openid):
     """Get user info by openid."""
     session = get_session()
-    user = session.query(models.User).filter_by(openid=user_openid).first()
+    query = _bakery(lambda s: s.query(models.User).filter_by(
+        openid=sqlalchemy.bindparam('openid')))
+    user = query(session).params(openid=user_openid).first()
     if user is None:
         raise NotFound('User with OpenID %s not found' % user_openid)
     return user
@@ -324,7 +588,9 @@ def get_pubkey(key):
     """
     session = get_session()
     md5_hash = hashlib.md5(base64.b64decode(key)).hexdigest()
-    pubkeys = session.query(models.PubKey).filter_by(md5_hash=md5_hash).all()
+    query = _bakery(lambda s: s.query(models.PubKey).filter_by(
+        md5_hash=sqlalchemy.bindparam('md5_hash')))
+    pubkeys = query(session).params(md5_hash=md5_hash).all()
     if len(pubkeys) == 1:
         return pubkeys[0]
     elif len(pubkeys) > 1:
@@ -367,11 +633,16 @@ def delete_pubkey(id):
         session.delete(key)
 
 
-def get_user_pubkeys(user_openid):
-    """Get public pubkeys for specified user."""
+def get_user_pubkeys(user_openid, md5_hash=None):
+    """Get public pubkeys for specified user.
+
+    :param md5_hash: If given, only keys with this md5 hash are returned.
+    """
     session = get_session()
-    pubkeys = session.query(models.PubKey).filter_by(openid=user_openid).all()
-    return _to_dict(pubkeys)
+    query = session.query(models.PubKey).filter_by(openid=user_openid)
+    if md5_hash is not None:
+        query = query.filter_by(md5_hash=md5_hash)
+    return _to_dict(query.all())
 
 
 def add_user_to_group(user_openid, group_id, created_by_user):
@@ -455,6 +726,48 @@ def get_organization(organization_id, allowed_keys=None):
     return _to_dict(organization, allowed_keys=allowed_keys)
 
 
+def get_organization_version(organization_id):
+    """Get the version of an organization and of the data shown with it."""
+    session = get_session()
+    group_ids = (session.query(models.Organization.group_id)
+                 .filter_by(id=organization_id))
+    product_ids = (session.query(models.Product.id)
+                   .filter_by(organization_id=organization_id))
+    version_ids = (session.query(models.ProductVersion.id)
+                   .filter(models.ProductVersion.product_id.in_(product_ids)))
+    test_ids = (session.query(models.Test.id)
+                .filter(models.Test.product_version_id.in_(version_ids)))
+    member_ids = (session.query(models.UserToGroup.user_openid)
+                  .filter(models.UserToGroup.group_id.in_(group_ids)))
+    # Counts of rows catch deletions, which leave no timestamps behind.
+    sources = (
+        (models.Organization, models.Organization.id == organization_id),
+        (models.Product, models.Product.organization_id == organization_id),
+        (models.ProductVersion,
+         models.ProductVersion.product_id.in_(product_ids)),
+        (models.Test, models.Test.id.in_(test_ids)),
+        (models.TestMeta, sqlalchemy.and_(
+            models.TestMeta.test_id.in_(test_ids),
+            models.TestMeta.meta_key == api_const.SHARED_TEST_RUN)),
+        (models.UserToGroup, models.UserToGroup.group_id.in_(group_ids)),
+        (models.User, models.User.openid.in_(member_ids)),
+    )
+    queries = [session.query(sqlalchemy.literal(i).label('source'),
+                             sqlalchemy.func.count(),
+                             sqlalchemy.func.max(model.created_at),
+                             sqlalchemy.func.max(model.updated_at))
+               .filter(criterion)
+               for i, (model, criterion) in enumerate(sources)]
+    rows = sorted(tuple(row)
+                  for row in queries[0].union_all(*queries[1:]).all())
+    if not rows[0][1]:
+        raise NotFound('Organization with id %s not found' % organization_id)
+    timestamps = [value for row in rows for value in row[2:] if value]
+    return {'updated_at': max(timestamps),
+            'version': '|'.join(six.text_type(value)
+                                for row in rows for value in row[1:])}
+
+
 def delete_organization(organization_id):
     """delete organization by id."""
     session = get_session()
@@ -520,7 +833,9 @@ def update_product(product_info):
 def get_product(id, allowed_keys=None):
     """Get product by id."""
     session = get_session()
-    product = session.query(models.Product).filter_by(id=id).first()
+    query = _bakery(lambda s: s.query(models.Product).filter_by(
+        id=sqlalchemy.bindparam('id')))
+    product = query(session).params(id=id).first()
     if product is None:
         raise NotFound('Product with id "%s" not found' % id)
     return _to_dict(product, allowed_keys=allowed_keys)
@@ -540,15 +855,15 @@ def delete_product(id):
 def get_foundation_users():
     """Get users' openid-s that belong to group of foundation."""
     session = get_session()
-    organization = (
-        session.query(models.Organization.group_id)
-        .filter_by(type=api_const.FOUNDATION).first())
+    query = _bakery(lambda s: s.query(models.Organization.group_id)
+                    .filter_by(type=api_const.FOUNDATION))
+    organization = query(session).first()
     if organization is None:
         LOG.warning('Foundation organization record not found in DB.')
         return []
-    group_id = organization.group_id
-    users = (session.query(models.UserToGroup.user_openid).
-             filter_by(group_id=group_id))
+    query = _bakery(lambda s: s.query(models.UserToGroup.user_openid)
+                    .filter_by(group_id=sqlalchemy.bindparam('group_id')))
+    users = query(session).params(group_id=organization.group_id)
     return [user.user_openid for user in users]
 
 
@@ -570,6 +885,37 @@ def get_organization_users(organization_id):
             for item in users}
 
 
+def get_foundation_group_id():
+    """Get ID of the group of the foundation organization."""
+    session = get_session()
+    organization = (
+        session.query(models.Organization.group_id)
+        .filter_by(type=api_const.FOUNDATION).first())
+    if organization is None:
+        LOG.warning('Foundation organization record not found in DB.')
+        return None
+    return organization.group_id
+
+
+def get_organization_group_id(organization_id):
+    """Get ID of the group of an organization."""
+    session = get_session()
+    organization = (session.query(models.Organization.group_id)
+                    .filter_by(id=organization_id).first())
+    if organization is None:
+        raise NotFound('Organization with id %s is not found'
+                       % organization_id)
+    return organization.group_id
+
+
+def get_user_group_ids(user_openid):
+    """Get IDs of groups the user belongs to."""
+    session = get_session()
+    items = (session.query(models.UserToGroup.group_id)
+             .filter_by(user_openid=user_openid))
+    return frozenset(item.group_id for item in items)
+
+
 def get_organizations(allowed_keys=None):
     """Get all organizations."""
     session = get_session()
@@ -680,6 +1026,36 @@ def get_product_version_by_cpid(cpid, allowed_keys=None):
     return _to_dict(version, allowed_keys=allowed_keys)
 
 
+def get_product_version_admins_by_cpid(cpid):
+    """Get product versions with a cloud provider id and their admins.
+
+    Returns a list with the id, the product id and the openids of the
+    vendor admins of each product version.
+    """
+    session = get_session()
+    query = (
+        session.query(models.ProductVersion.id,
+                      models.ProductVersion.product_id,
+                      models.UserToGroup.user_openid)
+        .join(models.Product,
+              models.Product.id == models.ProductVersion.product_id)
+        .join(models.Organization,
+              models.Organization.id == models.Product.organization_id)
+        .outerjoin(models.UserToGroup,
+                   models.UserToGroup.group_id ==
+                   models.Organization.group_id)
+        .filter(models.ProductVersion.cpid == cpid))
+    versions = {}
+    for version_id, product_id, user_openid in query.all():
+        version = versions.setdefault(version_id, {'id': version_id,
+                                                   'product_id': product_id,
+                                                   'admins': set()})
+        if user_openid:
+            version['admins'].add(user_openid)
+    return [dict(version, admins=frozenset(version['admins']))
+            for version in versions.values()]
+
+
 def get_product_versions(product_id, allowed_keys=None):
     """Get all versions for a product."""
     session = get_session()
@@ -690,6 +1066,59 @@ def get_product_versions(product_id, allowed_keys=None):
     return _to_dict(version_info, allowed_keys=allowed_keys)
 
 
+def get_product_versions_by_products(product_ids, allowed_keys=None):
+    """Get all versions of the given products."""
+    session = get_session()
+    versions = []
+    for chunk in _chunks(product_ids):
+        versions.extend(
+            session.query(models.ProductVersion)
+            .filter(models.ProductVersion.product_id.in_(chunk))
+            .order_by(models.ProductVersion.created_at).all())
+    return _to_dict(versions, allowed_keys=allowed_keys)
+
+
+def get_latest_test_results_by_versions(product_version_ids):
+    """Get the latest verified or shared test run of each product version.
+
+    Returns a dict of test runs keyed by product version ID. Versions
+    without verified or shared test runs are left out.
+    """
+    session = get_session()
+    shared_results = (session.query(models.TestMeta.test_id)
+                      .filter_by(meta_key=api_const.SHARED_TEST_RUN))
+    latest = {}
+    for chunk in _chunks(product_version_ids):
+        visible = sqlalchemy.and_(
+            models.Test.product_version_id.in_(chunk),
+            sqlalchemy.or_(
+                models.Test.verification_status ==
+                api_const.TEST_VERIFIED,
+                models.Test.id.in_(shared_results)))
+        newest = (
+            session.query(
+                models.Test.product_version_id,
+                sqlalchemy.func.max(models.Test.created_at).label(
+                    'created_at'))
+            .filter(visible)
+            .group_by(models.Test.product_version_id)
+            .subquery())
+        query = (
+            session.query(models.Test.id, models.Test.product_version_id,
+                          models.Test.created_at,
+                          models.Test.verification_status)
+            .join(newest, sqlalchemy.and_(
+                models.Test.product_version_id ==
+                newest.c.product_version_id,
+                models.Test.created_at == newest.c.created_at))
+            .filter(visible)
+            .order_by(models.Test.id))
+        for item in query.all():
+            # Test runs created at the same time are picked by ID.
+            latest.setdefault(item.product_version_id, _to_dict(item))
+    return latest
+
+
 def add_product_version(product_id, version, creator, cpid, allowed_keys=None):
     """Add a new product version."""
     product_version = models.ProductVersion()
@@ -51,6 +51,12 @@ class Test(BASE, RefStackBase):  # pragma: no cover
     """Test."""
 
     __tablename__ = 'test'
+    __table_args__ = (
+        sa.Index('ix_test_created_at', 'created_at'),
+        sa.Index('ix_test_verification_status_created_at',
+                 'verification_status', 'created_at'),
+        RefStackBase.__table_args__,
+    )
 
     id = sa.Column(sa.String(36), primary_key=True)
     cpid = sa.Column(sa.String(128), index=True, nullable=False)
@@ -87,6 +93,7 @@ class TestResults(BASE, RefStackBase):  # pragma: no cover
     __tablename__ = 'results'
     __table_args__ = (
         sa.UniqueConstraint('test_id', 'name'),
+        sa.Index('ix_results_name_test_id', 'name', 'test_id'),
         # TODO(sslypushenko)
         # Constraint should turned on after duplication test uuids issue
         # will be fixed
@@ -96,7 +103,7 @@ class TestResults(BASE, RefStackBase):  # pragma: no cover
     test_id = sa.Column(sa.String(36), sa.ForeignKey('test.id'),
                         index=True, nullable=False, unique=False)
     name = sa.Column(sa.String(512, collation='latin1_swedish_ci'),)
-    uuid = sa.Column(sa.String(36))
+    uuid = sa.Column(sa.String(36), index=True)
 
     @property
     def default_allowed_keys(self):
@@ -104,12 +111,65 @@ class TestResults(BASE, RefStackBase):  # pragma: no cover
         return 'name', 'uuid'
 
 
+class TestName(BASE, RefStackBase):  # pragma: no cover
+    """Registry of passed test names.
+
+    The id of a test name is its bit position in result bitsets.
+    """
+
+    __tablename__ = 'test_name'
+    id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
+    name = sa.Column(sa.String(512, collation='latin1_swedish_ci'),
+                     nullable=False, unique=True)
+
+    @property
+    def default_allowed_keys(self):
+        """Default keys."""
+        return 'id', 'name'
+
+
+class TestResultsBitset(BASE, RefStackBase):  # pragma: no cover
+    """Passed tests of a test run packed into a bitset."""
+
+    __tablename__ = 'results_bitset'
+    test_id = sa.Column(sa.String(36), sa.ForeignKey('test.id'),
+                        primary_key=True)
+    bits = sa.Column(sa.LargeBinary(), nullable=False)
+
+    @property
+    def default_allowed_keys(self):
+        """Default keys."""
+        return 'test_id', 'bits'
+
+
+class CapabilityStats(BASE, RefStackBase):  # pragma: no cover
+    """Pass rate of a guideline capability across shared test runs."""
+
+    __tablename__ = 'capability_stats'
+    __table_args__ = (
+        sa.UniqueConstraint('guideline', 'capability'),
+    )
+    _id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
+    guideline = sa.Column(sa.String(64), nullable=False)
+    capability = sa.Column(sa.String(128), nullable=False)
+    run_count = sa.Column(sa.Integer, nullable=False)
+    pass_count = sa.Column(sa.Integer, nullable=False)
+
+    @property
+    def default_allowed_keys(self):
+        """Default keys."""
+        return ('guideline', 'capability', 'run_count', 'pass_count',
+                'created_at')
+
+
 class TestMeta(BASE, RefStackBase):  # pragma: no cover
     """Test metadata."""
 
     __tablename__ = 'meta'
     __table_args__ = (
         sa.UniqueConstraint('test_id', 'meta_key'),
+        sa.Index('ix_meta_meta_key_value', 'meta_key', 'value',
+                 mysql_length={'value': 128}),
     )
     _id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
     test_id = sa.Column(sa.String(36), sa.ForeignKey('test.id'),
@@ -185,6 +245,11 @@ class UserToGroup(BASE, RefStackBase):  # pragma: no cover
     """user-group as many-to-many."""
 
     __tablename__ = 'user_to_group'
+    __table_args__ = (
+        sa.Index('ix_user_to_group_group_id_user_openid',
+                 'group_id', 'user_openid'),
+        RefStackBase.__table_args__,
+    )
 
     created_by_user = sa.Column(sa.String(128), nullable=False)
     _id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
@@ -206,7 +271,7 @@ class Organization(BASE, RefStackBase):  # pragma: no cover
 
     id = sa.Column(sa.String(36), primary_key=True,
                    default=lambda: six.text_type(uuid.uuid4()))
-    type = sa.Column(sa.Integer, nullable=False)
+    type = sa.Column(sa.Integer, nullable=False, index=True)
     name = sa.Column(sa.String(80), nullable=False)
     description = sa.Column(sa.Text())
     group_id = sa.Column(sa.String(36), sa.ForeignKey('group.id'),
@@ -226,6 +291,11 @@ class Product(BASE, RefStackBase):  # pragma: no cover
     """Product definition."""
 
     __tablename__ = 'product'
+    __table_args__ = (
+        sa.Index('ix_product_organization_id_created_at',
+                 'organization_id', 'created_at'),
+        RefStackBase.__table_args__,
+    )
 
     id = sa.Column(sa.String(36), primary_key=True,
                    default=lambda: six.text_type(uuid.uuid4()))
@@ -260,7 +330,7 @@ class ProductVersion(BASE, RefStackBase):
     product_id = sa.Column(sa.String(36), sa.ForeignKey('product.id'),
                            index=True, nullable=False, unique=False)
     version = sa.Column(sa.String(length=36), nullable=True)
-    cpid = sa.Column(sa.String(36), nullable=True)
+    cpid = sa.Column(sa.String(36), nullable=True, index=True)
     created_by_user = sa.Column(sa.String(128), sa.ForeignKey('user.openid'),
                                 nullable=False)
     product_info = orm.relationship('Product', backref='product_version')
@@ -36,6 +36,8 @@ import itertools
 import refstack.api.app
 import refstack.api.controllers.v1
 import refstack.api.controllers.auth
+import refstack.api.http_client
+import refstack.api.response_cache
 import refstack.db.api
 
 
@@ -48,7 +50,10 @@ def list_opts():
         #
         ('DEFAULT', itertools.chain(refstack.api.app.UI_OPTS,
                                     refstack.db.api.db_opts)),
-        ('api', itertools.chain(refstack.api.app.API_OPTS,
-                                refstack.api.controllers.CTRLS_OPTS)),
+        ('api', itertools.chain(
+            refstack.api.app.API_OPTS,
+            refstack.api.controllers.CTRLS_OPTS,
+            refstack.api.http_client.HTTP_OPTS,
+            refstack.api.response_cache.RESPONSE_CACHE_OPTS)),
         ('osid', refstack.api.controllers.auth.OPENID_OPTS),
     ]
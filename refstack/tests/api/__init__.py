@@ -60,6 +60,10 @@ class FunctionalTest(base.BaseTestCase):
         self.CONF.set_override('connection',
                                self.connection,
                                'database')
+        # Guidelines are fetched on request, so they can be mocked.
+        self.CONF.set_override('guidelines_refresh_interval', 0, 'api')
+        # The database is emptied between tests, bypassing invalidation.
+        self.CONF.set_override('response_cache_ttl', 0, 'api')
 
         self.app = pecan.testing.load_test_app(self.config)
 
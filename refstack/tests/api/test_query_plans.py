@@ -0,0 +1,320 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Query plans of the hot queries of the DB API.
+
+The database is seeded with enough rows for MySQL to prefer indexes over
+table scans whenever an index can answer a query. Every SELECT statement
+executed by a DB API function is then explained, and the test fails if
+a table is fully scanned.
+
+Listings of test runs shown to anonymous users select the test runs which
+were not uploaded by a user with NOT IN, which can't be answered with an
+index. For these, only the tables of test results and metadata are
+checked.
+"""
+
+import base64
+import datetime
+import hashlib
+import types
+
+from sqlalchemy import event
+
+from refstack.api import constants as api_const
+from refstack.db.sqlalchemy import api as db_api
+from refstack.db.sqlalchemy import models
+from refstack.tests import api
+
+USER_COUNT = 300
+VENDOR_COUNT = 100
+PRODUCTS_PER_VENDOR = 3
+VERSIONS_PER_PRODUCT = 2
+TEST_COUNT = 2000
+RESULTS_PER_TEST = 5
+TEST_NAME_COUNT = 500
+
+
+def _get_pubkey(i):
+    return base64.b64encode(('fake-key-%d' % i).encode('utf-8')).decode()
+
+
+class TestQueryPlans(api.FunctionalTest):
+    """Test case for query plans of the DB API."""
+
+    def setUp(self):
+        super(TestQueryPlans, self).setUp()
+        self.engine = db_api.get_engine()
+        self._seed()
+
+    def _insert(self, model, rows):
+        self.engine.execute(model.__table__.insert(), rows)
+
+    def _seed(self):
+        """Fill every table with a few thousand rows and analyze them."""
+        now = datetime.datetime(2018, 1, 1)
+        self._insert(models.User, [
+            {'openid': 'user-%d' % i, 'email': 'user-%d@example.com' % i,
+             'fullname': 'User %d' % i, 'created_at': now}
+            for i in range(USER_COUNT)])
+        self._insert(models.PubKey, [
+            {'id': 'key-%d' % i, 'openid': 'user-%d' % i, 'format': 'ssh-rsa',
+             'pubkey': _get_pubkey(i), 'comment': 'key %d' % i,
+             'md5_hash': hashlib.md5(
+                 base64.b64decode(_get_pubkey(i))).hexdigest(),
+             'created_at': now}
+            for i in range(USER_COUNT)])
+
+        # The first organization is the Foundation, and one vendor out of
+        # ten is official.
+        self._insert(models.Group, [
+            {'id': 'group-%d' % i, 'name': 'group %d' % i, 'created_at': now}
+            for i in range(VENDOR_COUNT + 1)])
+        self._insert(models.UserToGroup, [
+            {'user_openid': 'user-%d' % i,
+             'group_id': 'group-%d' % (i % (VENDOR_COUNT + 1)),
+             'created_by_user': 'user-0', 'created_at': now}
+            for i in range(USER_COUNT)])
+        self._insert(models.Organization, [
+            {'id': 'org-%d' % i, 'name': 'vendor %d' % i,
+             'type': (api_const.FOUNDATION if i == 0 else
+                      api_const.OFFICIAL_VENDOR if i % 10 == 0 else
+                      api_const.PRIVATE_VENDOR),
+             'group_id': 'group-%d' % i, 'created_by_user': 'user-0',
+             'created_at': now + datetime.timedelta(minutes=i)}
+            for i in range(VENDOR_COUNT + 1)])
+
+        product_count = VENDOR_COUNT * PRODUCTS_PER_VENDOR
+        self._insert(models.Product, [
+            {'id': 'prod-%d' % i, 'name': 'product %d' % i,
+             'organization_id': 'org-%d' % (i % VENDOR_COUNT + 1),
+             'created_by_user': 'user-0', 'public': i % 2 == 0,
+             'type': 0, 'product_type': 0,
+             'created_at': now + datetime.timedelta(minutes=i)}
+            for i in range(product_count)])
+        version_count = product_count * VERSIONS_PER_PRODUCT
+        self._insert(models.ProductVersion, [
+            {'id': 'ver-%d' % i, 'product_id': 'prod-%d' % (i % product_count),
+             'version': str(i // product_count), 'cpid': 'cpid-%d' % i,
+             'created_by_user': 'user-0', 'created_at': now}
+            for i in range(version_count)])
+
+        self._insert(models.Test, [
+            {'id': 'test-%d' % i, 'cpid': 'cpid-%d' % (i % version_count),
+             'duration_seconds': 10,
+             'product_version_id': ('ver-%d' % (i % version_count)
+                                    if i % 3 == 0 else None),
+             'verification_status': 1 if i % 20 == 0 else 0,
+             'created_at': now + datetime.timedelta(hours=i)}
+            for i in range(TEST_COUNT)])
+        meta = []
+        for i in range(TEST_COUNT):
+            if i % 3:
+                meta.append({'test_id': 'test-%d' % i,
+                             'meta_key': api_const.USER,
+                             'value': 'user-%d' % (i % USER_COUNT),
+                             'created_at': now})
+            if i % 10 == 0:
+                meta.append({'test_id': 'test-%d' % i,
+                             'meta_key': api_const.SHARED_TEST_RUN,
+                             'value': 'true', 'created_at': now})
+        self._insert(models.TestMeta, meta)
+        self._insert(models.TestResults, [
+            {'test_id': 'test-%d' % i, 'name': 'tempest.test_%d' % j,
+             'uuid': '%08d-0000-0000-0000-%012d' % (j, j),
+             'created_at': now}
+            for i in range(TEST_COUNT) for j in range(RESULTS_PER_TEST)])
+        self._insert(models.TestName, [
+            {'id': j + 1, 'name': 'tempest.test_%d' % j,
+             'created_at': now}
+            for j in range(TEST_NAME_COUNT)])
+        self._insert(models.TestResultsBitset, [
+            {'test_id': 'test-%d' % i, 'bits': b'\x1f', 'created_at': now}
+            for i in range(TEST_COUNT)])
+
+        for model in (models.User, models.PubKey, models.Group,
+                      models.UserToGroup, models.Organization,
+                      models.Product, models.ProductVersion, models.Test,
+                      models.TestMeta, models.TestResults, models.TestName,
+                      models.TestResultsBitset):
+            self.engine.execute('ANALYZE TABLE `%s`' %
+                                model.__table__.name)
+
+    def _explain(self, statement, parameters):
+        """Get the rows of the query plan of a statement as dicts."""
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute('EXPLAIN ' + statement, parameters)
+            columns = [column[0].lower() for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        finally:
+            connection.close()
+
+    def _get_scans(self, func, *args, **kwargs):
+        """Get the tables fully scanned by statements of a function.
+
+        Returns a list of the scanned tables and the statements which
+        scan them.
+        """
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context,
+                    executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append((statement, parameters))
+
+        event.listen(self.engine, 'before_cursor_execute', capture)
+        try:
+            result = func(*args, **kwargs)
+            if isinstance(result, types.GeneratorType):
+                list(result)
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', capture)
+
+        self.assertTrue(statements, '%s executed no query' % func.__name__)
+        scans = []
+        for statement, parameters in statements:
+            for row in self._explain(statement, parameters):
+                # Derived tables and subquery results are built by MySQL
+                # and have no indexes.
+                if row['type'] == 'ALL' and \
+                        not (row['table'] or '').startswith('<'):
+                    scans.append((row['table'], statement))
+        return scans
+
+    def assertIndexed(self, func, *args, **kwargs):
+        """Assert that no statement of the function scans a table."""
+        for table, statement in self._get_scans(func, *args, **kwargs):
+            self.fail('%s scans table %s: %s' %
+                      (func.__name__, table, statement))
+
+    def assertResultsIndexed(self, func, *args, **kwargs):
+        """Assert that the function scans no test results or metadata."""
+        tables = (models.TestResults.__tablename__,
+                  models.TestMeta.__tablename__)
+        for table, statement in self._get_scans(func, *args, **kwargs):
+            if table in tables:
+                self.fail('%s scans table %s: %s' %
+                          (func.__name__, table, statement))
+
+    def test_test_result_lookups(self):
+        """Test lookups of a single test run."""
+        self.assertIndexed(db_api.get_test_result, 'test-3')
+        self.assertIndexed(db_api.get_test_result_version, 'test-3')
+        self.assertIndexed(db_api.get_test_results, 'test-3')
+        self.assertIndexed(db_api.get_test_result_meta_key, 'test-3',
+                           api_const.USER)
+        self.assertIndexed(db_api.get_test_result_bitsets,
+                           ['test-3', 'test-4'])
+        self.assertIndexed(db_api.get_test_name_bits,
+                           ['tempest.test_1', 'tempest.test_2'])
+        self.assertIndexed(db_api.get_last_test_name_bit)
+
+    def test_test_result_records(self):
+        """Test pages of test runs with filters."""
+        start_date = datetime.datetime(2018, 2, 1)
+        filters_list = [
+            {api_const.SIGNED: True, api_const.OPENID: 'user-7'},
+            {api_const.ALL_PRODUCT_TESTS: True},
+            {api_const.ALL_PRODUCT_TESTS: True,
+             api_const.VERIFICATION_STATUS: 1},
+            {api_const.ALL_PRODUCT_TESTS: True, api_const.CPID: 'cpid-7'},
+            {api_const.ALL_PRODUCT_TESTS: True,
+             api_const.PRODUCT_ID: 'prod-7'},
+            {api_const.ALL_PRODUCT_TESTS: True,
+             api_const.START_DATE: start_date,
+             api_const.END_DATE: start_date + datetime.timedelta(days=2)},
+        ]
+        for filters in filters_list:
+            self.assertIndexed(db_api.get_test_result_records, 1, 20,
+                               filters)
+        self.assertIndexed(db_api.get_test_result_records_count,
+                           {api_const.ALL_PRODUCT_TESTS: True,
+                            api_const.VERIFICATION_STATUS: 1})
+
+    def test_test_result_records_passed_test(self):
+        """Test pages of test runs which passed a test."""
+        for passed_test in ('tempest.test_3',
+                            '00000003-0000-0000-0000-000000000003',
+                            'id-00000003-0000-0000-0000-000000000003'):
+            filters = {api_const.ALL_PRODUCT_TESTS: True,
+                       api_const.PASSED_TEST: passed_test}
+            self.assertIndexed(db_api.get_test_result_records, 1, 20,
+                               filters)
+            self.assertIndexed(db_api.get_test_result_records_count,
+                               filters)
+
+    def test_anonymous_test_result_records(self):
+        """Test pages of test runs shown to anonymous users."""
+        filters_list = [
+            {},
+            {api_const.CPID: 'cpid-7'},
+            {api_const.PASSED_TEST: 'tempest.test_3'},
+            {api_const.PASSED_TEST: '00000003-0000-0000-0000-000000000003'},
+        ]
+        for filters in filters_list:
+            self.assertResultsIndexed(db_api.get_test_result_records, 1, 20,
+                                      filters)
+            self.assertResultsIndexed(db_api.get_test_result_records_count,
+                                      filters)
+        self.assertResultsIndexed(db_api.get_shared_test_result_ids)
+
+    def test_test_names(self):
+        """Test searches of passed test names."""
+        self.assertResultsIndexed(db_api.get_test_names, 'tempest.test_1', 20)
+        self.assertIndexed(db_api.get_test_names, 'tempest.test_1', 20,
+                           {api_const.SIGNED: True,
+                            api_const.OPENID: 'user-7'})
+        self.assertIndexed(db_api.get_test_names, 'tempest.test_1', 20,
+                           {api_const.ALL_PRODUCT_TESTS: True})
+        self.assertIndexed(db_api.get_test_results_by_name,
+                           ['test-3', 'test-4', 'test-5'])
+
+    def test_product_lookups(self):
+        """Test lookups of products and product versions."""
+        self.assertIndexed(db_api.get_product, 'prod-7')
+        self.assertIndexed(db_api.get_product_by_version, 'ver-7')
+        self.assertIndexed(db_api.get_product_version, 'ver-7')
+        self.assertIndexed(db_api.get_product_versions_by_products,
+                           ['prod-0', 'prod-7'])
+        self.assertIndexed(db_api.get_products,
+                           filters={'organization_id': 'org-7'})
+        self.assertIndexed(db_api.get_products_by_user, 'user-7',
+                           filters={'organization_id': 'org-7'})
+        self.assertIndexed(db_api.get_product_versions, 'prod-7')
+        self.assertIndexed(db_api.get_product_version_by_cpid, 'cpid-7')
+        self.assertIndexed(db_api.get_product_version_admins_by_cpid,
+                           'cpid-7')
+        self.assertIndexed(db_api.get_latest_test_results_by_versions,
+                           ['ver-0', 'ver-7'])
+
+    def test_membership_lookups(self):
+        """Test lookups of organizations and group memberships."""
+        self.assertIndexed(db_api.get_foundation_group_id)
+        self.assertIndexed(db_api.get_foundation_users)
+        self.assertIndexed(db_api.get_organization_group_id, 'org-7')
+        self.assertIndexed(db_api.get_user_group_ids, 'user-7')
+        self.assertIndexed(db_api.get_organization, 'org-7')
+        self.assertIndexed(db_api.get_organization_users, 'org-7')
+        self.assertIndexed(db_api.get_organization_version, 'org-7')
+        self.assertIndexed(db_api.get_organizations_by_types,
+                           [api_const.OFFICIAL_VENDOR])
+        self.assertIndexed(db_api.get_organizations_by_user, 'user-7')
+
+    def test_user_lookups(self):
+        """Test lookups of users and their public keys."""
+        self.assertIndexed(db_api.user_get, 'user-7')
+        self.assertIndexed(db_api.get_pubkey, _get_pubkey(7))
+        self.assertIndexed(db_api.get_user_pubkeys, 'user-7')
@@ -299,6 +299,84 @@ class TestResultsEndpoint(api.FunctionalTest):
         for r in results['results']:
             self.assertIn(r['id'], response_test_ids)
 
+    def test_get_with_passed_test_filter(self):
+        test_uuid = '2b4c3b4e-4e1e-4d3c-9f4c-2f0e8b6a4e21'
+        fake_results = {
+            'cpid': '12345',
+            'duration_seconds': 1,
+            'results': [
+                {'name': 'tempest.foo', 'uuid': test_uuid},
+                {'name': 'tempest.bar'}
+            ]
+        }
+        foo_response = self.post_json(self.URL,
+                                      params=json.dumps(fake_results))
+        fake_results['results'] = [{'name': 'tempest.bar'}]
+        bar_response = self.post_json(self.URL,
+                                      params=json.dumps(fake_results))
+
+        results = self.get_json('/v1/results?passed_test=tempest.foo')
+        self.assertEqual([foo_response['test_id']],
+                         [r['id'] for r in results['results']])
+
+        results = self.get_json('/v1/results?passed_test=id-' + test_uuid)
+        self.assertEqual([foo_response['test_id']],
+                         [r['id'] for r in results['results']])
+
+        results = self.get_json('/v1/results?passed_test=tempest.bar')
+        self.assertEqual(
+            sorted([foo_response['test_id'], bar_response['test_id']]),
+            sorted(r['id'] for r in results['results']))
+
+        results = self.get_json('/v1/results/test_names?prefix=tempest.f')
+        self.assertEqual({'test_names': ['tempest.foo']}, results)
+
+    def test_get_test_names_of_private_test_run(self):
+        fake_results = {
+            'cpid': '12345',
+            'duration_seconds': 1,
+            'results': [{'name': 'tempest.private'}]
+        }
+        response = self.post_json(self.URL, params=json.dumps(fake_results))
+        db.save_test_result_meta_item(response['test_id'],
+                                      api_const.USER, 'fake-openid')
+
+        # Signed test runs which aren't shared are not searched.
+        results = self.get_json('/v1/results/test_names?prefix=tempest.p')
+        self.assertEqual({'test_names': []}, results)
+
+        db.save_test_result_meta_item(response['test_id'],
+                                      api_const.SHARED_TEST_RUN, 'true')
+        results = self.get_json('/v1/results/test_names?prefix=tempest.p')
+        self.assertEqual({'test_names': ['tempest.private']}, results)
+
+    def test_compare(self):
+        test_ids = []
+        for names in (('tempest.a', 'tempest.b'),
+                      ('tempest.a', 'tempest.c')):
+            fake_results = {
+                'cpid': '12345',
+                'duration_seconds': 1,
+                'results': [{'name': name} for name in names]
+            }
+            response = self.post_json(self.URL,
+                                      params=json.dumps(fake_results))
+            test_ids.append(response['test_id'])
+
+        results = self.get_json('/v1/results/compare?ids=' +
+                                ','.join(test_ids))
+        self.assertEqual(test_ids, results['results'])
+        self.assertEqual(['tempest.a'], results['common'])
+        self.assertEqual({test_ids[0]: ['tempest.b'],
+                          test_ids[1]: ['tempest.c']}, results['unique'])
+        self.assertEqual([{'from': test_ids[0], 'to': test_ids[1],
+                           'gained': ['tempest.c'], 'lost': ['tempest.b']}],
+                         results['changes'])
+
+        self.assertRaises(webtest.app.AppError,
+                          self.get_json,
+                          '/v1/results/compare?ids=' + test_ids[0])
+
     def test_get_with_date_filters(self):
         self.CONF.set_override('results_per_page',
                                10,
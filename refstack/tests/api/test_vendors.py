@@ -149,6 +149,58 @@ class TestVendorsEndpoint(api.FunctionalTest):
         self.assertEqual(props['properties'],
                          json.loads(get_response['properties']))
 
+    @mock.patch('refstack.api.utils.get_user_id', return_value='test-open-id')
+    def test_get_dashboard(self, mock_get_user):
+        """Test getting the dashboard of a vendor."""
+        org = db.add_organization({'name': 'test-vendor'}, 'test-open-id')
+        prod_info = {'name': 'product1',
+                     'description': 'product description',
+                     'product_type': 1, 'type': 0,
+                     'organization_id': org['id'], 'public': True}
+        prod1 = db.add_product(prod_info, 'test-open-id')
+        prod_info['name'] = 'product2'
+        prod_info['public'] = False
+        prod2 = db.add_product(prod_info, 'test-open-id')
+        version = db.add_product_version(prod1['id'], '1.0', 'test-open-id')
+
+        test_ids = [db.store_test_results(
+            {'cpid': 'foo', 'duration_seconds': 10,
+             'results': [{'name': 'tempest.foo'}]}) for _ in range(3)]
+        db.update_test_result({'id': test_ids[0],
+                               'product_version_id': version['id'],
+                               'verification_status': 1})
+        db.update_test_result({'id': test_ids[1],
+                               'product_version_id': version['id']})
+        db.save_test_result_meta_item(test_ids[1], 'shared', 'true')
+        # Private test runs are not listed.
+        db.update_test_result({'id': test_ids[2],
+                               'product_version_id': version['id']})
+
+        url = self.URL + org['id'] + '/dashboard'
+        dashboard = self.get_json(url)
+        self.assertEqual(org['id'], dashboard['vendor']['id'])
+        self.assertTrue(dashboard['vendor']['can_manage'])
+        self.assertEqual(['test-open-id'],
+                         [user['openid'] for user in dashboard['users']])
+        self.assertEqual([prod1['id'], prod2['id']],
+                         [product['id'] for product in dashboard['products']])
+        versions = {version['version']: version
+                    for version in dashboard['products'][0]['versions']}
+        self.assertEqual([None, '1.0'], sorted(versions, key=str))
+        self.assertIsNone(versions[None]['latest_result'])
+        self.assertIn(versions['1.0']['latest_result']['id'], test_ids[:2])
+
+        # Only public information of official vendors is given to others.
+        mock_get_user.return_value = 'some-user'
+        self.assertRaises(webtest.app.AppError, self.get_json, url)
+        db.update_organization({'id': org['id'],
+                                'type': api_const.OFFICIAL_VENDOR})
+        dashboard = self.get_json(url)
+        self.assertNotIn('group_id', dashboard['vendor'])
+        self.assertIsNone(dashboard['users'])
+        self.assertEqual([prod1['id']],
+                         [product['id'] for product in dashboard['products']])
+
     def test_get_one_invalid_url(self):
         """Test get request with invalid url."""
         self.assertRaises(webtest.app.AppError,
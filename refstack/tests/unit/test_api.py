@@ -16,17 +16,21 @@
 """Tests for API's controllers"""
 
 import json
+import uuid
+import zlib
 
 import mock
 from oslo_config import fixture as config_fixture
 from six.moves.urllib import parse
 import webob.exc
 
+from refstack.api import cache
 from refstack.api import constants as const
 from refstack.api import exceptions as api_exc
 from refstack.api.controllers import auth
 from refstack.api.controllers import guidelines
 from refstack.api.controllers import results
+from refstack.api.controllers import stats
 from refstack.api.controllers import user
 from refstack.api.controllers import validation
 from refstack.api.controllers import vendors
@@ -79,6 +83,12 @@ class ResultsControllerTestCase(BaseControllerTestCase):
                                self.test_results_url,
                                'api')
         self.CONF.set_override('ui_url', self.ui_url)
+        self.mock_request.GET = {}
+        self.mock_get_version = self.setup_mock(
+            'refstack.db.get_test_result_version',
+            return_value={'verification_status': const.TEST_NOT_VERIFIED,
+                          'updated_at': None,
+                          'version': 'fake-version'})
 
     @mock.patch('refstack.db.get_test_result')
     @mock.patch('refstack.db.get_test_results')
@@ -145,6 +155,35 @@ class ResultsControllerTestCase(BaseControllerTestCase):
                                       'verification_status']
         )
 
+    @mock.patch('refstack.db.get_test_result')
+    @mock.patch('refstack.db.get_test_results')
+    def test_get_not_modified(self, mock_get_test_results,
+                              mock_get_test_result):
+        self.mock_get_user_role.return_value = const.ROLE_USER
+        self.mock_get_version.return_value['verification_status'] = \
+            const.TEST_VERIFIED
+        self.mock_request.if_none_match = []
+        self.mock_response.headers = {}
+        self.controller.get_one('fake_arg')
+        etag = self.mock_response.etag
+        # Verified test runs may be unverified, so they are revalidated.
+        self.assertEqual('private, no-cache',
+                         self.mock_response.headers['Cache-Control'])
+
+        # The test run isn't retrieved again if the client has it.
+        mock_get_test_result.reset_mock()
+        mock_get_test_results.reset_mock()
+        self.mock_request.if_none_match = [etag]
+        self.assertIsNone(self.controller.get_one('fake_arg'))
+        self.assertFalse(mock_get_test_result.called)
+        self.assertFalse(mock_get_test_results.called)
+
+        # The ETag changes with the user role.
+        self.mock_get_user_role.return_value = const.ROLE_OWNER
+        self.controller.get_one('fake_arg')
+        self.assertNotEqual(etag, self.mock_response.etag)
+        self.assertTrue(mock_get_test_result.called)
+
     @mock.patch('refstack.db.store_test_results')
     def test_post(self, mock_store_test_results):
         self.mock_request.body = b'{"answer": 42}'
@@ -161,22 +200,22 @@ class ResultsControllerTestCase(BaseControllerTestCase):
         mock_store_test_results.assert_called_once_with({'answer': 42})
 
     @mock.patch('refstack.api.utils.check_user_is_foundation_admin')
-    @mock.patch('refstack.api.utils.check_user_is_product_admin')
-    @mock.patch('refstack.db.get_product_version_by_cpid')
+    @mock.patch('refstack.db.get_product_version_admins_by_cpid')
     @mock.patch('refstack.db.store_test_results')
     @mock.patch('refstack.db.get_pubkey')
     def test_post_with_sign(self, mock_get_pubkey, mock_store_test_results,
-                            mock_get_version, mock_check, mock_foundation):
+                            mock_get_version, mock_foundation):
         self.mock_request.body = b'{"answer": 42, "cpid": "123"}'
         self.mock_request.headers = {
             'X-Signature': 'fake-sign',
             'X-Public-Key': 'ssh-rsa Zm9vIGJhcg=='
         }
 
+        self.addCleanup(cache.upload_keys.clear)
         mock_get_pubkey.return_value.openid = 'fake_openid'
-        mock_get_version.return_value = [{'id': 'ver1',
-                                          'product_id': 'prod1'}]
-        mock_check.return_value = True
+        mock_get_version.return_value = [{
+            'id': 'ver1', 'product_id': 'prod1',
+            'admins': frozenset(['fake_openid'])}]
         mock_foundation.return_value = False
         mock_store_test_results.return_value = 'fake_test_id'
         result = self.controller.post()
@@ -184,11 +223,22 @@ class ResultsControllerTestCase(BaseControllerTestCase):
                          {'test_id': 'fake_test_id',
                           'url': self.test_results_url % 'fake_test_id'})
         self.assertEqual(self.mock_response.status, 201)
-        mock_check.assert_called_once_with('prod1', 'fake_openid')
+        mock_get_version.assert_called_once_with('123')
+        # Vendor admins don't need further authorization checks.
+        self.assertFalse(mock_foundation.called)
         mock_store_test_results.assert_called_once_with(
             {'answer': 42, 'cpid': '123', 'product_version_id': 'ver1',
              'meta': {const.USER: 'fake_openid'}}
         )
+        mock_get_pubkey.assert_called_once_with('Zm9vIGJhcg==')
+
+        # Keys which are not stored are rejected.
+        self.mock_request.headers['X-Public-Key'] = 'ssh-rsa YmFyIGZvbw=='
+        mock_get_pubkey.return_value = None
+        self.assertRaises(webob.exc.HTTPError, self.controller.post)
+        self.mock_abort.assert_called_once_with(
+            401, 'User with specified key not found. Please log into the '
+                 'RefStack server to upload your key.')
 
     @mock.patch('refstack.db.get_test_result')
     def test_get_item_failed(self, mock_get_test_result):
@@ -260,7 +310,8 @@ class ResultsControllerTestCase(BaseControllerTestCase):
             const.CPID,
             const.SIGNED,
             const.VERIFICATION_STATUS,
-            const.PRODUCT_ID
+            const.PRODUCT_ID,
+            const.PASSED_TEST
         ]
         page_number = 1
         total_pages_number = 10
@@ -299,6 +350,46 @@ class ResultsControllerTestCase(BaseControllerTestCase):
         db_get_test_result.assert_called_once_with(
             page_number, per_page, filters)
 
+    @mock.patch('refstack.api.utils.check_owner')
+    @mock.patch('refstack.api.utils.check_user_is_foundation_admin')
+    @mock.patch('refstack.db.get_approximate_test_result_records_count')
+    @mock.patch('refstack.db.get_test_result_records')
+    @mock.patch('refstack.db.get_test_result_records_count')
+    @mock.patch('refstack.api.utils.parse_input_params')
+    def test_get_has_more(self, parse_input, get_count, get_records,
+                          get_approximate_count, check_foundation,
+                          check_owner):
+        self.CONF.set_override('results_per_page', 2, 'api')
+        check_foundation.return_value = False
+        check_owner.return_value = True
+        self.mock_request.GET = {const.PAGINATION: const.PAGINATION_HAS_MORE,
+                                 const.PAGE: '3'}
+        get_records.return_value = [{'id': 1}, {'id': 2}, {'id': 3}]
+
+        result = self.controller.get()
+        self.assertEqual([1, 2], [r['id'] for r in result['results']])
+        self.assertEqual({'current_page': 3, 'has_more': True},
+                         result['pagination'])
+        filters = parse_input.return_value
+        get_records.assert_called_once_with(3, 2, filters, limit=3)
+        self.assertFalse(get_count.called)
+        self.assertFalse(get_approximate_count.called)
+
+        # Totals are given from the approximate count if requested.
+        self.mock_request.GET[const.PAGINATION] = \
+            const.PAGINATION_APPROXIMATE
+        get_records.return_value = [{'id': 5}]
+        get_approximate_count.return_value = 5
+        result = self.controller.get()
+        self.assertEqual({'current_page': 3, 'has_more': False,
+                          'approximate_total_pages': 3},
+                         result['pagination'])
+        get_approximate_count.assert_called_once_with(filters)
+        self.assertFalse(get_count.called)
+
+        self.mock_request.GET[const.PAGINATION] = 'fake'
+        self.assertRaises(api_exc.ParseInputsError, self.controller.get)
+
     @mock.patch('refstack.db.get_test_result')
     @mock.patch('refstack.db.delete_test_result')
     def test_delete(self, mock_db_delete, mock_get_test_result):
@@ -317,6 +408,86 @@ class ResultsControllerTestCase(BaseControllerTestCase):
         self.assertRaises(webob.exc.HTTPError,
                           self.controller.delete, 'test_id')
 
+    @mock.patch('refstack.api.utils.check_user_is_foundation_admin')
+    @mock.patch('refstack.api.utils.parse_input_params')
+    @mock.patch('refstack.db.get_test_names')
+    def test_test_names(self, mock_get_test_names, mock_parse,
+                        mock_is_foundation):
+        self.CONF.set_override('results_per_page', 5, 'api')
+        self.mock_request.GET = {const.PREFIX: 'tempest.api'}
+        mock_get_test_names.return_value = ['tempest.api.foo']
+        mock_parse.return_value = {}
+        mock_is_foundation.return_value = False
+        self.assertEqual({'test_names': ['tempest.api.foo']},
+                         self.controller.test_names())
+        mock_parse.assert_called_once_with([const.SIGNED])
+        mock_get_test_names.assert_called_once_with('tempest.api', 5,
+                                                    filters={})
+
+        # Foundation admins search all test runs.
+        mock_is_foundation.return_value = True
+        self.controller.test_names()
+        mock_get_test_names.assert_called_with(
+            'tempest.api', 5, filters={const.ALL_PRODUCT_TESTS: True})
+
+        # Signed test runs of the user are searched with signed=true.
+        mock_parse.return_value = {const.SIGNED: 'true',
+                                   const.OPENID: 'fake-openid'}
+        self.controller.test_names()
+        mock_get_test_names.assert_called_with(
+            'tempest.api', 5, filters={const.SIGNED: 'true',
+                                       const.OPENID: 'fake-openid'})
+
+    @mock.patch('refstack.api.utils.enforce_permissions')
+    @mock.patch('refstack.db.get_test_result')
+    @mock.patch('refstack.db.get_test_results_by_name')
+    def test_compare(self, mock_by_name, mock_get_test_result,
+                     mock_enforce):
+        ids = [str(uuid.uuid4()) for i in range(3)]
+        self.mock_request.GET = {const.IDS: '%s, %s,%s' % tuple(ids)}
+        passed = [('tempest.a', {ids[0], ids[1], ids[2]}),
+                  ('tempest.b', {ids[0], ids[2]}),
+                  ('tempest.c', {ids[1]}),
+                  ('tempest.d', {ids[2]})]
+
+        def get_results_by_name(test_ids):
+            for name, passed_in in passed:
+                if passed_in.intersection(test_ids):
+                    yield name, passed_in.intersection(test_ids)
+
+        mock_by_name.side_effect = get_results_by_name
+        expected = {
+            'results': ids,
+            'common': ['tempest.a'],
+            'unique': {ids[0]: [], ids[1]: ['tempest.c'],
+                       ids[2]: ['tempest.d']},
+            'changes': [
+                {'from': ids[0], 'to': ids[1],
+                 'gained': ['tempest.c'], 'lost': ['tempest.b']},
+                {'from': ids[1], 'to': ids[2],
+                 'gained': ['tempest.b', 'tempest.d'],
+                 'lost': ['tempest.c']},
+            ]
+        }
+        response = self.controller.compare()
+        # Nothing is read from the database before the response is sent.
+        self.assertFalse(mock_by_name.called)
+        self.assertEqual('application/json', response.content_type)
+        self.assertEqual(expected,
+                         json.loads(b''.join(response.app_iter).decode()))
+        mock_by_name.assert_has_calls([mock.call(ids),
+                                       mock.call(ids[:2]),
+                                       mock.call(ids[1:])])
+        mock_enforce.assert_has_calls([mock.call(ids[0], const.ROLE_USER),
+                                       mock.call(ids[1], const.ROLE_USER),
+                                       mock.call(ids[2], const.ROLE_USER)])
+
+    def test_compare_invalid_ids(self):
+        for ids in ('id1', 'id1,id1', 'id1,id2'):
+            self.mock_request.GET = {const.IDS: ids}
+            self.assertRaises(api_exc.ParseInputsError,
+                              self.controller.compare)
+
 
 class GuidelinesControllerTestCase(BaseControllerTestCase):
 
@@ -324,6 +495,7 @@ class GuidelinesControllerTestCase(BaseControllerTestCase):
         super(GuidelinesControllerTestCase, self).setUp()
         self.controller = guidelines.GuidelinesController()
         self.mock_abort.side_effect = None
+        self.mock_request.GET = {}
 
     @mock.patch('refstack.api.guidelines.Guidelines.get_guideline_list')
     def test_get_guidelines(self, mock_list):
@@ -332,6 +504,22 @@ class GuidelinesControllerTestCase(BaseControllerTestCase):
         result = self.controller.get()
         self.assertEqual(['2015.03.json'], result)
 
+    def test_get_guidelines_partial(self):
+        """Test when some guideline sources did not respond in time."""
+        def get_guideline_list(guidelines_obj):
+            guidelines_obj.skipped_sources = ['slow1', 'slow2']
+            return ['2015.03.json']
+
+        self.mock_response.headers = {}
+        with mock.patch('refstack.api.guidelines.Guidelines.'
+                        'get_guideline_list', autospec=True,
+                        side_effect=get_guideline_list):
+            self.assertEqual(['2015.03.json'], self.controller.get())
+        self.assertEqual(
+            '199 - "Guideline source slow1 did not respond in time", '
+            '199 - "Guideline source slow2 did not respond in time"',
+            self.mock_response.headers['Warning'])
+
     @mock.patch('refstack.api.guidelines.Guidelines.get_guideline_list')
     def test_get_guidelines_error(self, mock_list):
         """Test when there is a problem getting the guideline list and
@@ -347,6 +535,50 @@ class GuidelinesControllerTestCase(BaseControllerTestCase):
         result = self.controller.get_one('2015.03')
         self.assertEqual({'foo': 'bar'}, result)
 
+    @mock.patch('refstack.api.guidelines.Guidelines.get_guideline_digest')
+    @mock.patch('refstack.api.guidelines.Guidelines.get_guideline_contents')
+    def test_get_guideline_file_not_modified(self, mock_get_contents,
+                                             mock_get_digest):
+        """Test when the client already has the guideline file."""
+        mock_get_contents.return_value = {'foo': 'bar'}
+        mock_get_digest.return_value = 'fake-digest'
+        self.mock_request.if_none_match = ['fake-digest']
+        self.mock_response.headers = {}
+        self.assertIsNone(self.controller.get_one('2015.03'))
+        self.assertEqual('fake-digest', self.mock_response.etag)
+        self.assertEqual('public, max-age=300',
+                         self.mock_response.headers['Cache-Control'])
+
+    @mock.patch('refstack.api.guidelines.Guidelines.get_guideline_slice')
+    @mock.patch('refstack.api.guidelines.Guidelines.get_guideline_digest')
+    @mock.patch('refstack.api.guidelines.Guidelines.get_guideline_contents')
+    def test_get_guideline_file_slice(self, mock_get_contents,
+                                      mock_get_digest, mock_get_slice):
+        """Test when getting a part of a guideline file."""
+        mock_get_contents.return_value = {'foo': 'bar'}
+        mock_get_digest.return_value = 'fake-digest'
+        mock_get_slice.return_value = {'capabilities': {}}
+        self.mock_request.if_none_match = []
+        self.mock_response.headers = {}
+        self.mock_request.GET = {'target': 'compute',
+                                 'type': 'required,advisory',
+                                 'fields': 'capabilities'}
+        self.mock_request.query_string = ('target=compute&'
+                                          'type=required,advisory&'
+                                          'fields=capabilities')
+
+        self.assertEqual({'capabilities': {}},
+                         self.controller.get_one('2015.03'))
+        mock_get_slice.assert_called_once_with(
+            {'foo': 'bar'}, 'fake-digest', target='compute',
+            types=['required', 'advisory'], fields=['capabilities'])
+        # Slices have their own ETags.
+        self.assertNotEqual('fake-digest', self.mock_response.etag)
+
+        mock_get_slice.side_effect = KeyError
+        self.assertRaises(api_exc.ParseInputsError,
+                          self.controller.get_one, '2015.03')
+
     @mock.patch('refstack.api.guidelines.Guidelines.get_guideline_contents')
     def test_get_guideline_file_error(self, mock_get_contents):
         """Test when there is a problem getting the guideline file contents."""
@@ -427,6 +659,81 @@ class GuidelinesTestsControllerTestCase(BaseControllerTestCase):
         self.assertIn('Invalid target', result_str)
 
 
+class GuidelinesTestListControllerTestCase(BaseControllerTestCase):
+
+    def setUp(self):
+        super(GuidelinesTestListControllerTestCase, self).setUp()
+        self.controller = guidelines.GuidelinesController()
+        self.mock_request.headers = {}
+        self.mock_request.if_none_match = []
+        self.mock_request.query_string = ''
+        self.mock_response.headers = {}
+        self.mock_get_contents = self.setup_mock(
+            'refstack.api.guidelines.Guidelines.get_guideline_contents',
+            return_value={'foo': 'bar'})
+        self.setup_mock(
+            'refstack.api.guidelines.Guidelines.get_guideline_digest',
+            side_effect=lambda file_name, json: file_name)
+        self.mock_get_test_set = self.setup_mock(
+            'refstack.api.guidelines.Guidelines.get_target_test_set',
+            side_effect=lambda json, digest, target, *args: {
+                '2017.09.json': frozenset(['test_1', 'test_2']),
+                'dns.2018.02.json': frozenset(['test_2', 'test_3'])}[digest])
+
+    def test_test_list(self):
+        self.mock_request.GET = {
+            'guidelines': '2017.09.json:compute,dns.2018.02.json',
+            'type': 'required', 'alias': 'false'}
+        result = self.controller.test_list()
+
+        self.assertIs(self.mock_response, result)
+        self.assertEqual(b'test_1\ntest_2\ntest_3',
+                         b''.join(result.app_iter))
+        self.mock_get_test_set.assert_has_calls([
+            mock.call({'foo': 'bar'}, '2017.09.json', 'compute',
+                      ['required'], False, True),
+            mock.call({'foo': 'bar'}, 'dns.2018.02.json', 'dns',
+                      ['required'], False, True)])
+        self.assertEqual('Accept-Encoding',
+                         self.mock_response.headers['Vary'])
+
+    @mock.patch.object(guidelines, '_TEST_LIST_CHUNK_SIZE', 2)
+    def test_test_list_gzip(self):
+        self.mock_request.GET = {'guidelines': '2017.09.json,'
+                                               'dns.2018.02.json'}
+        self.mock_request.headers = {'Accept-Encoding': 'deflate, gzip'}
+        result = self.controller.test_list()
+
+        self.assertEqual('gzip', result.content_encoding)
+        self.assertEqual(b'test_1\ntest_2\ntest_3', zlib.decompress(
+            b''.join(result.app_iter), 16 + zlib.MAX_WBITS))
+        self.mock_get_test_set.assert_any_call(
+            {'foo': 'bar'}, '2017.09.json', 'platform', None, True, True)
+
+    def test_test_list_not_modified(self):
+        self.mock_request.GET = {'guidelines': '2017.09.json'}
+        self.controller.test_list()
+        self.mock_request.if_none_match = [self.mock_response.etag]
+        self.assertEqual('', self.controller.test_list())
+
+        # The ETag depends on the encoding.
+        self.mock_request.headers = {'Accept-Encoding': 'gzip'}
+        self.assertIs(self.mock_response, self.controller.test_list())
+
+    def test_test_list_invalid(self):
+        self.mock_request.GET = {}
+        self.assertRaises(api_exc.ParseInputsError,
+                          self.controller.test_list)
+
+        self.mock_request.GET = {'guidelines': '2017.09.json:foo'}
+        self.mock_get_test_set.side_effect = KeyError
+        self.assertRaises(api_exc.ParseInputsError,
+                          self.controller.test_list)
+
+        self.mock_get_contents.return_value = None
+        self.assertRaises(webob.exc.HTTPError, self.controller.test_list)
+
+
 class BaseRestControllerWithValidationTestCase(BaseControllerTestCase):
 
     def setUp(self):
@@ -461,8 +768,7 @@ class ProfileControllerTestCase(BaseControllerTestCase):
         super(ProfileControllerTestCase, self).setUp()
         self.controller = user.ProfileController()
 
-    @mock.patch('refstack.db.get_foundation_users',
-                return_value=['foo@bar.org'])
+    @mock.patch('refstack.db.is_foundation_user', return_value=True)
     @mock.patch('refstack.db.user_get',
                 return_value=mock.Mock(openid='foo@bar.org',
                                        email='foo@bar.org',
@@ -470,7 +776,7 @@ class ProfileControllerTestCase(BaseControllerTestCase):
     @mock.patch('refstack.api.utils.get_user_session',
                 return_value={const.USER_OPENID: 'foo@bar.org'})
     def test_get(self, mock_get_user_session, mock_user_get,
-                 mock_get_foundation_users):
+                 mock_is_foundation_user):
         actual_result = self.controller.get()
         self.assertEqual({'openid': 'foo@bar.org',
                           'email': 'foo@bar.org',
@@ -609,6 +915,218 @@ class AuthControllerTestCase(BaseControllerTestCase):
                          mock_request.environ['beaker.session'])
 
 
+class EligibilityControllerTestCase(BaseControllerTestCase):
+
+    def setUp(self):
+        super(EligibilityControllerTestCase, self).setUp()
+        self.controller = results.EligibilityController()
+
+    @mock.patch('refstack.api.compliance.get_eligibility')
+    @mock.patch('refstack.db.get_test_result')
+    def test_get(self, mock_get_test_result, mock_get_eligibility):
+        self.mock_get_user_role.return_value = const.ROLE_USER
+        eligibility = {'passing': [{'guideline': '2018.02.json',
+                                    'target': 'compute'}],
+                       'missing_required': {'2018.02.json': {
+                           'compute': 0, 'platform': 2}}}
+        mock_get_eligibility.return_value = eligibility
+
+        self.assertEqual(eligibility, self.controller.get('test_id'))
+        mock_get_test_result.assert_called_once_with('test_id',
+                                                     allowed_keys=['id'])
+        mock_get_eligibility.assert_called_once_with('test_id')
+
+    @mock.patch('refstack.api.compliance.get_eligibility')
+    def test_get_forbidden(self, mock_get_eligibility):
+        self.mock_get_user_role.return_value = None
+        self.assertRaises(webob.exc.HTTPError,
+                          self.controller.get, 'test_id')
+        self.assertFalse(mock_get_eligibility.called)
+
+
+class ViewControllerTestCase(BaseControllerTestCase):
+
+    def setUp(self):
+        super(ViewControllerTestCase, self).setUp()
+        self.controller = results.ViewController()
+        self.mock_request.GET = {}
+        self.mock_request.if_none_match = []
+        self.mock_response.headers = {}
+        self.mock_get_test_result = self.setup_mock(
+            'refstack.db.get_test_result',
+            return_value={'id': 'test_id', 'meta': {'target': 'compute'},
+                          'product_version': {
+                              'id': 'ver1', 'product_id': 'prod1',
+                              'product_info': {'public': True}}})
+        self.setup_mock('refstack.db.get_test_results',
+                        return_value=[{'name': 'test_1'}])
+        self.setup_mock('refstack.api.guidelines.Guidelines.__init__',
+                        return_value=None)
+        self.mock_get_guideline_list = self.setup_mock(
+            'refstack.api.guidelines.Guidelines.get_guideline_list',
+            return_value={'powered': [{'name': '2017.01.json',
+                                       'file': '2017.01.json'},
+                                      {'name': 'next.json',
+                                       'file': 'next.json'},
+                                      {'name': '2018.02.json',
+                                       'file': '2018.02.json'}],
+                          'dns': [{'name': '2018.02',
+                                   'file': 'dns.2018.02.json'}]})
+        self.mock_contents = self.setup_mock(
+            'refstack.api.guidelines.Guidelines.get_guideline_contents',
+            return_value={'schema': '1.4', 'status': 'approved'})
+        self.setup_mock(
+            'refstack.api.guidelines.Guidelines.get_guideline_digest',
+            return_value='digest')
+        self.mock_report = self.setup_mock(
+            'refstack.api.compliance.get_compliance_report',
+            return_value={'capabilities': [], 'summary': {}})
+        self.mock_get_versions = self.setup_mock(
+            'refstack.db.get_product_versions',
+            return_value=[{'id': 'ver1', 'version': '1.0', 'cpid': None}])
+
+    def test_get(self):
+        self.mock_get_user_role.return_value = const.ROLE_OWNER
+        view = self.controller.get('test_id')
+
+        self.assertEqual('compute', view['target'])
+        self.assertEqual(['test_1'], view['result']['results'])
+        self.assertEqual(['next.json', '2018.02.json', '2017.01.json'],
+                         [gl['file'] for gl in view['guidelines']])
+        # The latest approved guideline is selected by default.
+        self.assertEqual({'name': '2018.02.json', 'file': '2018.02.json',
+                          'schema': '1.4', 'status': 'approved',
+                          'releases': None}, view['guideline'])
+        self.assertEqual({'capabilities': [], 'summary': {}},
+                         view['report'])
+        self.mock_contents.assert_called_once_with('2018.02.json')
+        self.mock_report.assert_called_once_with(
+            {'schema': '1.4', 'status': 'approved'}, 'digest', 'compute',
+            {'test_1'})
+        self.mock_get_versions.assert_called_once_with(
+            'prod1', allowed_keys=['id', 'version', 'cpid'])
+        self.assertEqual([{'id': 'ver1', 'version': '1.0', 'cpid': None}],
+                         view['product_versions'])
+        self.assertIsNotNone(self.mock_response.etag)
+
+        # The client already has the current view.
+        self.mock_request.if_none_match = [self.mock_response.etag]
+        self.assertIsNone(self.controller.get('test_id'))
+
+    def test_get_without_next(self):
+        self.mock_get_user_role.return_value = const.ROLE_USER
+        self.mock_get_guideline_list.return_value = {
+            'powered': [{'name': '2017.01.json', 'file': '2017.01.json'},
+                        {'name': '2018.02.json', 'file': '2018.02.json'}]}
+        view = self.controller.get('test_id')
+        self.assertEqual('2018.02.json', view['guideline']['file'])
+
+        # The 'next' guideline is only selected when there is no other.
+        self.mock_get_guideline_list.return_value = {
+            'powered': [{'name': 'next.json', 'file': 'next.json'}]}
+        view = self.controller.get('test_id')
+        self.assertEqual('next.json', view['guideline']['file'])
+
+    def test_get_params(self):
+        self.mock_get_user_role.return_value = const.ROLE_USER
+        self.mock_get_test_result.return_value['meta'] = {}
+        self.mock_request.GET = {const.GUIDELINE: '2018.02',
+                                 const.TARGET: 'dns'}
+        view = self.controller.get('test_id')
+
+        self.assertEqual('dns.2018.02.json', view['guideline']['file'])
+        self.mock_report.assert_called_once_with(
+            mock.ANY, 'digest', 'dns', {'test_1'})
+        self.assertIsNone(view['product_versions'])
+        self.assertFalse(self.mock_get_versions.called)
+
+    def test_get_invalid_params(self):
+        self.mock_get_user_role.return_value = const.ROLE_USER
+        self.mock_request.GET = {const.TARGET: 'foo'}
+        self.assertRaises(api_exc.ParseInputsError,
+                          self.controller.get, 'test_id')
+
+        self.mock_request.GET = {const.GUIDELINE: '2000.01'}
+        self.assertRaises(webob.exc.HTTPError,
+                          self.controller.get, 'test_id')
+
+        self.mock_request.GET = {}
+        self.mock_report.side_effect = KeyError
+        self.assertRaises(api_exc.ParseInputsError,
+                          self.controller.get, 'test_id')
+
+    def test_get_forbidden(self):
+        self.mock_get_user_role.return_value = None
+        self.assertRaises(webob.exc.HTTPError,
+                          self.controller.get, 'test_id')
+        self.assertFalse(self.mock_report.called)
+
+
+class StatsControllerTestCase(BaseControllerTestCase):
+
+    def setUp(self):
+        super(StatsControllerTestCase, self).setUp()
+        self.controller = stats.StatsController()
+
+    @mock.patch('refstack.db.get_capability_stats')
+    def test_capabilities(self, mock_get_stats):
+        self.mock_request.GET = {const.GUIDELINE: '2017.09.json'}
+        mock_get_stats.return_value = [
+            {'guideline': '2017.09.json', 'capability': 'cap-1',
+             'run_count': 4, 'pass_count': 3},
+            {'guideline': '2017.09.json', 'capability': 'cap-2',
+             'run_count': 0, 'pass_count': 0}]
+
+        result = self.controller.capabilities()
+
+        mock_get_stats.assert_called_once_with('2017.09.json')
+        self.assertEqual(
+            {'capabilities': [
+                {'guideline': '2017.09.json', 'capability': 'cap-1',
+                 'run_count': 4, 'pass_count': 3, 'pass_rate': 0.75},
+                {'guideline': '2017.09.json', 'capability': 'cap-2',
+                 'run_count': 0, 'pass_count': 0, 'pass_rate': None}]},
+            result)
+
+    @mock.patch('refstack.api.guidelines.get_refresh_metrics')
+    @mock.patch('refstack.api.utils.check_user_is_foundation_admin')
+    def test_guidelines(self, mock_is_admin, mock_get_metrics):
+        mock_is_admin.return_value = False
+        self.mock_abort.side_effect = webob.exc.HTTPError()
+        self.assertRaises(webob.exc.HTTPError, self.controller.guidelines)
+        self.mock_abort.assert_called_once_with(403, 'Forbidden.')
+
+        mock_is_admin.return_value = True
+        mock_get_metrics.return_value = {'refreshes': 1}
+        self.assertEqual({'refreshes': 1}, self.controller.guidelines())
+
+    @mock.patch('refstack.api.http_client.get_metrics')
+    @mock.patch('refstack.api.utils.check_user_is_foundation_admin')
+    def test_http(self, mock_is_admin, mock_get_metrics):
+        mock_is_admin.return_value = False
+        self.mock_abort.side_effect = webob.exc.HTTPError()
+        self.assertRaises(webob.exc.HTTPError, self.controller.http)
+        self.mock_abort.assert_called_once_with(403, 'Forbidden.')
+
+        mock_is_admin.return_value = True
+        mock_get_metrics.return_value = {'github': {'requests': 1}}
+        self.assertEqual({'targets': {'github': {'requests': 1}}},
+                         self.controller.http())
+
+    @mock.patch('refstack.api.response_cache.get_metrics')
+    @mock.patch('refstack.api.utils.check_user_is_foundation_admin')
+    def test_responses(self, mock_is_admin, mock_get_metrics):
+        mock_is_admin.return_value = False
+        self.mock_abort.side_effect = webob.exc.HTTPError()
+        self.assertRaises(webob.exc.HTTPError, self.controller.responses)
+        self.mock_abort.assert_called_once_with(403, 'Forbidden.')
+
+        mock_is_admin.return_value = True
+        mock_get_metrics.return_value = {'results': {'hits': 1}}
+        self.assertEqual({'endpoints': {'results': {'hits': 1}}},
+                         self.controller.responses())
+
+
 class MetadataControllerTestCase(BaseControllerTestCase):
 
     def setUp(self):
@@ -761,6 +1279,98 @@ class PublicKeysControllerTestCase(BaseControllerTestCase):
                           self.controller.delete, 'other_key_id')
 
 
+class VendorDashboardControllerTestCase(BaseControllerTestCase):
+
+    def setUp(self):
+        super(VendorDashboardControllerTestCase, self).setUp()
+        self.controller = vendors.DashboardController()
+        self.mock_request.if_none_match = []
+        self.mock_response.headers = {}
+        self.mock_is_foundation = self.setup_mock(
+            'refstack.api.utils.check_user_is_foundation_admin',
+            return_value=False)
+        self.mock_is_vendor_admin = self.setup_mock(
+            'refstack.api.utils.check_user_is_vendor_admin',
+            return_value=True)
+        self.mock_get_org = self.setup_mock(
+            'refstack.db.get_organization',
+            return_value={'id': 'org1', 'type': const.OFFICIAL_VENDOR})
+        self.mock_get_version = self.setup_mock(
+            'refstack.db.get_organization_version',
+            return_value={'version': '1', 'updated_at': 'fake-time'})
+        self.mock_get_products = self.setup_mock(
+            'refstack.db.get_products',
+            return_value=[{'id': 'prod2', 'name': 'b'},
+                          {'id': 'prod1', 'name': 'a'}])
+        self.mock_get_versions = self.setup_mock(
+            'refstack.db.get_product_versions_by_products',
+            return_value=[{'id': 'ver1', 'product_id': 'prod1'},
+                          {'id': 'ver2', 'product_id': 'prod1'}])
+        self.mock_get_latest = self.setup_mock(
+            'refstack.db.get_latest_test_results_by_versions',
+            return_value={'ver2': {'id': 'test1'}})
+        self.mock_get_users = self.setup_mock(
+            'refstack.db.get_organization_users',
+            return_value={'foo': {'openid': 'foo'}})
+
+    def test_get(self):
+        dashboard = self.controller.get('org1')
+
+        self.assertEqual({'id': 'org1', 'type': const.OFFICIAL_VENDOR,
+                          'can_manage': True}, dashboard['vendor'])
+        self.assertEqual([{'openid': 'foo'}], dashboard['users'])
+        self.assertEqual(['prod1', 'prod2'],
+                         [product['id'] for product in dashboard['products']])
+        self.assertEqual(
+            [{'id': 'ver1', 'product_id': 'prod1', 'latest_result': None},
+             {'id': 'ver2', 'product_id': 'prod1',
+              'latest_result': {'id': 'test1'}}],
+            dashboard['products'][0]['versions'])
+        self.assertEqual([], dashboard['products'][1]['versions'])
+        self.mock_get_org.assert_called_once_with('org1', allowed_keys=None)
+        self.assertEqual({'organization_id': 'org1'},
+                         self.mock_get_products.call_args[1]['filters'])
+        self.assertEqual(['prod1', 'prod2'],
+                         sorted(self.mock_get_versions.call_args[0][0]))
+        self.mock_get_latest.assert_called_once_with(['ver1', 'ver2'])
+
+    def test_get_not_admin(self):
+        self.mock_is_vendor_admin.return_value = False
+        dashboard = self.controller.get('org1')
+
+        self.assertFalse(dashboard['vendor']['can_manage'])
+        self.assertIsNone(dashboard['users'])
+        self.assertFalse(self.mock_get_users.called)
+        self.assertEqual({'organization_id': 'org1', 'public': True},
+                         self.mock_get_products.call_args[1]['filters'])
+
+        self.mock_get_org.return_value = {'id': 'org1',
+                                          'type': const.PRIVATE_VENDOR}
+        self.assertRaises(webob.exc.HTTPError, self.controller.get, 'org1')
+
+    def test_get_not_modified(self):
+        self.controller.get('org1')
+        etag = self.mock_response.etag
+        self.assertEqual('fake-time', self.mock_response.last_modified)
+
+        # The dashboard isn't built for clients which already have it.
+        self.mock_get_products.reset_mock()
+        self.mock_request.if_none_match = [etag]
+        self.assertIsNone(self.controller.get('org1'))
+        self.assertFalse(self.mock_get_products.called)
+
+        # Non-admins are shown another dashboard.
+        self.mock_is_vendor_admin.return_value = False
+        self.assertIsNotNone(self.controller.get('org1'))
+        self.assertNotEqual(etag, self.mock_response.etag)
+
+        self.mock_is_vendor_admin.return_value = True
+        self.mock_get_version.return_value = {'version': '2',
+                                              'updated_at': 'fake-time'}
+        self.assertIsNotNone(self.controller.get('org1'))
+        self.assertNotEqual(etag, self.mock_response.etag)
+
+
 class VendorUsersControllerTestCase(BaseControllerTestCase):
 
     def setUp(self):
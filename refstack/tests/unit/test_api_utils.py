@@ -14,8 +14,11 @@
 #    under the License.
 
 """Tests for API's utils"""
+import base64
+import hashlib
 import time
 
+from cryptography.hazmat.primitives.asymmetric import rsa
 import mock
 from oslo_config import fixture as config_fixture
 from oslo_utils import timeutils
@@ -26,6 +29,7 @@ import six
 from six.moves.urllib import parse
 from webob import exc
 
+from refstack.api import cache
 from refstack.api import constants as const
 from refstack.api import exceptions as api_exc
 from refstack.api import utils as api_utils
@@ -362,6 +366,54 @@ class APIUtilsTestCase(base.BaseTestCase):
         mock_get_user.side_effect = mock_db.NotFound('User')
         self.assertFalse(api_utils.is_authenticated())
 
+    @mock.patch('refstack.db.is_organization_user')
+    @mock.patch('refstack.db.is_foundation_user')
+    @mock.patch('refstack.db.user_get')
+    @mock.patch('pecan.request')
+    def test_auth_context(self, mock_request, mock_user_get,
+                          mock_foundation, mock_vendor):
+        mock_user_get.return_value = 'FAKE_USER'
+        mock_foundation.return_value = True
+        mock_vendor.return_value = False
+        context = api_utils.AuthContext('foo@bar.com')
+        mock_request.environ = {const.AUTH_CONTEXT_ENV: context}
+
+        # Identity is resolved once per request.
+        for _ in range(2):
+            self.assertEqual('foo@bar.com', api_utils.get_user_id())
+            self.assertTrue(api_utils.is_authenticated())
+            self.assertEqual('FAKE_USER', api_utils.get_user())
+            self.assertTrue(api_utils.check_user_is_foundation_admin())
+            self.assertFalse(api_utils.check_user_is_vendor_admin('v1'))
+        mock_user_get.assert_called_once_with('foo@bar.com')
+        mock_foundation.assert_called_once_with('foo@bar.com')
+        mock_vendor.assert_called_once_with('v1', 'foo@bar.com')
+
+        # Other users are still looked up.
+        api_utils.check_user_is_vendor_admin('v1', user_id='other')
+        mock_vendor.assert_called_with('v1', 'other')
+
+    @mock.patch('refstack.db.is_foundation_user')
+    @mock.patch('refstack.db.user_get')
+    @mock.patch('pecan.request')
+    def test_auth_context_anonymous(self, mock_request, mock_user_get,
+                                    mock_foundation):
+        mock_request.environ = {
+            const.AUTH_CONTEXT_ENV: api_utils.AuthContext(None)}
+        self.assertIsNone(api_utils.get_user_id())
+        self.assertFalse(api_utils.is_authenticated())
+        self.assertFalse(api_utils.check_user_is_foundation_admin())
+        self.assertFalse(mock_user_get.called)
+        self.assertFalse(mock_foundation.called)
+
+        mock_user_get.side_effect = db.NotFound('User')
+        context = api_utils.AuthContext('foo@bar.com')
+        mock_request.environ = {const.AUTH_CONTEXT_ENV: context}
+        self.assertFalse(api_utils.is_authenticated())
+        self.assertFalse(api_utils.is_authenticated())
+        self.assertEqual('foo@bar.com', api_utils.get_user_id())
+        mock_user_get.assert_called_once_with('foo@bar.com')
+
     @mock.patch('refstack.api.utils.check_user_is_foundation_admin')
     @mock.patch('pecan.abort', side_effect=exc.HTTPError)
     @mock.patch('refstack.db.get_test_result_meta_key')
@@ -493,7 +545,7 @@ class APIUtilsTestCase(base.BaseTestCase):
 
         self.assertRaises(ValueError, fake_controller.post, public_test)
 
-    @mock.patch('requests.post')
+    @mock.patch('refstack.api.http_client.post')
     @mock.patch('pecan.abort')
     def test_verify_openid_request(self, mock_abort, mock_post):
         mock_response = mock.Mock()
@@ -527,20 +579,96 @@ class APIUtilsTestCase(base.BaseTestCase):
                  'Please permit access to your name.'
         )
 
-    @mock.patch('refstack.db.get_organization_users')
+    @mock.patch('refstack.db.is_organization_user')
     @mock.patch.object(api_utils, 'get_user_id', return_value='fake_id')
     def test_check_user_is_vendor_admin(self, mock_user, mock_db):
         mock_user.return_value = 'some-user'
-        mock_db.return_value = ['some-user', 'another-user']
+        mock_db.return_value = True
         result = api_utils.check_user_is_vendor_admin('some-vendor')
         self.assertTrue(result)
+        mock_db.assert_called_once_with('some-vendor', 'some-user')
 
-        mock_db.return_value = ['another-user']
-        result = api_utils.check_user_is_vendor_admin('some-vendor')
+        mock_db.return_value = False
+        result = api_utils.check_user_is_vendor_admin('some-vendor',
+                                                      user_id='other-user')
         self.assertFalse(result)
+        mock_db.assert_called_with('some-vendor', 'other-user')
+
+    @mock.patch('refstack.db.is_foundation_user')
+    @mock.patch.object(api_utils, 'get_user_id', return_value='some-user')
+    def test_check_user_is_foundation_admin(self, mock_user, mock_db):
+        mock_db.return_value = True
+        self.assertTrue(api_utils.check_user_is_foundation_admin())
+        mock_db.assert_called_once_with('some-user')
+
+        mock_db.return_value = False
+        self.assertFalse(
+            api_utils.check_user_is_foundation_admin(user_id='other-user'))
+        mock_db.assert_called_with('other-user')
+
+    @mock.patch.object(api_utils, 'is_authenticated')
+    @mock.patch('pecan.request')
+    @mock.patch('pecan.response')
+    def test_check_etag(self, mock_response, mock_request,
+                        mock_is_authenticated):
+        mock_response.headers = {}
+        mock_request.if_none_match = ['other-etag']
+        mock_is_authenticated.return_value = True
+        self.assertFalse(api_utils.check_etag('fake-etag'))
+        self.assertEqual('fake-etag', mock_response.etag)
+        self.assertEqual('private, no-cache',
+                         mock_response.headers['Cache-Control'])
+        self.assertEqual('Cookie, Authorization',
+                         mock_response.headers['Vary'])
+
+        mock_response.headers = {}
+        mock_request.if_none_match = ['fake-etag']
+        mock_is_authenticated.return_value = False
+        self.assertTrue(api_utils.check_etag('fake-etag', max_age=60,
+                                             last_modified='fake-time'))
+        self.assertEqual('fake-time', mock_response.last_modified)
+        self.assertEqual('public, max-age=60',
+                         mock_response.headers['Cache-Control'])
+
+        mock_response.headers = {}
+        api_utils.check_etag('fake-etag', per_user=False)
+        self.assertNotIn('Vary', mock_response.headers)
+
+    @mock.patch('refstack.api.response_cache.get_cache')
+    @mock.patch.object(api_utils, 'is_authenticated')
+    @mock.patch('pecan.request')
+    def test_cache_anonymous_response(self, mock_request,
+                                      mock_is_authenticated, mock_get_cache):
+        mock_request.GET.mixed.return_value = {'page': '1'}
+        page_cache = mock_get_cache.return_value
+        page_cache.get_or_set.return_value = 'cached-page'
+        method = mock.Mock(__name__='get', return_value='page')
+        wrapped = api_utils.cache_anonymous_response('results')(method)
+
+        mock_is_authenticated.return_value = False
+        self.assertEqual('cached-page', wrapped('controller'))
+        page_cache.get_or_set.assert_called_once_with(
+            'results', {'page': '1'}, method, 'controller')
+
+        # Pages of logged in users are never cached.
+        mock_is_authenticated.return_value = True
+        self.assertEqual('page', wrapped('controller'))
+        self.assertEqual(1, page_cache.get_or_set.call_count)
+
+        mock_is_authenticated.return_value = False
+        mock_get_cache.return_value = None
+        self.assertEqual('page', wrapped('controller'))
+
+    def test_get_etag(self):
+        self.assertEqual(api_utils.get_etag({'a': 1, 'b': [2]}),
+                         api_utils.get_etag({'b': [2], 'a': 1}))
+        self.assertNotEqual(api_utils.get_etag({'a': 1}),
+                            api_utils.get_etag({'a': 2}))
 
     @mock.patch('refstack.db.get_user_pubkeys')
     def test_encode_token(self, mock_pubkey):
+        self.addCleanup(cache.verified_tokens.clear)
+        self.addCleanup(cache.parsed_pubkeys.clear)
         mock_request = mock.MagicMock()
         mock_request.headers = {}
         self.assertIsNone(api_utils.decode_token(mock_request))
@@ -556,12 +684,12 @@ class APIUtilsTestCase(base.BaseTestCase):
                                 algorithm='RS256')
         auth_str = 'Bearer %s' % six.text_type(fake_token, 'utf-8')
         mock_request.headers = {const.JWT_TOKEN_HEADER: auth_str}
-        mock_pubkey.return_value = [{'format': 'ssh-rsa',
+        mock_pubkey.return_value = [{'id': 'key1', 'format': 'ssh-rsa',
                                      'pubkey': 'fakepubkey'}]
         self.assertRaises(api_exc.ValidationError, api_utils.decode_token,
                           mock_request)
 
-        mock_pubkey.return_value = [{'format': 'ssh-rsa',
+        mock_pubkey.return_value = [{'id': 'key2', 'format': 'ssh-rsa',
                                      'pubkey': PUB_KEY}]
         self.assertRaises(api_exc.ValidationError, api_utils.decode_token,
                           mock_request)
@@ -572,8 +700,216 @@ class APIUtilsTestCase(base.BaseTestCase):
                                 algorithm='RS256')
         auth_str = 'Bearer %s' % six.text_type(fake_token, 'utf-8')
         mock_request.headers = {const.JWT_TOKEN_HEADER: auth_str}
-        mock_pubkey.return_value = [{'format': 'ssh-rsa',
+        mock_pubkey.return_value = [{'id': 'key2', 'format': 'ssh-rsa',
                                      'pubkey': PUB_KEY}]
         self.assertEqual('oid',
                          api_utils.decode_token(
                              mock_request)[const.USER_OPENID])
+
+    @mock.patch('jwt.get_unverified_header', return_value={})
+    @mock.patch('jwt.decode')
+    @mock.patch('refstack.db.get_user_pubkeys')
+    def test_decode_token_cache(self, mock_pubkey, mock_decode,
+                                mock_header):
+        self.addCleanup(cache.verified_tokens.clear)
+        self.addCleanup(cache.parsed_pubkeys.clear)
+        self.CONF.set_override('verified_token_cache_ttl', 300, 'api')
+        token_data = {const.USER_OPENID: 'oid',
+                      'exp': int(time.time()) + 3600}
+        mock_decode.return_value = token_data
+        mock_pubkey.return_value = [{'id': 'key1', 'format': 'ssh-rsa',
+                                     'pubkey': 'fakepubkey'},
+                                    {'id': 'key2', 'format': 'ssh-rsa',
+                                     'pubkey': PUB_KEY}]
+        mock_request = mock.MagicMock()
+        mock_request.headers = {const.JWT_TOKEN_HEADER: 'Bearer token'}
+
+        self.assertEqual(token_data, api_utils.decode_token(mock_request))
+        self.assertEqual(token_data, api_utils.decode_token(mock_request))
+        mock_pubkey.assert_called_once_with('oid')
+        # Unparsable keys are skipped without trying to verify the token.
+        self.assertEqual(2, mock_decode.call_count)
+        self.assertIsNone(cache.parsed_pubkeys.get('key1'))
+        pubkey_obj = cache.parsed_pubkeys.get('key2')
+        self.assertIsInstance(pubkey_obj, rsa.RSAPublicKey)
+        self.assertIs(pubkey_obj, mock_decode.call_args[1]['key'])
+
+        # Parsed keys are reused while verifying other tokens.
+        mock_request.headers = {const.JWT_TOKEN_HEADER: 'Bearer token2'}
+        with mock.patch('cryptography.hazmat.primitives.serialization.'
+                        'load_ssh_public_key') as mock_load:
+            api_utils.decode_token(mock_request)
+        self.assertFalse(mock_load.called)
+
+        # Deleting a key drops verified tokens and the parsed key.
+        with mock.patch('refstack.db.sqlalchemy.api.delete_pubkey'), \
+                mock.patch.object(db.api, '_change_listeners',
+                                  [cache.invalidate]):
+            db.delete_pubkey('key2')
+        self.assertIsNone(cache.parsed_pubkeys.get('key2'))
+        api_utils.decode_token(mock_request)
+        self.assertEqual(3, mock_pubkey.call_count)
+
+    @mock.patch('jwt.get_unverified_header', return_value={})
+    @mock.patch('jwt.decode')
+    @mock.patch('refstack.db.get_user_pubkeys')
+    def test_decode_token_cache_ttl(self, mock_pubkey, mock_decode,
+                                    mock_header):
+        self.addCleanup(cache.verified_tokens.clear)
+        self.addCleanup(cache.parsed_pubkeys.clear)
+        mock_pubkey.return_value = [{'id': 'key2', 'format': 'ssh-rsa',
+                                     'pubkey': PUB_KEY}]
+        mock_request = mock.MagicMock()
+        mock_request.headers = {const.JWT_TOKEN_HEADER: 'Bearer token'}
+
+        # Expired tokens are not cached.
+        mock_decode.return_value = {
+            const.USER_OPENID: 'oid',
+            'exp': int(time.time()) - const.JWT_VALIDATION_LEEWAY - 1}
+        api_utils.decode_token(mock_request)
+        self.assertEqual(0, len(cache.verified_tokens))
+
+        # Caching of verified tokens can be disabled.
+        self.CONF.set_override('verified_token_cache_ttl', 0, 'api')
+        mock_decode.return_value = {const.USER_OPENID: 'oid',
+                                    'exp': int(time.time()) + 3600}
+        api_utils.decode_token(mock_request)
+        self.assertEqual(0, len(cache.verified_tokens))
+
+    @mock.patch('jwt.get_unverified_header')
+    @mock.patch('jwt.decode')
+    @mock.patch('refstack.db.get_user_pubkeys')
+    def test_decode_token_key_id(self, mock_pubkey, mock_decode,
+                                 mock_header):
+        self.addCleanup(cache.verified_tokens.clear)
+        self.addCleanup(cache.parsed_pubkeys.clear)
+        token_data = {const.USER_OPENID: 'oid',
+                      'exp': int(time.time()) + 3600}
+        mock_decode.return_value = token_data
+        pubkey = {'id': 'key2', 'format': 'ssh-rsa', 'pubkey': PUB_KEY}
+        mock_pubkey.return_value = [pubkey]
+        md5_hash = hashlib.md5(base64.b64decode(PUB_KEY)).hexdigest()
+
+        # The key id from the token header is looked up by md5 hash.
+        mock_header.return_value = {'kid': md5_hash}
+        mock_request = mock.MagicMock()
+        mock_request.headers = {const.JWT_TOKEN_HEADER: 'Bearer token1'}
+        self.assertEqual(token_data, api_utils.decode_token(mock_request))
+        mock_pubkey.assert_called_once_with('oid', md5_hash=md5_hash)
+        # Only the selected key is used to verify the token.
+        self.assertEqual(2, mock_decode.call_count)
+
+        colon_hash = 'MD5:' + ':'.join(md5_hash[i:i + 2].upper()
+                                       for i in range(0, 32, 2))
+        mock_header.return_value = {'kid': colon_hash}
+        mock_request.headers = {const.JWT_TOKEN_HEADER: 'Bearer token2'}
+        api_utils.decode_token(mock_request)
+        mock_pubkey.assert_called_with('oid', md5_hash=md5_hash)
+
+        # A SHA-256 fingerprint can be sent in the X-Key-Id header.
+        mock_header.return_value = {}
+        mock_request.headers = {
+            const.JWT_TOKEN_HEADER: 'Bearer token3',
+            const.JWT_KEY_ID_HEADER: api_utils.get_pubkey_fingerprint(
+                PUB_KEY)}
+        api_utils.decode_token(mock_request)
+        mock_pubkey.assert_called_with('oid')
+
+        # Tokens fail validation if no key matches the key id.
+        mock_request.headers = {const.JWT_TOKEN_HEADER: 'Bearer token4',
+                                const.JWT_KEY_ID_HEADER: 'SHA256:unknown'}
+        self.assertRaises(api_exc.ValidationError, api_utils.decode_token,
+                          mock_request)
+        mock_request.headers = {const.JWT_TOKEN_HEADER: 'Bearer token4',
+                                const.JWT_KEY_ID_HEADER: 'bad-key-id'}
+        self.assertRaises(api_exc.ValidationError, api_utils.decode_token,
+                          mock_request)
+
+    @mock.patch('refstack.db.get_pubkey')
+    def test_get_upload_key(self, mock_get_pubkey):
+        self.addCleanup(cache.upload_keys.clear)
+        mock_get_pubkey.return_value = mock.Mock(id='key-id',
+                                                 openid='user')
+        public_key = 'ssh-rsa %s comment' % PUB_KEY
+
+        upload_key = api_utils.get_upload_key(public_key)
+        self.assertEqual(('key-id', 'user', None), upload_key)
+        self.assertEqual(upload_key, api_utils.get_upload_key(public_key))
+        mock_get_pubkey.assert_called_once_with(PUB_KEY)
+        # The owner is looked up again along with parsing the key.
+        upload_key = api_utils.get_upload_key(public_key.encode('utf-8'),
+                                              parse=True)
+        self.assertEqual(512, upload_key.key.key_size)
+        self.assertEqual(2, mock_get_pubkey.call_count)
+
+        # Both the owner and the parsed key are cached.
+        with mock.patch('cryptography.hazmat.primitives.serialization.'
+                        'load_ssh_public_key') as mock_load:
+            self.assertEqual(upload_key,
+                             api_utils.get_upload_key(public_key, parse=True))
+        self.assertFalse(mock_load.called)
+        self.assertEqual(2, mock_get_pubkey.call_count)
+
+        # Deleting any key drops the cached keys.
+        with mock.patch('refstack.db.sqlalchemy.api.delete_pubkey'), \
+                mock.patch.object(db.api, '_change_listeners',
+                                  [cache.invalidate]):
+            db.delete_pubkey('other-key-id')
+        api_utils.get_upload_key(public_key)
+        self.assertEqual(3, mock_get_pubkey.call_count)
+
+    @mock.patch('refstack.db.get_pubkey')
+    def test_get_upload_key_expiration(self, mock_get_pubkey):
+        self.addCleanup(cache.upload_keys.clear)
+        self.CONF.set_override('upload_key_cache_ttl', 60, 'api')
+        now = [1000.0]
+        timer_patcher = mock.patch.object(cache.upload_keys, 'timer',
+                                          lambda: now[0])
+        timer_patcher.start()
+        self.addCleanup(timer_patcher.stop)
+        mock_get_pubkey.return_value = mock.Mock(id='key-id',
+                                                 openid='user')
+        public_key = 'ssh-rsa %s' % PUB_KEY
+
+        api_utils.get_upload_key(public_key)
+        now[0] += 59
+        api_utils.get_upload_key(public_key)
+        mock_get_pubkey.assert_called_once_with(PUB_KEY)
+
+        # Keys deleted through other processes are looked up again once
+        # the entry expires.
+        now[0] += 1
+        mock_get_pubkey.return_value = None
+        self.assertEqual((None, None, None),
+                         api_utils.get_upload_key(public_key))
+        self.assertEqual(2, mock_get_pubkey.call_count)
+
+        # Nothing is cached with a TTL of 0.
+        self.CONF.set_override('upload_key_cache_ttl', 0, 'api')
+        mock_get_pubkey.return_value = mock.Mock(id='key-id',
+                                                 openid='user')
+        api_utils.get_upload_key(public_key)
+        self.assertEqual(0, len(cache.upload_keys))
+
+    @mock.patch('refstack.db.get_pubkey')
+    def test_get_upload_key_not_stored(self, mock_get_pubkey):
+        self.addCleanup(cache.upload_keys.clear)
+        mock_get_pubkey.return_value = None
+        public_key = 'ssh-rsa %s' % PUB_KEY
+        self.assertEqual((None, None, None),
+                         api_utils.get_upload_key(public_key))
+        upload_key = api_utils.get_upload_key(public_key, parse=True)
+        self.assertIsNone(upload_key.openid)
+        self.assertIsNotNone(upload_key.key)
+        self.assertEqual(0, len(cache.upload_keys))
+
+        # Malformed keys are never looked up.
+        self.assertEqual((None, None, None),
+                         api_utils.get_upload_key('H--0'))
+        self.assertEqual(2, mock_get_pubkey.call_count)
+        self.assertRaises(api_exc.ValidationError, api_utils.get_upload_key,
+                          'ssh-rsa H--0', parse=True)
+
+    def test_get_pubkey_fingerprint(self):
+        self.assertEqual('SHA256:HXiuRNa9R2diql2Pg73MJl5J43gJn1BP7RyL+5oYuDQ',
+                         api_utils.get_pubkey_fingerprint(PUB_KEY))
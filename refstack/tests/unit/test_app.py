@@ -15,8 +15,10 @@
 
 """Tests for API's utility"""
 
+import datetime
 import json
 
+from cryptography import fernet
 import mock
 from oslo_config import fixture as config_fixture
 from oslotest import base
@@ -24,7 +26,9 @@ import pecan
 import webob
 
 from refstack.api import app
+from refstack.api import constants as const
 from refstack.api import exceptions as api_exc
+from refstack.api import session
 
 
 def get_response_kwargs(response_mock):
@@ -174,6 +178,90 @@ class CORSHookTestCase(base.BaseTestCase):
                          state.response.headers)
 
 
+class AuthContextHookTestCase(base.BaseTestCase):
+    """
+    Tests for the authentication context hook used by the application.
+    """
+
+    @mock.patch('refstack.db.get_query_count')
+    @mock.patch('refstack.api.utils.get_user_id', return_value='openid')
+    def test_auth_context(self, mock_get_user_id, mock_query_count):
+        hook = app.AuthContextHook()
+        request = pecan.core.Request({'REQUEST_METHOD': 'GET',
+                                      'PATH_INFO': '/v1/profile'})
+        state = pecan.core.RoutingState(request, pecan.core.Response(), None)
+        mock_query_count.return_value = 10
+        hook.on_route(state)
+
+        context = request.environ[const.AUTH_CONTEXT_ENV]
+        self.assertEqual('openid', context.openid)
+        self.assertRaises(AttributeError, setattr, context, 'openid', 'foo')
+
+        mock_query_count.return_value = 13
+        with mock.patch.object(app.LOG, 'debug') as mock_debug:
+            hook.after(state)
+        mock_debug.assert_called_once_with(
+            '%(method)s %(path)s: %(count)d DB queries',
+            {'method': 'GET', 'path': '/v1/profile', 'count': 3})
+
+
+class ConditionalGetHookTestCase(base.BaseTestCase):
+    """
+    Tests for the conditional GET hook used by the application.
+    """
+
+    def _after(self, headers=None, method='GET', etag='abc',
+               last_modified=None):
+        request = pecan.core.Request.blank('/v1/results/1', headers=headers)
+        request.method = method
+        response = pecan.core.Response(body=b'{"id": 1}',
+                                       content_type='application/json')
+        if etag:
+            response.etag = etag
+        response.last_modified = last_modified
+        state = pecan.core.RoutingState(request, response, None)
+        app.ConditionalGetHook().after(state)
+        return response
+
+    def test_if_none_match(self):
+        response = self._after({'If-None-Match': '"abc"'})
+        self.assertEqual(304, response.status_int)
+        self.assertEqual(b'', response.body)
+        self.assertNotIn('Content-Type', response.headers)
+        self.assertEqual('"abc"', response.headers['ETag'])
+
+        # nginx weakens ETags when it compresses responses.
+        response = self._after({'If-None-Match': 'W/"abc", "def"'})
+        self.assertEqual(304, response.status_int)
+
+        for response in (self._after({'If-None-Match': '"def"'}),
+                         self._after({'If-None-Match': '"abc"'},
+                                     method='POST'),
+                         self._after({'If-None-Match': '"abc"'}, etag=None),
+                         self._after()):
+            self.assertEqual(200, response.status_int)
+            self.assertEqual(b'{"id": 1}', response.body)
+
+    def test_if_modified_since(self):
+        last_modified = datetime.datetime(2017, 1, 2, 3, 4, 5)
+        response = self._after(
+            {'If-Modified-Since': 'Mon, 02 Jan 2017 03:04:05 GMT'},
+            last_modified=last_modified)
+        self.assertEqual(304, response.status_int)
+
+        response = self._after(
+            {'If-Modified-Since': 'Mon, 02 Jan 2017 03:04:04 GMT'},
+            last_modified=last_modified)
+        self.assertEqual(200, response.status_int)
+
+        # If-None-Match takes precedence.
+        response = self._after(
+            {'If-Modified-Since': 'Mon, 02 Jan 2017 03:04:05 GMT',
+             'If-None-Match': '"def"'},
+            last_modified=last_modified)
+        self.assertEqual(200, response.status_int)
+
+
 class SetupAppTestCase(base.BaseTestCase):
 
     def setUp(self):
@@ -181,7 +269,10 @@ class SetupAppTestCase(base.BaseTestCase):
         self.config_fixture = config_fixture.Config()
         self.CONF = self.useFixture(self.config_fixture).conf
 
+    @mock.patch('refstack.api.guidelines.start_guideline_refresh')
     @mock.patch('pecan.hooks')
+    @mock.patch.object(app, 'ConditionalGetHook')
+    @mock.patch.object(app, 'AuthContextHook')
     @mock.patch.object(app, 'JSONErrorHook')
     @mock.patch.object(app, 'CORSHook')
     @mock.patch.object(app, 'JWTAuthHook')
@@ -190,7 +281,9 @@ class SetupAppTestCase(base.BaseTestCase):
     @mock.patch('refstack.api.app.SessionMiddleware')
     @mock.patch('refstack.api.utils.get_token', return_value='42')
     def test_setup_app(self, get_token, session_middleware, make_app, os_join,
-                       auth_hook, json_error_hook, cors_hook, pecan_hooks):
+                       auth_hook, json_error_hook, cors_hook,
+                       auth_context_hook, conditional_get_hook, pecan_hooks,
+                       start_refresh):
 
         self.CONF.set_override('app_dev_mode',
                                True,
@@ -210,6 +303,8 @@ class SetupAppTestCase(base.BaseTestCase):
         json_error_hook.return_value = 'json_error_hook'
         cors_hook.return_value = 'cors_hook'
         auth_hook.return_value = 'jwt_auth_hook'
+        auth_context_hook.return_value = 'auth_context_hook'
+        conditional_get_hook.return_value = 'conditional_get_hook'
         pecan_hooks.RequestViewerHook.return_value = 'request_viewer_hook'
         pecan_config = mock.Mock()
         pecan_config.app = {'root': 'fake_pecan_config'}
@@ -226,7 +321,8 @@ class SetupAppTestCase(base.BaseTestCase):
             debug=True,
             static_root='fake_static_root',
             template_path='fake_template_path',
-            hooks=['jwt_auth_hook', 'cors_hook', 'json_error_hook',
+            hooks=['jwt_auth_hook', 'auth_context_hook',
+                   'conditional_get_hook', 'cors_hook', 'json_error_hook',
                    'request_viewer_hook']
         )
         session_middleware.assert_called_once_with(
@@ -238,3 +334,34 @@ class SetupAppTestCase(base.BaseTestCase):
              'session.validate_key': get_token.return_value,
              'session.sa.pool_recycle': 600}
         )
+        start_refresh.assert_called_once_with(3600)
+
+        start_refresh.reset_mock()
+        self.CONF.set_override('guidelines_refresh_interval', 0, 'api')
+        app.setup_app(pecan_config)
+        self.assertFalse(start_refresh.called)
+
+    @mock.patch('refstack.api.guidelines.start_guideline_refresh')
+    @mock.patch('pecan.make_app')
+    @mock.patch('refstack.api.app.SessionMiddleware')
+    def test_setup_app_cookie_sessions(self, session_middleware, make_app,
+                                       start_refresh):
+        self.CONF.set_override('session_backend', 'cookie', 'api')
+        self.CONF.set_override('session_cookie_keys',
+                               [fernet.Fernet.generate_key().decode('ascii')],
+                               'api')
+        make_app.return_value = 'fake_app'
+        pecan_config = mock.Mock()
+        pecan_config.app = {'root': 'fake_pecan_config'}
+
+        result = app.setup_app(pecan_config)
+
+        self.assertIsInstance(result, session.CookieSessionMiddleware)
+        self.assertEqual('fake_app', result.app)
+        self.assertEqual(app.SESSION_TIMEOUT, result.timeout)
+        self.assertFalse(session_middleware.called)
+
+        # A random key is used if no keys are configured.
+        self.CONF.set_override('session_cookie_keys', [], 'api')
+        result = app.setup_app(pecan_config)
+        self.assertIsInstance(result, session.CookieSessionMiddleware)
@@ -0,0 +1,117 @@
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for in-memory caches."""
+
+import mock
+from oslotest import base
+
+from refstack.api import cache as api_cache
+from refstack import cache
+from refstack import db
+
+
+class TTLCacheTestCase(base.BaseTestCase):
+    """Test case for TTLCache."""
+
+    def setUp(self):
+        super(TTLCacheTestCase, self).setUp()
+        self.now = 1000
+        self.cache = cache.TTLCache(maxsize=2, ttl=10,
+                                    timer=lambda: self.now)
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('foo'))
+        self.assertEqual('bar', self.cache.get('foo', 'bar'))
+        self.cache.set('foo', 'value')
+        self.assertEqual('value', self.cache.get('foo'))
+        self.assertEqual({'hits': 1, 'misses': 2, 'size': 1},
+                         self.cache.stats())
+
+    def test_expiration(self):
+        self.cache.set('foo', 'value')
+        self.cache.set('bar', 'value', ttl=20)
+        self.now += 10
+        self.assertIsNone(self.cache.get('foo'))
+        self.assertEqual('value', self.cache.get('bar'))
+        self.now += 10
+        self.assertIsNone(self.cache.get('bar'))
+        self.assertEqual(0, len(self.cache))
+
+        no_ttl_cache = cache.TTLCache(timer=lambda: self.now)
+        no_ttl_cache.set('foo', 'value')
+        self.now += 10 ** 6
+        self.assertEqual('value', no_ttl_cache.get('foo'))
+
+    def test_lru_eviction(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        # Make 'a' the most recently used entry.
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertEqual(2, len(self.cache))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(1, self.cache.get('a'))
+        self.assertEqual(3, self.cache.get('c'))
+
+    def test_get_or_set(self):
+        func = mock.Mock(return_value='value')
+        self.assertEqual('value',
+                         self.cache.get_or_set('foo', func, 1, bar=2, ttl=5))
+        self.assertEqual('value', self.cache.get_or_set('foo', func, 1))
+        func.assert_called_once_with(1, bar=2)
+        self.now += 5
+        self.cache.get_or_set('foo', func, 1)
+        self.assertEqual(2, func.call_count)
+
+        # Falsy values are cached too.
+        func.return_value = None
+        self.cache.get_or_set('none', func)
+        self.cache.get_or_set('none', func)
+        self.assertEqual(3, func.call_count)
+
+    def test_pop_clear(self):
+        self.cache.set('foo', 'value')
+        self.cache.set('bar', 'value')
+        self.cache.pop('foo')
+        self.cache.pop('missing')
+        self.assertIsNone(self.cache.get('foo'))
+        self.assertEqual('value', self.cache.get('bar'))
+        self.cache.clear()
+        self.assertEqual(0, len(self.cache))
+
+
+class APICacheTestCase(base.BaseTestCase):
+    """Test case for invalidation of API caches."""
+
+    @mock.patch('refstack.api.response_cache.invalidate')
+    def test_invalidate(self, mock_invalidate):
+        self.addCleanup(api_cache.parsed_pubkeys.clear)
+        self.addCleanup(api_cache.verified_tokens.clear)
+        self.addCleanup(api_cache.upload_keys.clear)
+        api_cache.parsed_pubkeys.set('key-id', 'key')
+        api_cache.verified_tokens.set('digest', {'openid': 'user'})
+        api_cache.upload_keys.set('fingerprint', {'openid': 'user'})
+
+        api_cache.invalidate(db.PRODUCTS, db.RESULTS)
+        mock_invalidate.assert_called_once_with(db.PRODUCTS, db.RESULTS)
+        self.assertEqual('key', api_cache.parsed_pubkeys.get('key-id'))
+
+        # Tokens and uploads signed with deleted keys are verified again.
+        api_cache.invalidate(db.PUBKEYS)
+        mock_invalidate.assert_called_with()
+        self.assertEqual(0, len(api_cache.parsed_pubkeys))
+        self.assertEqual(0, len(api_cache.verified_tokens))
+        self.assertEqual(0, len(api_cache.upload_keys))
@@ -0,0 +1,336 @@
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import numpy
+
+from refstack.api import compliance
+from refstack.api import guidelines
+from refstack.db.sqlalchemy import api as db_api
+from refstack.tests import unit as base
+
+GUIDELINE = {
+    'metadata': {
+        'schema': '2.0',
+    },
+    'platforms': {
+        'OpenStack Powered Compute': {
+            'components': [{'name': 'os_powered_compute'}]
+        },
+    },
+    'components': {
+        'os_powered_compute': {
+            'capabilities': {
+                'required': ['cap-1', 'cap-2'],
+                'advisory': ['cap-3'],
+            }
+        }
+    },
+    'capabilities': {
+        'cap-1': {
+            'tests': {
+                'test_1': {'idempotent_id': 'id-1'},
+                'test_2': {'idempotent_id': 'id-2',
+                           'aliases': ['test_2_1']},
+                'test_3': {'idempotent_id': 'id-3',
+                           'flagged': {'reason': 'foo'}}
+            }
+        },
+        'cap-2': {
+            'tests': {
+                'test_4': {'idempotent_id': 'id-4'},
+                'test_5': {'idempotent_id': 'id-5'}
+            }
+        },
+        'cap-3': {
+            'tests': {
+                'test_6': {'idempotent_id': 'id-6'}
+            }
+        }
+    }
+}
+
+NAME_BITS = {'test_1': 3, 'test_2': 17, 'test_2_1': 40, 'test_3': 4,
+             'test_4': 9, 'test_6': 1}
+
+
+class ComplianceTestCase(base.RefstackBaseTestCase):
+    """Test case for compliance evaluation."""
+
+    def setUp(self):
+        super(ComplianceTestCase, self).setUp()
+        self.mock_name_bits = self.setup_mock(
+            'refstack.db.get_test_name_bits', return_value=NAME_BITS)
+        # Guideline sources are not needed to compile a guideline.
+        self.setup_mock('refstack.api.guidelines.Guidelines.__init__',
+                        return_value=None)
+
+    def _bitset(self, names):
+        return db_api._encode_bitset(NAME_BITS[name] for name in names)
+
+    def test_to_bitset_matrix(self):
+        matrix = compliance.to_bitset_matrix([b'\x01', b'\x00\x02'], 3)
+        expected = numpy.array([[1, 0, 0], [0, 2, 0]], dtype=numpy.uint8)
+        numpy.testing.assert_array_equal(expected, matrix)
+        self.assertEqual((0, 0), compliance.to_bitset_matrix([]).shape)
+
+    def test_compile_target(self):
+        compiled = compliance.compile_target(GUIDELINE, target='compute')
+        self.assertEqual(4, compiled.test_count)
+        self.assertEqual(1, compiled.unknown_count)
+        self.assertEqual({'test_5'}, compiled.unknown_names)
+        self.assertEqual(6, compiled.width)
+        self.assertEqual(1, len(compiled.alias_masks))
+        self.assertEqual(
+            sorted([{'test_1'}, {'test_2', 'test_2_1'}, {'test_4'},
+                    {'test_5'}], key=sorted),
+            sorted(compiled.tests, key=sorted))
+        # Reading guidelines doesn't register test names.
+        self.mock_name_bits.assert_called_once_with(
+            {'test_1', 'test_2', 'test_2_1', 'test_4', 'test_5'})
+
+    def test_count_missing(self):
+        compiled = compliance.compile_target(GUIDELINE, target='compute')
+        runs = [[],
+                ['test_1', 'test_2', 'test_4'],
+                ['test_1', 'test_2_1', 'test_3', 'test_4', 'test_6'],
+                ['test_2', 'test_2_1', 'test_6']]
+        matrix = compliance.to_bitset_matrix(
+            [self._bitset(names) for names in runs])
+
+        missing = compiled.count_missing(matrix)
+
+        # The result must match a plain set-based evaluation.
+        expected = [sum(1 for test in compiled.tests if not test & set(run))
+                    for run in runs]
+        self.assertEqual(expected, missing.tolist())
+        self.assertEqual([4, 1, 1, 3], missing.tolist())
+
+    def test_count_missing_narrow_matrix(self):
+        compiled = compliance.compile_target(GUIDELINE, target='compute')
+        matrix = compliance.to_bitset_matrix([self._bitset(['test_1'])])
+        self.assertEqual(1, matrix.shape[1])
+        self.assertEqual([3], compiled.count_missing(matrix).tolist())
+
+    @mock.patch('refstack.db.get_test_result_bitsets')
+    def test_evaluate_test_runs(self, mock_bitsets):
+        compiled = compliance.compile_target(GUIDELINE, target='compute')
+        mock_bitsets.return_value = {
+            'id1': self._bitset(['test_1', 'test_2', 'test_4']),
+            'id2': self._bitset(['test_6']),
+        }
+
+        result = compliance.evaluate_test_runs(['id1', 'id2', 'id3'],
+                                               {'compute': compiled})
+
+        self.assertEqual({'compute': {'id1': 1, 'id2': 4}}, result)
+        mock_bitsets.assert_called_once_with(['id1', 'id2', 'id3'])
+
+
+class EligibilityTestCase(base.RefstackBaseTestCase):
+    """Test case for evaluation against all guidelines."""
+
+    def setUp(self):
+        super(EligibilityTestCase, self).setUp()
+        self.mock_name_bits = self.setup_mock(
+            'refstack.db.get_test_name_bits', return_value=NAME_BITS)
+        self.mock_last_bit = self.setup_mock(
+            'refstack.db.get_last_test_name_bit', return_value=40)
+        self.setup_mock('refstack.api.guidelines.Guidelines.__init__',
+                        return_value=None)
+        self.mock_list = self.setup_mock(
+            'refstack.api.guidelines.Guidelines.get_guideline_list',
+            return_value={'powered': [{'name': '2018.02.json',
+                                       'file': '2018.02.json'}],
+                          'dns': [{'name': '2018.02.json',
+                                   'file': 'dns.2018.02.json'}]})
+        self.mock_contents = self.setup_mock(
+            'refstack.api.guidelines.Guidelines.get_guideline_contents',
+            side_effect=lambda guideline_file: {
+                '2018.02.json': GUIDELINE}.get(guideline_file))
+        self.mock_digest = self.setup_mock(
+            'refstack.api.guidelines.Guidelines.get_guideline_digest',
+            side_effect=lambda guideline_file, guideline_json:
+                guidelines.get_digest(guideline_json))
+        self.mock_bitsets = self.setup_mock(
+            'refstack.db.get_test_result_bitsets',
+            side_effect=lambda test_ids: {
+                'id1': db_api._encode_bitset([3, 17, 9]),
+                'id2': db_api._encode_bitset([3])})
+        self.addCleanup(compliance._eligibility_cache.clear)
+        self.addCleanup(compliance._compiled_guidelines.update,
+                        {'digest': None, 'targets': {}, 'last_bit': None})
+
+    def test_get_compiled_guidelines(self):
+        digest, targets = compliance.get_compiled_guidelines()
+        # Only the compute target is defined in the guideline, and the
+        # add-on guideline could not be retrieved.
+        self.assertEqual([('2018.02.json', 'compute')], list(targets))
+        self.assertEqual((digest, targets),
+                         compliance.get_compiled_guidelines())
+        self.assertEqual(1, compliance.get_compiled_guidelines()[1][
+            ('2018.02.json', 'compute')].unknown_count)
+
+        # The compiled targets are checked against the digests of the
+        # guideline files, which aren't serialized again.
+        self.mock_digest.side_effect = None
+        self.mock_digest.return_value = guidelines.get_digest(GUIDELINE)
+        self.mock_contents.side_effect = lambda guideline_file: {
+            '2018.02.json': {'capabilities': {}}}.get(guideline_file)
+        self.assertEqual((digest, targets),
+                         compliance.get_compiled_guidelines())
+        self.mock_digest.assert_called_with('2018.02.json',
+                                            {'capabilities': {}})
+
+        # Targets are recompiled when a guideline changes.
+        self.mock_digest.return_value = 'new-digest'
+        new_digest, new_targets = compliance.get_compiled_guidelines()
+        self.assertNotEqual(digest, new_digest)
+        self.assertEqual({}, new_targets)
+
+    def test_get_compiled_guidelines_registered_names(self):
+        digest, targets = compliance.get_compiled_guidelines()
+
+        # Other registered names don't change the compiled targets, and
+        # unknown names are only looked up again after registrations.
+        self.mock_last_bit.return_value = 41
+        self.mock_name_bits.return_value = {}
+        self.assertEqual((digest, targets),
+                         compliance.get_compiled_guidelines())
+        self.mock_name_bits.assert_called_with({'test_5'})
+        call_count = self.mock_name_bits.call_count
+        self.assertEqual((digest, targets),
+                         compliance.get_compiled_guidelines())
+        self.assertEqual(call_count, self.mock_name_bits.call_count)
+
+        # Targets are recompiled once an unknown test name is registered.
+        self.mock_last_bit.return_value = 42
+        self.mock_name_bits.return_value = dict(NAME_BITS, test_5=42)
+        new_digest, new_targets = compliance.get_compiled_guidelines()
+        self.assertEqual(digest, new_digest)
+        self.assertEqual(0, new_targets[
+            ('2018.02.json', 'compute')].unknown_count)
+
+    def test_get_eligibility(self):
+        self.assertEqual(
+            {'passing': [],
+             'missing_required': {'2018.02.json': {'compute': 1}}},
+            compliance.get_eligibility('id1'))
+        self.assertEqual(
+            {'passing': [],
+             'missing_required': {'2018.02.json': {'compute': 3}}},
+            compliance.get_eligibility('id2'))
+        self.assertEqual(
+            {'passing': [], 'missing_required': {}},
+            compliance.get_eligibility('id3'))
+
+        # Answers are cached until the guidelines change.
+        compliance.get_eligibility('id1')
+        self.assertEqual(3, self.mock_bitsets.call_count)
+
+        guideline = dict(GUIDELINE, capabilities=dict(
+            GUIDELINE['capabilities'], **{'cap-2': {'tests': {
+                'test_4': {'idempotent_id': 'id-4'}}}}))
+        self.mock_contents.side_effect = lambda guideline_file: {
+            '2018.02.json': guideline}.get(guideline_file)
+        self.assertEqual(
+            {'passing': [{'guideline': '2018.02.json', 'target': 'compute'}],
+             'missing_required': {'2018.02.json': {'compute': 0}}},
+            compliance.get_eligibility('id1'))
+        self.assertEqual(4, self.mock_bitsets.call_count)
+
+
+class CapabilityStatsTestCase(base.RefstackBaseTestCase):
+    """Test case for capability pass rate analytics."""
+
+    def setUp(self):
+        super(CapabilityStatsTestCase, self).setUp()
+        self.setup_mock('refstack.db.get_test_name_bits',
+                        return_value=NAME_BITS)
+        self.setup_mock('refstack.api.guidelines.Guidelines.__init__',
+                        return_value=None)
+        self.setup_mock(
+            'refstack.api.guidelines.Guidelines.get_guideline_list',
+            return_value={'powered': [{'name': '2018.02.json',
+                                       'file': '2018.02.json'}]})
+        self.setup_mock(
+            'refstack.api.guidelines.Guidelines.get_guideline_contents',
+            return_value=GUIDELINE)
+        self.setup_mock('refstack.db.get_shared_test_result_ids',
+                        return_value=['id1', 'id2', 'id3'])
+        bitsets = {'id1': db_api._encode_bitset([3, 40, 9]),
+                   'id2': db_api._encode_bitset([3, 17, 1]),
+                   'id3': db_api._encode_bitset([])}
+        self.mock_bitsets = self.setup_mock(
+            'refstack.db.get_test_result_bitsets',
+            side_effect=lambda test_ids: dict(
+                (test_id, bitsets[test_id]) for test_id in test_ids))
+        self.setup_mock('refstack.api.compliance._STATS_BATCH_SIZE', 2)
+
+    def test_compile_capabilities(self):
+        compiled = compliance.compile_capabilities(GUIDELINE)
+        self.assertEqual(['cap-1', 'cap-2', 'cap-3'], sorted(compiled))
+        self.assertEqual(2, compiled['cap-1'].test_count)
+        self.assertEqual(2, compiled['cap-2'].test_count)
+        self.assertEqual(1, compiled['cap-2'].unknown_count)
+        self.assertEqual(1, compiled['cap-3'].test_count)
+
+    @mock.patch.object(compliance, '_report_targets',
+                       compliance.cache.TTLCache())
+    def test_get_compliance_report(self):
+        report = compliance.get_compliance_report(
+            GUIDELINE, 'digest', 'compute', {'test_1', 'test_2_1', 'test_6'})
+        self.assertEqual(
+            [{'id': 'cap-1', 'status': 'required', 'passed_count': 2,
+              'test_count': 3, 'missing': [], 'flagged': ['test_3']},
+             {'id': 'cap-2', 'status': 'required', 'passed_count': 0,
+              'test_count': 2, 'missing': ['test_4', 'test_5'],
+              'flagged': []},
+             {'id': 'cap-3', 'status': 'advisory', 'passed_count': 1,
+              'test_count': 1, 'missing': [], 'flagged': []}],
+            sorted(report['capabilities'], key=lambda cap: cap['id']))
+        self.assertEqual({'capabilities': 2, 'passed_capabilities': 1,
+                          'tests': 5, 'passed_tests': 2},
+                         report['summary']['required'])
+        self.assertEqual(0, report['summary']['removed']['capabilities'])
+
+        # Capabilities and tests of the target are compiled once.
+        with mock.patch.object(compliance,
+                               '_compile_report_target') as mock_compile:
+            report = compliance.get_compliance_report(
+                GUIDELINE, 'digest', 'compute', set())
+            self.assertFalse(mock_compile.called)
+        self.assertEqual(0, report['summary']['advisory']['passed_tests'])
+
+        self.assertRaises(KeyError, compliance.get_compliance_report,
+                          GUIDELINE, 'digest', 'platform', set())
+
+    def test_compute_capability_stats(self):
+        stats = compliance.compute_capability_stats()
+        self.assertEqual(
+            [{'guideline': '2018.02.json', 'capability': 'cap-1',
+              'run_count': 3, 'pass_count': 2},
+             {'guideline': '2018.02.json', 'capability': 'cap-2',
+              'run_count': 3, 'pass_count': 0},
+             {'guideline': '2018.02.json', 'capability': 'cap-3',
+              'run_count': 3, 'pass_count': 1}],
+            stats)
+        self.mock_bitsets.assert_has_calls([mock.call(['id1', 'id2']),
+                                            mock.call(['id3'])])
+
+    @mock.patch('refstack.db.save_capability_stats')
+    def test_update_capability_stats(self, mock_save):
+        stats = compliance.update_capability_stats()
+        mock_save.assert_called_once_with(stats)
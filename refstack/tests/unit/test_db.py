@@ -20,11 +20,13 @@ import hashlib
 import six
 import mock
 from oslo_config import fixture as config_fixture
+from oslo_db import exception as db_exc
 from oslotest import base
 import sqlalchemy.orm
 
 from refstack import db
 from refstack.api import constants as api_const
+from refstack import cache
 from refstack.db.sqlalchemy import api
 from refstack.db.sqlalchemy import models
 
@@ -32,16 +34,32 @@ from refstack.db.sqlalchemy import models
 class DBAPITestCase(base.BaseTestCase):
     """Test case for database API."""
 
+    @mock.patch.object(db.api, '_change_listeners', [])
     @mock.patch.object(api, 'store_test_results')
     def test_store_test_results(self, mock_store_test_results):
+        listener = mock.Mock()
+        db.add_change_listener(listener)
+        # Listeners are registered once.
+        db.add_change_listener(listener)
         db.store_test_results('fake_results')
         mock_store_test_results.assert_called_once_with('fake_results')
+        listener.assert_called_once_with(db.RESULTS)
 
     @mock.patch.object(api, 'get_test_result')
     def test_get_test_result(self, mock_get_test_result):
         db.get_test_result(12345)
         mock_get_test_result.assert_called_once_with(12345, allowed_keys=None)
 
+    @mock.patch.object(api, 'get_test_result_version')
+    def test_get_test_result_version(self, mock_get_version):
+        db.get_test_result_version(12345)
+        mock_get_version.assert_called_once_with(12345)
+
+    @mock.patch.object(api, 'get_organization_version')
+    def test_get_organization_version(self, mock_get_version):
+        db.get_organization_version('org-id')
+        mock_get_version.assert_called_once_with('org-id')
+
     @mock.patch.object(api, 'get_test_results')
     def test_get_test_results(self, mock_get_test_results):
         db.get_test_results(12345)
@@ -51,7 +69,7 @@ class DBAPITestCase(base.BaseTestCase):
     def test_get_test_result_records(self, mock_db):
         filters = mock.Mock()
         db.get_test_result_records(1, 2, filters)
-        mock_db.assert_called_once_with(1, 2, filters)
+        mock_db.assert_called_once_with(1, 2, filters, limit=None)
 
     @mock.patch.object(api, 'get_test_result_records_count')
     def test_get_test_result_records_count(self, mock_db):
@@ -59,6 +77,220 @@ class DBAPITestCase(base.BaseTestCase):
         db.get_test_result_records_count(filters)
         mock_db.assert_called_once_with(filters)
 
+    @mock.patch.object(db.api, '_records_count_executor')
+    @mock.patch.object(db.api, '_records_count_cache',
+                       cache.TTLCache(maxsize=10))
+    @mock.patch('time.time')
+    @mock.patch.object(api, 'get_test_result_records_count')
+    def test_get_approximate_test_result_records_count(self, mock_count,
+                                                       mock_time,
+                                                       mock_executor):
+        mock_time.return_value = 1000
+        mock_count.return_value = 10
+        filters = {api_const.CPID: 'fake-cpid'}
+        self.assertEqual(10,
+                         db.get_approximate_test_result_records_count(filters))
+        mock_count.return_value = 20
+        self.assertEqual(10,
+                         db.get_approximate_test_result_records_count(filters))
+        self.assertEqual(1, mock_count.call_count)
+        self.assertEqual(20, db.get_approximate_test_result_records_count({}))
+
+        # Outdated counts are refreshed in the background, once at a time.
+        mock_time.return_value = 1300
+        self.assertEqual(10,
+                         db.get_approximate_test_result_records_count(filters))
+        self.assertEqual(10,
+                         db.get_approximate_test_result_records_count(filters))
+        mock_executor.submit.assert_called_once_with(
+            db.api._refresh_records_count, mock.ANY, filters)
+
+        refresh, key, refresh_filters = mock_executor.submit.call_args[0]
+        refresh(key, refresh_filters)
+        self.assertEqual(20,
+                         db.get_approximate_test_result_records_count(filters))
+        self.assertEqual(1, mock_executor.submit.call_count)
+
+    @mock.patch.object(api, 'get_test_results_by_name')
+    def test_get_test_results_by_name(self, mock_db):
+        db.get_test_results_by_name(['id1', 'id2'])
+        mock_db.assert_called_once_with(['id1', 'id2'])
+
+    @mock.patch.object(api, 'get_test_names')
+    def test_get_test_names(self, mock_db):
+        db.get_test_names('tempest.api', 20, filters={'signed': True})
+        mock_db.assert_called_once_with('tempest.api', 20,
+                                        filters={'signed': True})
+
+    @mock.patch.object(api, 'get_test_name_bits')
+    def test_get_test_name_bits(self, mock_db):
+        db.get_test_name_bits(['tempest.a'], create=True)
+        mock_db.assert_called_once_with(['tempest.a'], create=True)
+
+    @mock.patch.object(api, 'get_last_test_name_bit')
+    def test_get_last_test_name_bit(self, mock_db):
+        db.get_last_test_name_bit()
+        mock_db.assert_called_once_with()
+
+    @mock.patch.object(api, 'get_test_result_bitsets')
+    def test_get_test_result_bitsets(self, mock_db):
+        db.get_test_result_bitsets(['id1', 'id2'])
+        mock_db.assert_called_once_with(['id1', 'id2'])
+
+    @mock.patch.object(api, 'get_shared_test_result_ids')
+    def test_get_shared_test_result_ids(self, mock_db):
+        db.get_shared_test_result_ids()
+        mock_db.assert_called_once_with()
+
+    @mock.patch.object(api, 'get_product_versions_by_products')
+    def test_get_product_versions_by_products(self, mock_db):
+        db.get_product_versions_by_products(['prod1'], allowed_keys=['id'])
+        mock_db.assert_called_once_with(['prod1'], allowed_keys=['id'])
+
+    @mock.patch.object(api, 'get_latest_test_results_by_versions')
+    def test_get_latest_test_results_by_versions(self, mock_db):
+        db.get_latest_test_results_by_versions(['ver1', 'ver2'])
+        mock_db.assert_called_once_with(['ver1', 'ver2'])
+
+    @mock.patch.object(api, 'save_capability_stats')
+    def test_save_capability_stats(self, mock_db):
+        db.save_capability_stats(['fake_stats'])
+        mock_db.assert_called_once_with(['fake_stats'])
+
+    @mock.patch.object(api, 'get_capability_stats')
+    def test_get_capability_stats(self, mock_db):
+        db.get_capability_stats('2017.09.json')
+        mock_db.assert_called_once_with('2017.09.json')
+
+    @mock.patch.object(api, 'get_user_group_ids')
+    @mock.patch.object(api, 'get_foundation_group_id')
+    def test_is_foundation_user(self, mock_group_id, mock_user_groups):
+        self.addCleanup(db.api._membership_cache.clear)
+        mock_group_id.return_value = 'foundation-group'
+        mock_user_groups.return_value = frozenset(['foundation-group'])
+        self.assertTrue(db.is_foundation_user('user@example.com'))
+        self.assertTrue(db.is_foundation_user('user@example.com'))
+        mock_group_id.assert_called_once_with()
+        mock_user_groups.assert_called_once_with('user@example.com')
+
+        # Membership changes are visible immediately.
+        with mock.patch.object(api, 'remove_user_from_group'):
+            db.remove_user_from_group('user@example.com', 'foundation-group')
+        mock_user_groups.return_value = frozenset()
+        self.assertFalse(db.is_foundation_user('user@example.com'))
+
+        with mock.patch.object(api, 'delete_organization'):
+            db.delete_organization('org-id')
+        mock_group_id.return_value = None
+        self.assertFalse(db.is_foundation_user('user@example.com'))
+        self.assertEqual(2, mock_group_id.call_count)
+
+    @mock.patch.object(api, 'get_product_version_admins_by_cpid')
+    def test_get_product_version_admins_by_cpid(self, mock_db):
+        self.addCleanup(db.api._cpid_cache.clear)
+        versions = [{'id': 'ver1', 'product_id': 'prod1',
+                     'admins': frozenset(['user'])}]
+        mock_db.return_value = versions
+        self.assertEqual(versions,
+                         db.get_product_version_admins_by_cpid('cpid'))
+        self.assertEqual(versions,
+                         db.get_product_version_admins_by_cpid('cpid'))
+        mock_db.assert_called_once_with('cpid')
+
+        # Changes of versions and memberships are visible immediately.
+        for func, args in (('add_product_version',
+                            ('prod1', '2.0', 'user', 'cpid')),
+                           ('update_product_version', ({'id': 'ver1'},)),
+                           ('delete_product_version', ('ver1',)),
+                           ('add_user_to_group', ('user', 'group', 'user')),
+                           ('remove_user_from_group', ('user', 'group'))):
+            with mock.patch.object(api, func):
+                getattr(db, func)(*args)
+            db.get_product_version_admins_by_cpid('cpid')
+        self.assertEqual(6, mock_db.call_count)
+
+    @mock.patch.object(api, 'get_user_group_ids')
+    @mock.patch.object(api, 'get_organization_group_id')
+    def test_is_organization_user(self, mock_group_id, mock_user_groups):
+        self.addCleanup(db.api._membership_cache.clear)
+        stats = db.get_membership_cache_stats()
+        mock_group_id.return_value = 'vendor-group'
+        mock_user_groups.return_value = frozenset()
+        self.assertFalse(db.is_organization_user('org-id', 'user'))
+        self.assertFalse(db.is_organization_user('org-id', 'user'))
+        mock_group_id.assert_called_once_with('org-id')
+        mock_user_groups.assert_called_once_with('user')
+
+        with mock.patch.object(api, 'add_user_to_group'):
+            db.add_user_to_group('user', 'vendor-group', 'admin')
+        mock_user_groups.return_value = frozenset(['vendor-group'])
+        self.assertTrue(db.is_organization_user('org-id', 'user'))
+        new_stats = db.get_membership_cache_stats()
+        self.assertEqual(3, new_stats['hits'] - stats['hits'])
+        self.assertEqual(3, new_stats['misses'] - stats['misses'])
+        self.assertEqual(2, new_stats['size'])
+
+        mock_group_id.side_effect = api.NotFound
+        with mock.patch.object(api, 'delete_organization'):
+            db.delete_organization('org-id')
+        self.assertRaises(api.NotFound, db.is_organization_user,
+                          'org-id', 'user')
+
+    @mock.patch.object(api, 'get_user_group_ids')
+    @mock.patch.object(api, 'get_foundation_group_id')
+    @mock.patch.object(api, 'add_organization')
+    def test_add_organization_invalidates_membership(self, mock_add,
+                                                     mock_group_id,
+                                                     mock_user_groups):
+        self.addCleanup(db.api._membership_cache.clear)
+        mock_group_id.return_value = None
+        mock_user_groups.return_value = frozenset()
+        self.assertFalse(db.is_foundation_user('user'))
+
+        db.add_organization({'name': 'Foundation'}, 'user')
+        mock_add.assert_called_once_with({'name': 'Foundation'}, 'user')
+        mock_group_id.return_value = 'group'
+        mock_user_groups.return_value = frozenset(['group'])
+        self.assertTrue(db.is_foundation_user('user'))
+
+    @mock.patch.object(api, 'get_user_group_ids')
+    @mock.patch.object(api, 'get_foundation_group_id')
+    def test_is_foundation_user_no_cache(self, mock_group_id,
+                                         mock_user_groups):
+        self.addCleanup(db.api._membership_cache.clear)
+        conf = self.useFixture(config_fixture.Config()).conf
+        conf.set_override('membership_cache_ttl', 0)
+        mock_group_id.return_value = 'group'
+        mock_user_groups.return_value = frozenset(['group'])
+        self.assertTrue(db.is_foundation_user('user'))
+
+        # Changes made by another process are not notified, but are
+        # visible if memberships aren't cached.
+        mock_user_groups.return_value = frozenset()
+        self.assertFalse(db.is_foundation_user('user'))
+        self.assertEqual(2, mock_user_groups.call_count)
+
+    @mock.patch.object(api, 'get_query_count')
+    def test_get_query_count(self, mock_db):
+        mock_db.return_value = 42
+        self.assertEqual(42, db.get_query_count())
+        mock_db.assert_called_once_with()
+
+    @mock.patch.object(api, 'store_pubkey')
+    def test_store_pubkey(self, mock_db):
+        mock_db.return_value = 'key-id'
+        self.assertEqual('key-id', db.store_pubkey({'pubkey': 'key'}))
+        mock_db.assert_called_once_with({'pubkey': 'key'})
+
+    @mock.patch.object(db.api, '_change_listeners', [])
+    @mock.patch.object(api, 'delete_pubkey')
+    def test_delete_pubkey(self, mock_db):
+        listener = mock.Mock()
+        db.add_change_listener(listener)
+        db.delete_pubkey('key-id')
+        mock_db.assert_called_once_with('key-id')
+        listener.assert_called_once_with(db.PUBKEYS)
+
     @mock.patch.object(api, 'user_get')
     def test_user_get(self, mock_db):
         user_openid = 'user@example.com'
@@ -97,11 +329,22 @@ class DBHelpersTestCase(base.BaseTestCase):
         facade.get_session.assert_called_once_with(**fake_kwargs)
         self.assertEqual(result, 'fake_session')
 
+    @mock.patch('sqlalchemy.event.listen')
     @mock.patch('oslo_db.sqlalchemy.session.EngineFacade.from_config')
-    def test_create_facade_lazily(self, session):
-        session.return_value = 'fake_session'
+    def test_create_facade_lazily(self, session, mock_listen):
+        self.addCleanup(setattr, api, '_FACADE', None)
+        facade = session.return_value
         result = api._create_facade_lazily()
-        self.assertEqual(result, 'fake_session')
+        self.assertEqual(result, facade)
+        # Queries are counted for every thread.
+        mock_listen.assert_called_once_with(
+            facade.get_engine.return_value, 'before_cursor_execute',
+            api._count_query)
+
+    def test_get_query_count(self):
+        count = api.get_query_count()
+        api._count_query('conn', 'cursor', 'SELECT 1', (), None, False)
+        self.assertEqual(count + 1, api.get_query_count())
 
 
 class DBBackendTestCase(base.BaseTestCase):
@@ -156,13 +399,16 @@ class DBBackendTestCase(base.BaseTestCase):
         self.assertEqual([{'meta': 1}],
                          api._to_dict([fake_model], allowed_keys=('meta')))
 
+    @mock.patch.object(api, 'get_test_name_bits')
     @mock.patch.object(api, 'get_session')
+    @mock.patch('refstack.db.sqlalchemy.models.TestResultsBitset')
     @mock.patch('refstack.db.sqlalchemy.models.TestResults')
     @mock.patch('refstack.db.sqlalchemy.models.Test')
     @mock.patch('refstack.db.sqlalchemy.models.TestMeta')
     @mock.patch('uuid.uuid4')
     def test_store_test_results(self, mock_uuid, mock_test_meta, mock_test,
-                                mock_test_result, mock_get_session):
+                                mock_test_result, mock_bitset,
+                                mock_get_session, mock_name_bits):
         fake_tests_result = {
             'cpid': 'foo',
             'duration_seconds': 10,
@@ -184,6 +430,10 @@ class DBBackendTestCase(base.BaseTestCase):
         test_result = mock_test_result.return_value
         test_result.save = mock.Mock()
 
+        mock_name_bits.return_value = {'tempest.some.test': 1,
+                                       'tempest.test': 9}
+        bitset = mock_bitset.return_value
+
         test_id = api.store_test_results(fake_tests_result)
 
         mock_test.assert_called_once_with()
@@ -197,33 +447,128 @@ class DBBackendTestCase(base.BaseTestCase):
                          fake_tests_result['duration_seconds'])
         self.assertEqual(mock_test_result.call_count,
                          len(fake_tests_result['results']))
+        mock_name_bits.assert_called_once_with(
+            ['tempest.some.test', 'tempest.test'], create=True)
+        self.assertEqual(six.text_type(_id), bitset.test_id)
+        self.assertEqual(b'\x02\x02', bitset.bits)
+        bitset.save.assert_called_once_with(session)
+
+    def test_encode_bitset(self):
+        self.assertEqual(b'', api._encode_bitset([]))
+        self.assertEqual(b'\x01', api._encode_bitset([0]))
+        self.assertEqual(b'\x81\x00\x04', api._encode_bitset([7, 0, 18]))
+
+    @mock.patch.object(api, 'get_session')
+    @mock.patch('refstack.db.sqlalchemy.models.TestName')
+    def test_get_test_name_bits(self, mock_test_name, mock_get_session):
+        session = mock_get_session.return_value
+        session.query.return_value.filter.side_effect = [
+            [('tempest.a', 1)], [('tempest.b', 2)]]
+
+        self.assertEqual({'tempest.a': 1},
+                         api.get_test_name_bits(['tempest.a', 'tempest.b']))
+        self.assertFalse(session.add.called)
+
+        session.query.return_value.filter.side_effect = [
+            [('tempest.a', 1)], [('tempest.b', 2)]]
+        result = api.get_test_name_bits(['tempest.a', 'tempest.b'],
+                                        create=True)
+        self.assertEqual({'tempest.a': 1, 'tempest.b': 2}, result)
+        session.add.assert_called_once_with(mock_test_name.return_value)
+        self.assertEqual('tempest.b', mock_test_name.return_value.name)
 
+    @mock.patch.object(api, 'get_session')
+    def test_get_last_test_name_bit(self, mock_get_session):
+        query = mock_get_session.return_value.query.return_value
+        query.scalar.return_value = 42
+        self.assertEqual(42, api.get_last_test_name_bit())
+
+    @mock.patch.object(api, 'get_session')
+    @mock.patch('refstack.db.sqlalchemy.models.TestName')
+    def test_get_test_name_bits_duplication(self, mock_test_name,
+                                            mock_get_session):
+        session = mock_get_session.return_value
+        session.query.return_value.filter.side_effect = [
+            [], [('tempest.a', 1), ('tempest.b', 2)]]
+        session.add.side_effect = [db_exc.DBDuplicateEntry, None,
+                                   db_exc.DBDuplicateEntry]
+
+        result = api.get_test_name_bits(['tempest.a', 'tempest.b'],
+                                        create=True)
+        self.assertEqual({'tempest.a': 1, 'tempest.b': 2}, result)
+        self.assertEqual(3, session.add.call_count)
+
+    @mock.patch.object(api, 'get_test_name_bits')
+    @mock.patch.object(api, 'get_session')
+    @mock.patch('refstack.db.sqlalchemy.api.models')
+    def test_get_test_result_bitsets(self, mock_models, mock_get_session,
+                                     mock_name_bits):
+        session = mock_get_session.return_value
+        bitset_query = mock.Mock()
+        bitset_query.filter.return_value = [('id1', b'\x01')]
+        test_query = mock.Mock()
+        test_query.filter.return_value.all.return_value = [('id2',)]
+        results_query = mock.Mock()
+        results_query.filter_by.return_value = [('tempest.a',)]
+        session.query.side_effect = [bitset_query, test_query, results_query]
+        mock_name_bits.return_value = {'tempest.a': 10}
+
+        result = api.get_test_result_bitsets(['id1', 'id2', 'id3'])
+
+        self.assertEqual({'id1': b'\x01', 'id2': b'\x00\x04'}, result)
+        mock_name_bits.assert_called_once_with(['tempest.a'], create=True)
+        results_query.filter_by.assert_called_once_with(test_id='id2')
+        bitset = mock_models.TestResultsBitset.return_value
+        self.assertEqual('id2', bitset.test_id)
+        bitset.save.assert_called_once_with(session)
+
+    @mock.patch.object(api, '_bakery')
     @mock.patch.object(api, 'get_session')
     @mock.patch('refstack.db.sqlalchemy.models.Test')
     @mock.patch.object(api, '_to_dict', side_effect=lambda x, *args: x)
-    def test_get_test_result(self, mock_to_dict, mock_test, mock_get_session):
+    def test_get_test_result(self, mock_to_dict, mock_test, mock_get_session,
+                             mock_bakery):
         session = mock_get_session.return_value
-        session.query = mock.Mock()
-        query = session.query.return_value
-        query.filter_by = mock.Mock()
-        filter_by = query.filter_by.return_value
-        mock_result = 'fake_test_info'
-        filter_by.first = mock.Mock(return_value=mock_result)
+        params = mock_bakery.return_value.return_value.params
+        params.return_value.first.return_value = 'fake_test_info'
         test_id = 'fake_id'
         actual_result = api.get_test_result(test_id)
 
         mock_get_session.assert_called_once_with()
+        mock_bakery.return_value.assert_called_once_with(session)
+        params.assert_called_once_with(test_id=test_id)
+        params.return_value.first.assert_called_once_with()
+        self.assertEqual('fake_test_info', actual_result)
+
+        # The baked query is built once, with a bound test id.
+        build_query = mock_bakery.call_args[0][0]
+        build_query(session)
         session.query.assert_called_once_with(mock_test)
-        query.filter_by.assert_called_once_with(id=test_id)
-        filter_by.first.assert_called_once_with()
-        self.assertEqual(mock_result, actual_result)
+        session.query.return_value.filter_by.assert_called_once_with(
+            id=mock.ANY)
 
-        session = mock_get_session.return_value
-        session.query = mock.Mock()
-        query = session.query.return_value
-        query.filter_by.return_value.first.return_value = None
+        params.return_value.first.return_value = None
         self.assertRaises(api.NotFound, api.get_test_result, 'fake_id')
 
+    @mock.patch.object(api, 'get_session')
+    def test_get_test_result_version(self, mock_get_session):
+        query = mock_get_session.return_value.query.return_value
+        first = query.outerjoin.return_value.outerjoin.return_value. \
+            outerjoin.return_value.filter.return_value.group_by. \
+            return_value.first
+        first.return_value = (1, 'fake-created', 'fake-updated', None, None,
+                              2, 'fake-meta-created', None)
+
+        self.assertEqual({'verification_status': 1,
+                          'updated_at': 'fake-updated',
+                          'version': '1|fake-created|fake-updated|None|'
+                                     'None|2|fake-meta-created|None'},
+                         api.get_test_result_version('fake_id'))
+
+        first.return_value = None
+        self.assertRaises(api.NotFound, api.get_test_result_version,
+                          'fake_id')
+
     @mock.patch('refstack.db.sqlalchemy.api.models')
     @mock.patch.object(api, 'get_session')
     def test_delete_test_result(self, mock_get_session, mock_models):
@@ -231,10 +576,12 @@ class DBBackendTestCase(base.BaseTestCase):
         test_query = mock.Mock()
         test_meta_query = mock.Mock()
         test_results_query = mock.Mock()
+        test_bitset_query = mock.Mock()
         session.query = mock.Mock(side_effect={
             mock_models.Test: test_query,
             mock_models.TestMeta: test_meta_query,
-            mock_models.TestResults: test_results_query
+            mock_models.TestResults: test_results_query,
+            mock_models.TestResultsBitset: test_bitset_query
         }.get)
         db.delete_test_result('fake_id')
         session.begin.assert_called_once_with()
@@ -244,6 +591,8 @@ class DBBackendTestCase(base.BaseTestCase):
             .assert_called_once_with()
         test_results_query.filter_by.return_value.delete\
             .assert_called_once_with()
+        test_bitset_query.filter_by.return_value.delete\
+            .assert_called_once_with()
         session.delete.assert_called_once_with(
             test_query.filter_by.return_value.first.return_value)
 
@@ -269,20 +618,26 @@ class DBBackendTestCase(base.BaseTestCase):
         mock_test.save.assert_called_once_with(session=session)
         session.begin.assert_called_once_with()
 
+    @mock.patch.object(api, '_bakery')
     @mock.patch('refstack.db.sqlalchemy.api.models')
     @mock.patch.object(api, 'get_session')
-    def test_get_test_result_meta_key(self, mock_get_session, mock_models):
+    def test_get_test_result_meta_key(self, mock_get_session, mock_models,
+                                      mock_bakery):
         session = mock_get_session.return_value
-        session.query.return_value\
-            .filter_by.return_value\
-            .filter_by.return_value\
-            .first.return_value = mock.Mock(value=42)
+        params = mock_bakery.return_value.return_value.params
+        params.return_value.first.return_value = mock.Mock(value=42)
         self.assertEqual(
             42, db.get_test_result_meta_key('fake_id', 'fake_key'))
-        session.query.return_value\
-            .filter_by.return_value\
-            .filter_by.return_value\
-            .first.return_value = None
+        mock_bakery.return_value.assert_called_once_with(session)
+        params.assert_called_once_with(test_id='fake_id', key='fake_key')
+
+        build_query = mock_bakery.call_args[0][0]
+        build_query(session)
+        session.query.assert_called_once_with(mock_models.TestMeta)
+        session.query.return_value.filter_by.assert_called_once_with(
+            test_id=mock.ANY, meta_key=mock.ANY)
+
+        params.return_value.first.return_value = None
         self.assertEqual(24, db.get_test_result_meta_key(
             'fake_id', 'fake_key', 24))
 
@@ -446,6 +801,161 @@ class DBBackendTestCase(base.BaseTestCase):
         filtered_query = signed_query.filter.return_value
         self.assertEqual(result, filtered_query)
 
+    @mock.patch.object(api, 'get_session')
+    @mock.patch('refstack.db.sqlalchemy.models.TestResults')
+    def test_get_test_results_by_name(self, mock_results, mock_get_session):
+        session = mock_get_session.return_value
+        rows = (session.query.return_value
+                .filter.return_value
+                .order_by.return_value
+                .yield_per.return_value)
+        fake_rows = []
+        for name, test_id in (('tempest.a', 'id1'), ('tempest.a', 'id2'),
+                              ('tempest.b', 'id2')):
+            row = mock.Mock(test_id=test_id)
+            row.name = name
+            fake_rows.append(row)
+        rows.__iter__.return_value = iter(fake_rows)
+
+        result = list(api.get_test_results_by_name(['id1', 'id2']))
+
+        self.assertEqual([('tempest.a', {'id1', 'id2'}),
+                          ('tempest.b', {'id2'})], result)
+        session.query.assert_called_once_with(mock_results.name,
+                                              mock_results.test_id)
+        mock_results.test_id.in_.assert_called_once_with(['id1', 'id2'])
+        session.query.return_value.filter.return_value.order_by.\
+            assert_called_once_with(mock_results.name)
+
+    @mock.patch('refstack.db.sqlalchemy.models.TestResults')
+    def test_get_passed_test_query(self, mock_results):
+        session = mock.Mock()
+        query = session.query.return_value
+
+        result = api._get_passed_test_query(session, 'tempest.foo.bar')
+        session.query.assert_called_once_with(mock_results.test_id)
+        query.filter.assert_called_once_with(
+            mock_results.name == 'tempest.foo.bar')
+        self.assertEqual(query.filter.return_value, result)
+
+        query.filter.reset_mock()
+        test_uuid = '2b4c3b4e-4e1e-4d3c-9f4c-2f0e8b6a4e21'
+        api._get_passed_test_query(session, 'id-' + test_uuid)
+        query.filter.assert_called_once_with(mock_results.uuid == test_uuid)
+
+    @mock.patch.object(api, '_get_passed_test_query')
+    @mock.patch('refstack.db.sqlalchemy.models.Test')
+    def test_apply_filters_for_query_passed_test(self, mock_test,
+                                                 mock_passed_test_query):
+        query = mock.Mock()
+        filters = {
+            api_const.PASSED_TEST: 'tempest.foo.bar',
+            api_const.SIGNED: 'true',
+            api_const.OPENID: 'test-openid'
+        }
+
+        api._apply_filters_for_query(query, filters)
+
+        mock_passed_test_query.assert_called_once_with(query.session,
+                                                       'tempest.foo.bar')
+        mock_test.id.in_.assert_called_once_with(
+            mock_passed_test_query.return_value)
+        query.filter.assert_called_once_with(mock_test.id.in_.return_value)
+
+    @mock.patch.object(api, '_apply_filters_for_query')
+    @mock.patch.object(api, 'get_session')
+    @mock.patch('refstack.db.sqlalchemy.models.Test')
+    @mock.patch('refstack.db.sqlalchemy.models.TestResults')
+    def test_get_test_names(self, mock_results, mock_test, mock_get_session,
+                            mock_apply):
+        session = mock_get_session.return_value
+        query = session.query.return_value
+        visible = query.filter.return_value
+        names = (visible.filter.return_value
+                 .distinct.return_value
+                 .order_by.return_value
+                 .limit.return_value)
+        row = mock.Mock()
+        row.name = 'tempest.a_b.foo'
+        names.__iter__.return_value = iter([row])
+
+        result = api.get_test_names('tempest.a_b', 10)
+
+        self.assertEqual(['tempest.a_b.foo'], result)
+        session.query.assert_has_calls((mock.call(mock_test.id),
+                                        mock.call(mock_results.name)),
+                                       any_order=True)
+        mock_results.name.like.assert_called_once_with('tempest.a\\_b%',
+                                                       escape='\\')
+        # Only visible test runs are searched.
+        mock_apply.assert_called_once_with(query, {})
+        mock_results.test_id.in_.assert_called_once_with(
+            mock_apply.return_value)
+        visible.filter.assert_called_once_with(
+            mock_results.test_id.in_.return_value)
+        visible.filter.return_value.distinct.return_value.order_by.\
+            assert_called_once_with(mock_results.name)
+        visible.filter.return_value.distinct.return_value.order_by.\
+            return_value.limit.assert_called_once_with(10)
+
+    @mock.patch.object(api, 'get_session')
+    @mock.patch('refstack.db.sqlalchemy.api.models')
+    def test_get_shared_test_result_ids(self, mock_models, mock_get_session):
+        session = mock_get_session.return_value
+        test_query = mock.Mock()
+        meta_query = mock.Mock()
+        session.query = mock.Mock(side_effect={
+            mock_models.Test.id: test_query,
+            mock_models.TestMeta.test_id: meta_query
+        }.get)
+        verified_results = test_query.filter_by.return_value
+        verified_results.union.return_value = [('id1',), ('id2',)]
+
+        self.assertEqual(['id1', 'id2'], api.get_shared_test_result_ids())
+        test_query.filter_by.assert_called_once_with(
+            verification_status=api_const.TEST_VERIFIED)
+        meta_query.filter_by.assert_called_once_with(
+            meta_key=api_const.SHARED_TEST_RUN)
+        verified_results.union.assert_called_once_with(
+            meta_query.filter_by.return_value)
+
+    @mock.patch.object(api, 'get_session')
+    @mock.patch('refstack.db.sqlalchemy.models.CapabilityStats')
+    def test_save_capability_stats(self, mock_stats, mock_get_session):
+        session = mock_get_session.return_value
+        stats = [{'guideline': '2017.09.json', 'capability': 'cap-1',
+                  'run_count': 10, 'pass_count': 7}]
+
+        api.save_capability_stats(stats)
+
+        session.begin.assert_called_once_with()
+        session.query.assert_called_once_with(mock_stats)
+        session.query.return_value.delete.assert_called_once_with()
+        capability_stats = mock_stats.return_value
+        session.add.assert_called_once_with(capability_stats)
+        self.assertEqual('2017.09.json', capability_stats.guideline)
+        self.assertEqual('cap-1', capability_stats.capability)
+        self.assertEqual(10, capability_stats.run_count)
+        self.assertEqual(7, capability_stats.pass_count)
+
+    @mock.patch.object(api, 'get_session')
+    @mock.patch('refstack.db.sqlalchemy.models.CapabilityStats')
+    @mock.patch.object(api, '_to_dict', side_effect=lambda x: x)
+    def test_get_capability_stats(self, mock_to_dict, mock_stats,
+                                  mock_get_session):
+        session = mock_get_session.return_value
+        query = session.query.return_value
+
+        result = api.get_capability_stats()
+        self.assertFalse(query.filter_by.called)
+        self.assertEqual(query.order_by.return_value.all.return_value,
+                         result)
+        query.order_by.assert_called_once_with(mock_stats.guideline,
+                                               mock_stats.capability)
+
+        api.get_capability_stats('2017.09.json')
+        query.filter_by.assert_called_once_with(guideline='2017.09.json')
+
     @mock.patch.object(api, '_apply_filters_for_query')
     @mock.patch.object(api, 'get_session')
     @mock.patch('refstack.db.sqlalchemy.models.Test')
@@ -479,6 +989,10 @@ class DBBackendTestCase(base.BaseTestCase):
         ordered_query.offset.assert_called_once_with(per_page)
         query_with_offset.limit.assert_called_once_with(per_page)
 
+        api.get_test_result_records(2, per_page, filters, limit=per_page + 1)
+        ordered_query.offset.assert_called_with(per_page)
+        query_with_offset.limit.assert_called_with(per_page + 1)
+
     @mock.patch.object(api, '_apply_filters_for_query')
     @mock.patch.object(api, 'get_session')
     @mock.patch('refstack.db.sqlalchemy.models.Test')
@@ -499,32 +1013,37 @@ class DBBackendTestCase(base.BaseTestCase):
         mock_apply.assert_called_once_with(query, filters)
         apply_result.count.assert_called_once_with()
 
+    @mock.patch.object(api, '_bakery')
     @mock.patch.object(api, 'get_session',
                        return_value=mock.Mock(name='session'),)
     @mock.patch('refstack.db.sqlalchemy.models.User')
-    def test_user_get(self, mock_model, mock_get_session):
+    def test_user_get(self, mock_model, mock_get_session, mock_bakery):
         user_openid = 'user@example.com'
         session = mock_get_session.return_value
-        query = session.query.return_value
-        filtered = query.filter_by.return_value
-        user = filtered.first.return_value
+        params = mock_bakery.return_value.return_value.params
+        user = params.return_value.first.return_value
 
         result = api.user_get(user_openid)
         self.assertEqual(result, user)
 
+        mock_bakery.return_value.assert_called_once_with(session)
+        params.assert_called_once_with(openid=user_openid)
+        params.return_value.first.assert_called_once_with()
+
+        build_query = mock_bakery.call_args[0][0]
+        build_query(session)
         session.query.assert_called_once_with(mock_model)
-        query.filter_by.assert_called_once_with(openid=user_openid)
-        filtered.first.assert_called_once_with()
+        session.query.return_value.filter_by.assert_called_once_with(
+            openid=mock.ANY)
 
+    @mock.patch.object(api, '_bakery')
     @mock.patch.object(api, 'get_session',
                        return_value=mock.Mock(name='session'),)
     @mock.patch('refstack.db.sqlalchemy.models.User')
-    def test_user_get_none(self, mock_model, mock_get_session):
+    def test_user_get_none(self, mock_model, mock_get_session, mock_bakery):
         user_openid = 'user@example.com'
-        session = mock_get_session.return_value
-        query = session.query.return_value
-        filtered = query.filter_by.return_value
-        filtered.first.return_value = None
+        params = mock_bakery.return_value.return_value.params
+        params.return_value.first.return_value = None
         self.assertRaises(api.NotFound, api.user_get, user_openid)
 
     @mock.patch.object(api, 'get_session')
@@ -544,25 +1063,32 @@ class DBBackendTestCase(base.BaseTestCase):
         user.update.assert_called_once_with(user_info)
         session.begin.assert_called_once_with()
 
+    @mock.patch.object(api, '_bakery')
     @mock.patch.object(api, 'get_session',
                        return_value=mock.Mock(name='session'),)
     @mock.patch('refstack.db.sqlalchemy.models.PubKey')
-    def test_get_pubkey(self, mock_model, mock_get_session):
+    def test_get_pubkey(self, mock_model, mock_get_session, mock_bakery):
         key = 'AAAAB3Nz'
         khash = hashlib.md5(base64.b64decode(key.encode('ascii'))).hexdigest()
         session = mock_get_session.return_value
-        query = session.query.return_value
-        filtered = query.filter_by.return_value
+        params = mock_bakery.return_value.return_value.params
+        filtered = params.return_value
 
         # Test no key match.
         filtered.all.return_value = []
         result = api.get_pubkey(key)
         self.assertIsNone(result)
 
-        session.query.assert_called_once_with(mock_model)
-        query.filter_by.assert_called_once_with(md5_hash=khash)
+        mock_bakery.return_value.assert_called_once_with(session)
+        params.assert_called_once_with(md5_hash=khash)
         filtered.all.assert_called_once_with()
 
+        build_query = mock_bakery.call_args[0][0]
+        build_query(session)
+        session.query.assert_called_once_with(mock_model)
+        session.query.return_value.filter_by.assert_called_once_with(
+            md5_hash=mock.ANY)
+
         # Test only one key match.
         filtered.all.return_value = [{'pubkey': key, 'md5_hash': khash}]
         result = api.get_pubkey(key)
@@ -640,6 +1166,10 @@ class DBBackendTestCase(base.BaseTestCase):
             openid='user_id')
         self.assertEqual(keys, actual_keys)
 
+        db.get_user_pubkeys('user_id', md5_hash='hash')
+        session.query.return_value.filter_by.return_value \
+            .filter_by.assert_called_once_with(md5_hash='hash')
+
     @mock.patch.object(api, 'get_session')
     @mock.patch('refstack.db.sqlalchemy.models.UserToGroup')
     def test_add_user_to_group(self, mock_model, mock_get_session):
@@ -769,23 +1299,67 @@ class DBBackendTestCase(base.BaseTestCase):
         query.filter_by.assert_called_once_with(id=organization_id)
         filtered.first.assert_called_once_with()
 
+    @mock.patch.object(api, 'get_session')
+    def test_get_organization_version(self, mock_get_session):
+        query = mock_get_session.return_value.query.return_value
+        union = query.filter.return_value.union_all.return_value
+        # Rows of the sources come in any order.
+        union.all.return_value = [(1, 2, 'fake-product-created', None),
+                                  (0, 1, 'fake-created', 'fake-updated')]
+
+        self.assertEqual({'updated_at': 'fake-updated',
+                          'version': '1|fake-created|fake-updated|'
+                                     '2|fake-product-created|None'},
+                         api.get_organization_version('org-id'))
+
+        union.all.return_value = [(0, 0, None, None)]
+        self.assertRaises(api.NotFound, api.get_organization_version,
+                          'org-id')
+
+    @mock.patch.object(api, '_bakery')
     @mock.patch.object(api, 'get_session',
                        return_value=mock.Mock(name='session'),)
     @mock.patch('refstack.db.sqlalchemy.models.Product')
     @mock.patch.object(api, '_to_dict', side_effect=lambda x, allowed_keys: x)
-    def test_product_get(self, mock_to_dict, mock_model, mock_get_session):
+    def test_product_get(self, mock_to_dict, mock_model, mock_get_session,
+                         mock_bakery):
         _id = 12345
         session = mock_get_session.return_value
-        query = session.query.return_value
-        filtered = query.filter_by.return_value
-        product = filtered.first.return_value
+        params = mock_bakery.return_value.return_value.params
+        product = params.return_value.first.return_value
 
         result = api.get_product(_id)
         self.assertEqual(result, product)
 
+        mock_bakery.return_value.assert_called_once_with(session)
+        params.assert_called_once_with(id=_id)
+        params.return_value.first.assert_called_once_with()
+
+        build_query = mock_bakery.call_args[0][0]
+        build_query(session)
         session.query.assert_called_once_with(mock_model)
-        query.filter_by.assert_called_once_with(id=_id)
-        filtered.first.assert_called_once_with()
+        session.query.return_value.filter_by.assert_called_once_with(
+            id=mock.ANY)
+
+    @mock.patch.object(api, '_bakery')
+    @mock.patch.object(api, 'get_session')
+    def test_get_foundation_users(self, mock_get_session, mock_bakery):
+        session = mock_get_session.return_value
+        organizations, users = mock.Mock(), mock.Mock()
+        mock_bakery.side_effect = [organizations, users]
+        organizations.return_value.first.return_value = mock.Mock(
+            group_id='foundation_group')
+        users.return_value.params.return_value = [
+            mock.Mock(user_openid='user1'), mock.Mock(user_openid='user2')]
+
+        self.assertEqual(['user1', 'user2'], api.get_foundation_users())
+        organizations.assert_called_once_with(session)
+        users.return_value.params.assert_called_once_with(
+            group_id='foundation_group')
+
+        mock_bakery.side_effect = [organizations]
+        organizations.return_value.first.return_value = None
+        self.assertEqual([], api.get_foundation_users())
 
     @mock.patch.object(api, 'get_session')
     @mock.patch('refstack.db.sqlalchemy.api.models')
@@ -801,6 +1375,49 @@ class DBBackendTestCase(base.BaseTestCase):
             mock.call().delete(synchronize_session=False)))
         session.begin.assert_called_once_with()
 
+    @mock.patch.object(api, 'get_session')
+    @mock.patch('refstack.db.sqlalchemy.api.models')
+    def test_get_foundation_group_id(self, mock_models, mock_get_session):
+        session = mock_get_session.return_value
+        query = session.query.return_value
+        query.filter_by.return_value.first.return_value.group_id = 'foo'
+
+        self.assertEqual('foo', api.get_foundation_group_id())
+        session.query.assert_called_once_with(
+            mock_models.Organization.group_id)
+        query.filter_by.assert_called_once_with(type=api_const.FOUNDATION)
+
+        query.filter_by.return_value.first.return_value = None
+        self.assertIsNone(api.get_foundation_group_id())
+
+    @mock.patch.object(api, 'get_session')
+    @mock.patch('refstack.db.sqlalchemy.api.models')
+    def test_get_organization_group_id(self, mock_models, mock_get_session):
+        session = mock_get_session.return_value
+        query = session.query.return_value
+        query.filter_by.return_value.first.return_value.group_id = 'foo'
+
+        self.assertEqual('foo', api.get_organization_group_id('org-id'))
+        query.filter_by.assert_called_once_with(id='org-id')
+
+        query.filter_by.return_value.first.return_value = None
+        self.assertRaises(api.NotFound, api.get_organization_group_id,
+                          'org-id')
+
+    @mock.patch.object(api, 'get_session')
+    @mock.patch('refstack.db.sqlalchemy.api.models')
+    def test_get_user_group_ids(self, mock_models, mock_get_session):
+        session = mock_get_session.return_value
+        query = session.query.return_value
+        query.filter_by.return_value = [mock.Mock(group_id='foo'),
+                                        mock.Mock(group_id='bar')]
+
+        self.assertEqual(frozenset(['foo', 'bar']),
+                         api.get_user_group_ids('user'))
+        session.query.assert_called_once_with(
+            mock_models.UserToGroup.group_id)
+        query.filter_by.assert_called_once_with(user_openid='user')
+
     @mock.patch.object(api, 'get_session',
                        return_value=mock.Mock(name='session'),)
     @mock.patch('refstack.db.sqlalchemy.api.models')
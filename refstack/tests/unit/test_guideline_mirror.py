@@ -0,0 +1,139 @@
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the local guidelines mirror."""
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+
+import mock
+from oslotest import base
+
+from refstack.api import guideline_mirror
+
+
+def make_tarball(files, prefix='interop-master/'):
+    """Build a tarball with the given files in memory."""
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode='w:gz') as archive:
+        for name, content in files.items():
+            info = tarfile.TarInfo(prefix + name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    return data.getvalue()
+
+
+class GuidelineMirrorTestCase(base.BaseTestCase):
+    """Test case for the guidelines mirror."""
+
+    def setUp(self):
+        super(GuidelineMirrorTestCase, self).setUp()
+        patcher = mock.patch.object(guideline_mirror, '_loaded',
+                                    {'key': None, 'files': None})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.files = {'2017.01.json': b'{"id": "2017.01"}',
+                      'next.json': b'{"id": "next"}',
+                      'add-ons/dns.2018.02.json': b'{"id": "dns"}',
+                      'add-ons/README.rst': b'',
+                      'tools/schema.json': b'{}'}
+
+    def _write_files(self, path):
+        for name, content in self.files.items():
+            file_path = os.path.join(path, *name.split('/'))
+            if not os.path.isdir(os.path.dirname(file_path)):
+                os.makedirs(os.path.dirname(file_path))
+            with open(file_path, 'wb') as f:
+                f.write(content)
+
+    def test_load_directory(self):
+        self._write_files(self.tmp_dir)
+        files = guideline_mirror.load(self.tmp_dir)
+        self.assertEqual({'2017.01.json': {'id': '2017.01'},
+                          'next.json': {'id': 'next'},
+                          'add-ons/dns.2018.02.json': {'id': 'dns'}},
+                         files)
+        self.assertEqual(
+            [{'name': '2017.01.json', 'path': '2017.01.json',
+              'type': 'file'},
+             {'name': 'dns.2018.02.json', 'path': 'add-ons/dns.2018.02.json',
+              'type': 'file'},
+             {'name': 'next.json', 'path': 'next.json', 'type': 'file'}],
+            guideline_mirror.list_files(files))
+
+        # Files are not read again while the mirror is unchanged.
+        with mock.patch.object(guideline_mirror, '_read_directory') as read:
+            self.assertIs(files, guideline_mirror.load(self.tmp_dir))
+            self.assertFalse(read.called)
+
+        os.remove(os.path.join(self.tmp_dir, 'next.json'))
+        os.utime(self.tmp_dir, (1, 1))
+        self.assertNotIn('next.json', guideline_mirror.load(self.tmp_dir))
+
+    def test_load_archive(self):
+        path = os.path.join(self.tmp_dir, 'interop.tar.gz')
+        with open(path, 'wb') as f:
+            f.write(make_tarball(self.files))
+        files = guideline_mirror.load(path)
+        self.assertEqual(['2017.01.json', 'add-ons/dns.2018.02.json',
+                          'next.json'], sorted(files))
+
+        self.assertRaises(EnvironmentError, guideline_mirror.load,
+                          os.path.join(self.tmp_dir, 'missing.tar.gz'))
+
+    @mock.patch('refstack.api.http_client.get')
+    def test_sync_archive(self, mock_get):
+        mock_get.return_value.content = make_tarball(self.files)
+        path = os.path.join(self.tmp_dir, 'interop.tgz')
+
+        self.assertEqual(3, guideline_mirror.sync(path, 'http://fake'))
+        mock_get.assert_called_once_with('http://fake', target='github')
+        self.assertEqual(3, len(guideline_mirror.load(path)))
+        self.assertEqual(['interop.tgz'], os.listdir(self.tmp_dir))
+
+    @mock.patch('refstack.api.http_client.get')
+    def test_sync_directory(self, mock_get):
+        mock_get.return_value.content = make_tarball(self.files)
+        path = os.path.join(self.tmp_dir, 'interop')
+
+        guideline_mirror.sync(path, 'http://fake')
+        self.assertTrue(os.path.islink(path))
+        old_dir = os.path.realpath(path)
+        self.assertEqual(3, len(guideline_mirror.load(path)))
+
+        del self.files['next.json']
+        mock_get.return_value.content = make_tarball(self.files)
+        self.assertEqual(2, guideline_mirror.sync(path, 'http://fake'))
+        self.assertNotIn('next.json', guideline_mirror.load(path))
+        # The previous download is removed.
+        self.assertFalse(os.path.exists(old_dir))
+        self.assertEqual(2, len(os.listdir(self.tmp_dir)))
+
+    @mock.patch('refstack.api.http_client.get')
+    def test_sync_errors(self, mock_get):
+        mock_get.return_value.content = make_tarball({'README.rst': b''})
+        self.assertRaises(ValueError, guideline_mirror.sync,
+                          os.path.join(self.tmp_dir, 'interop'),
+                          'http://fake')
+
+        # Directories not created by sync are not replaced.
+        mock_get.return_value.content = make_tarball(self.files)
+        self.assertRaises(ValueError, guideline_mirror.sync,
+                          self.tmp_dir, 'http://fake')
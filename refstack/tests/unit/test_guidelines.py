@@ -14,19 +14,31 @@
 #    under the License.
 
 import json
+import threading
 
 import httmock
 import mock
+from oslo_config import fixture as config_fixture
 from oslotest import base
 import requests
 
 from refstack.api import guidelines
+from refstack.api import http_client
 
 
 class GuidelinesTestCase(base.BaseTestCase):
 
     def setUp(self):
         super(GuidelinesTestCase, self).setUp()
+        # Don't serve responses or guidelines of other tests.
+        http_client._client = None
+        for patcher in (mock.patch.object(guidelines, '_snapshot',
+                                          {'key': None, 'list': None,
+                                           'skipped_sources': [],
+                                           'contents': {}, 'digests': {}}),
+                        mock.patch.dict(guidelines._refresh_metrics)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
         self.guidelines = guidelines.Guidelines()
 
     def test_guidelines_list(self):
@@ -84,13 +96,211 @@ class GuidelinesTestCase(base.BaseTestCase):
             result = self.guidelines.get_guideline_list()
         self.assertEqual(result, {'powered': []})
 
-    @mock.patch('requests.get')
+    @mock.patch('refstack.api.http_client.get')
     def test_get_guidelines_exception(self, mock_requests_get):
         """Test when the GET request raises an exception."""
         mock_requests_get.side_effect = requests.exceptions.RequestException()
         result = self.guidelines.get_guideline_list()
         self.assertEqual(result, {'powered': []})
 
+    @mock.patch('refstack.api.http_client.get')
+    def test_get_guidelines_sources(self, mock_get):
+        """Test merging the listings of several guideline sources."""
+        listings = {
+            'addons': [{'name': 'dns.2018.02.json',
+                        'path': 'add-ons/dns.2018.02.json',
+                        'type': 'file'}],
+            'other': [{'name': 'dns.2018.02.json',
+                       'path': 'other/add-ons/dns.2018.02.json',
+                       'type': 'file'},
+                      {'name': '2017.01.json',
+                       'path': 'other/2017.01.json',
+                       'type': 'file'}],
+            'repo': [{'name': '2017.01.json',
+                      'path': '2017.01.json',
+                      'type': 'file'}],
+            'slow': [{'name': '2018.02.json',
+                      'path': '2018.02.json',
+                      'type': 'file'}]}
+        blocked = threading.Event()
+        self.addCleanup(blocked.set)
+
+        def get(url, target):
+            if url == 'slow':
+                blocked.wait(10)
+            return mock.Mock(status_code=200,
+                             json=mock.Mock(return_value=listings[url]))
+
+        mock_get.side_effect = get
+        self.useFixture(config_fixture.Config()).conf.set_override(
+            'guideline_sources_timeout', 1, 'api')
+        guidelines_obj = guidelines.Guidelines(
+            repo_url='repo', additional_capability_urls='addons,other,slow')
+
+        result = guidelines_obj.get_guideline_list()
+
+        # Files of earlier sources win, and the slow source is left out.
+        self.assertEqual(
+            {'dns': [{'name': '2018.02.json', 'file': 'dns.2018.02.json'}],
+             'powered': [{'name': '2017.01.json',
+                          'file': 'other/2017.01.json'}]},
+            result)
+        self.assertEqual(['slow'], guidelines_obj.skipped_sources)
+        self.assertEqual(4, mock_get.call_count)
+
+    @mock.patch('refstack.api.http_client.get')
+    @mock.patch('refstack.api.guideline_mirror.load')
+    def test_guidelines_mirror(self, mock_load, mock_get):
+        """Test reading guidelines from a local mirror."""
+        mock_load.return_value = {'2017.01.json': {'id': '2017.01'},
+                                  'add-ons/dns.2018.02.json': {'id': 'dns'}}
+        guidelines_obj = guidelines.Guidelines(mirror_path='/mirror')
+
+        self.assertEqual(
+            {'dns': [{'name': '2018.02.json', 'file': 'dns.2018.02.json'}],
+             'powered': [{'name': '2017.01.json', 'file': '2017.01.json'}]},
+            guidelines_obj.get_guideline_list())
+        self.assertEqual({'id': 'dns'},
+                         guidelines_obj.get_guideline_contents('dns.2018.02'))
+        self.assertIsNone(guidelines_obj.get_guideline_contents('2010.03'))
+        mock_load.assert_called_with('/mirror')
+        self.assertFalse(mock_get.called)
+
+        # GitHub is used if the mirror can't be read.
+        mock_load.side_effect = IOError()
+        mock_get.return_value = mock.Mock(
+            status_code=200, json=mock.Mock(return_value={'id': '2017.01'}))
+        self.assertEqual({'id': '2017.01'},
+                         guidelines_obj.get_guideline_contents('2017.01'))
+        self.assertTrue(mock_get.called)
+
+    @mock.patch.object(guidelines.Guidelines, '_fetch_guideline_contents')
+    @mock.patch.object(guidelines.Guidelines, '_fetch_guideline_list')
+    def test_refresh_guidelines(self, mock_list, mock_contents):
+        """Test serving guidelines of background refreshes."""
+        guideline_list = {
+            'dns': [{'name': '2018.02.json', 'file': 'dns.2018.02.json'}],
+            'powered': [{'name': '2017.01.json', 'file': '2017.01.json'}]}
+        mock_list.return_value = guideline_list
+        contents = {'add-ons/dns.2018.02.json': {'id': 'dns'},
+                    '2017.01.json': {'id': '2017.01'}}
+        mock_contents.side_effect = contents.get
+
+        self.assertEqual(2, guidelines.refresh_guidelines())
+        mock_list.reset_mock()
+        mock_contents.reset_mock()
+
+        self.assertEqual(guideline_list, self.guidelines.get_guideline_list())
+        self.assertEqual({'id': 'dns'},
+                         self.guidelines.get_guideline_contents('dns.2018.02'))
+        self.assertFalse(mock_list.called)
+        self.assertFalse(mock_contents.called)
+        # Digests of refreshed guidelines are not computed again.
+        dns_json = self.guidelines.get_guideline_contents('dns.2018.02')
+        digest = guidelines.get_digest(dns_json)
+        with mock.patch.object(guidelines, 'get_digest') as mock_digest:
+            self.assertEqual(digest, self.guidelines.get_guideline_digest(
+                'dns.2018.02.json', dns_json))
+            self.assertFalse(mock_digest.called)
+        # Guidelines which are not refreshed are fetched.
+        self.guidelines.get_guideline_contents('2010.03.json')
+        mock_contents.assert_called_once_with('2010.03.json')
+        # Instances using other sources are not served refreshed guidelines.
+        guidelines.Guidelines(raw_url='http://other').get_guideline_list()
+        self.assertTrue(mock_list.called)
+
+        # Files which fail to be fetched keep their previous contents.
+        del contents['2017.01.json']
+        contents['add-ons/dns.2018.02.json'] = {'id': 'new'}
+        self.assertEqual(2, guidelines.refresh_guidelines())
+        self.assertEqual({'id': '2017.01'},
+                         self.guidelines.get_guideline_contents('2017.01'))
+        self.assertEqual({'id': 'new'},
+                         self.guidelines.get_guideline_contents('dns.2018.02'))
+
+        # Failed refreshes keep the previous guidelines.
+        mock_list.return_value = {'powered': []}
+        self.assertRaises(ValueError, guidelines.refresh_guidelines)
+        self.assertEqual(guideline_list, self.guidelines.get_guideline_list())
+
+        metrics = guidelines.get_refresh_metrics()
+        self.assertEqual(2, metrics['refreshes'])
+        self.assertEqual(1, metrics['failures'])
+        self.assertEqual(1, metrics['consecutive_failures'])
+        self.assertEqual(2, metrics['guideline_count'])
+        self.assertEqual(1, metrics['stale_count'])
+        self.assertIsNotNone(metrics['last_error'])
+        self.assertTrue(metrics['lag_seconds'] >= 0)
+
+    @mock.patch('requests.adapters.HTTPAdapter.send')
+    def test_refresh_guidelines_requests(self, mock_send):
+        """Test that every refresh fetches the guidelines again."""
+        def send(request, **kwargs):
+            if request.url.endswith('.json'):
+                content = {'id': '2017.01'}
+            else:
+                content = [{'name': '2017.01.json', 'path': '2017.01.json',
+                            'type': 'file'}]
+            response = requests.Response()
+            response.status_code = 200
+            response.headers['Content-Type'] = 'application/json'
+            response._content = json.dumps(content).encode('utf-8')
+            response.url = request.url
+            response.request = request
+            return response
+
+        mock_send.side_effect = send
+        self.guidelines.get_guideline_list()
+        self.guidelines.get_guideline_contents('2017.01')
+        fetched = mock_send.call_count
+        self.assertEqual(1, guidelines.refresh_guidelines())
+        self.assertEqual(2 * fetched, mock_send.call_count)
+        self.assertEqual(1, guidelines.refresh_guidelines())
+        self.assertEqual(3 * fetched, mock_send.call_count)
+
+    @mock.patch('refstack.api.guideline_mirror.load')
+    def test_refresh_guidelines_mirror(self, mock_load):
+        """Test that changes of mirrors show up before the next refresh."""
+        self.useFixture(config_fixture.Config()).config(
+            guidelines_mirror_path='/mirror', group='api')
+        mock_load.return_value = {'2017.01.json': {'id': '2017.01'}}
+        self.assertEqual(1, guidelines.refresh_guidelines())
+        guideline_list = {
+            'powered': [{'name': '2017.01.json', 'file': '2017.01.json'}]}
+
+        mock_load.return_value = {'2017.01.json': {'id': 'changed'},
+                                  '2018.02.json': {'id': '2018.02'}}
+        guidelines_obj = guidelines.Guidelines()
+        self.assertEqual(
+            {'powered': [{'name': '2017.01.json', 'file': '2017.01.json'},
+                         {'name': '2018.02.json', 'file': '2018.02.json'}]},
+            guidelines_obj.get_guideline_list())
+        self.assertEqual({'id': 'changed'},
+                         guidelines_obj.get_guideline_contents('2017.01'))
+
+        # Refreshed guidelines are served if the mirror can't be read.
+        mock_load.side_effect = IOError()
+        self.assertEqual(guideline_list, guidelines_obj.get_guideline_list())
+        self.assertEqual({'id': '2017.01'},
+                         guidelines_obj.get_guideline_contents('2017.01'))
+
+    @mock.patch.object(guidelines.Guidelines, '_fetch_guideline_contents')
+    @mock.patch.object(guidelines.Guidelines, '_list_sources')
+    def test_refresh_guidelines_skipped_sources(self, mock_list,
+                                                mock_contents):
+        """Test serving sources left out of a refresh."""
+        mock_list.return_value = ([[{'name': '2017.01.json',
+                                     'path': '2017.01.json',
+                                     'type': 'file'}]], ['slow'])
+        mock_contents.return_value = {'id': '2017.01'}
+        self.assertEqual(1, guidelines.refresh_guidelines())
+
+        guidelines_obj = guidelines.Guidelines()
+        self.assertEqual(
+            {'powered': [{'name': '2017.01.json', 'file': '2017.01.json'}]},
+            guidelines_obj.get_guideline_list())
+        self.assertEqual(['slow'], guidelines_obj.skipped_sources)
+
     def test_get_capability_file(self):
         """Test when getting a specific guideline file."""
         @httmock.all_requests
@@ -114,7 +324,7 @@ class GuidelinesTestCase(base.BaseTestCase):
             result = self.guidelines.get_guideline_contents('2010.03.json')
         self.assertIsNone(result)
 
-    @mock.patch('requests.get')
+    @mock.patch('refstack.api.http_client.get')
     def test_get_capability_file_exception(self, mock_requests_get):
         """Test when the GET request raises an exception."""
         mock_requests_get.side_effect = requests.exceptions.RequestException()
@@ -294,3 +504,77 @@ class GuidelinesTestCase(base.BaseTestCase):
         }
         tests = self.guidelines.get_test_list(json, ['cap-2'])
         self.assertEqual(['test_3'], tests)
+
+    @mock.patch.object(guidelines, '_slices', guidelines.cache.TTLCache())
+    def test_get_guideline_slice(self):
+        """Test slicing a guideline by target, statuses and fields."""
+        json = {
+            'platform': {'required': ['compute', 'object']},
+            'schema': '1.4',
+            'components': {
+                'compute': {'required': ['cap-1'], 'advisory': ['cap-2']},
+                'object': {'required': ['cap-3']}
+            },
+            'capabilities': {'cap-1': {'tests': {'test_1': {}}},
+                             'cap-2': {'tests': {'test_2': {}}},
+                             'cap-3': {'tests': {'test_3': {}}}}
+        }
+
+        guideline_slice = self.guidelines.get_guideline_slice(
+            json, 'digest', target='compute', types=['required'])
+        self.assertEqual({'cap-1': {'tests': {'test_1': {}}}},
+                         guideline_slice['capabilities'])
+        self.assertEqual(json['components'], guideline_slice['components'])
+        # The guideline itself is left unchanged.
+        self.assertEqual(3, len(json['capabilities']))
+
+        guideline_slice = self.guidelines.get_guideline_slice(
+            json, 'digest', types=['required'], fields=['capabilities'])
+        self.assertEqual(['capabilities'], list(guideline_slice))
+        self.assertEqual(['cap-1', 'cap-3'],
+                         sorted(guideline_slice['capabilities']))
+
+        # Slices are cached under the digest and the parameters.
+        with mock.patch.object(self.guidelines,
+                               'get_target_capabilities') as mock_caps:
+            self.assertIs(guideline_slice,
+                          self.guidelines.get_guideline_slice(
+                              json, 'digest', types=['required'],
+                              fields=['capabilities']))
+            self.assertFalse(mock_caps.called)
+
+        self.assertRaises(KeyError, self.guidelines.get_guideline_slice,
+                          json, 'digest', target='foo')
+
+    @mock.patch.object(guidelines, '_test_sets', guidelines.cache.TTLCache())
+    def test_get_target_test_set(self):
+        """Test getting the cached test set of a guideline target."""
+        json = {
+            'platform': {'required': ['compute']},
+            'schema': '1.4',
+            'components': {'compute': {'required': ['cap-1']}},
+            'capabilities': {
+                'cap-1': {'tests': {
+                    'test_1': {'idempotent_id': 'id-1',
+                               'aliases': ['test_1_1']},
+                    'test_2': {'idempotent_id': 'id-2',
+                               'flagged': {'reason': 'foo'}}}}}
+        }
+
+        test_set = self.guidelines.get_target_test_set(json, 'digest')
+        self.assertEqual(frozenset(['test_1[id-1]', 'test_1_1[id-1]',
+                                    'test_2[id-2]']), test_set)
+        test_set = self.guidelines.get_target_test_set(
+            json, 'digest', types=['required'], alias=False,
+            show_flagged=False)
+        self.assertEqual(frozenset(['test_1[id-1]']), test_set)
+
+        with mock.patch.object(self.guidelines,
+                               'get_test_list') as mock_test_list:
+            self.assertIs(test_set, self.guidelines.get_target_test_set(
+                json, 'digest', types=['required'], alias=False,
+                show_flagged=False))
+            self.assertFalse(mock_test_list.called)
+
+        self.assertRaises(KeyError, self.guidelines.get_target_test_set,
+                          json, 'digest', target='foo')
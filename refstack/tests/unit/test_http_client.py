@@ -0,0 +1,210 @@
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the outbound HTTP client."""
+
+import threading
+import time
+
+import mock
+from oslotest import base
+import requests
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+from refstack.api import http_client
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Replies with the responses queued on the server."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        status, headers, body, delay = (self.server.responses.pop(0)
+                                        if self.server.responses
+                                        else (200, {}, b'ok', 0))
+        if delay:
+            time.sleep(delay)
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Stub server handling every connection in its own thread."""
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients time out on purpose.
+        pass
+
+
+class HTTPClientTestCase(base.BaseTestCase):
+    """Test case for HTTPClient against a local stub HTTP server."""
+
+    def setUp(self):
+        super(HTTPClientTestCase, self).setUp()
+        self.server = StubServer(('127.0.0.1', 0), StubHandler)
+        self.server.responses = []
+        self.server.paths = []
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:%s' % self.server.server_port
+
+        self.now = 1000.0
+        self.sleep = mock.Mock()
+        self.client = http_client.HTTPClient(
+            pool_size=2, timeouts={'github': '0.5'}, retries=2,
+            failure_threshold=2, reset_timeout=60,
+            timer=lambda: self.now, sleep=self.sleep)
+
+    def _reply(self, status=200, headers=None, body=b'ok', delay=0):
+        self.server.responses.append((status, headers or {}, body, delay))
+
+    def test_get(self):
+        self._reply(body=b'[1]')
+        response = self.client.get(self.url + '/a', 'github')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([1], response.json())
+        self.assertEqual(['/a'], self.server.paths)
+
+    def test_timeout(self):
+        with mock.patch.object(self.client.session, 'request') as request:
+            request.return_value = mock.Mock(status_code=200, headers={})
+            self.client.get(self.url, 'github')
+            self.client.get(self.url, 'other')
+            self.client.get(self.url, 'github', timeout=3)
+        self.assertEqual([0.5, http_client._DEFAULT_TIMEOUT, 3],
+                         [c[1]['timeout'] for c in request.call_args_list])
+
+        self._reply(delay=1)
+        self._reply(delay=1)
+        self._reply(delay=1)
+        self.assertRaises(requests.exceptions.Timeout,
+                          self.client.get, self.url + '/slow', 'github')
+
+    def test_retry(self):
+        self._reply(503)
+        self._reply(502)
+        response = self.client.get(self.url, 'github')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3, len(self.server.paths))
+        self.assertEqual(2, self.sleep.call_count)
+        # The delays are random, but within exponentially growing bounds.
+        delays = [c[0][0] for c in self.sleep.call_args_list]
+        self.assertTrue(0 <= delays[0] <= http_client._RETRY_BACKOFF)
+        self.assertTrue(0 <= delays[1] <= 2 * http_client._RETRY_BACKOFF)
+
+        # POST requests are not retried.
+        self._reply(503)
+        response = self.client.post(self.url, 'github')
+        self.assertEqual(503, response.status_code)
+        self.assertEqual(4, len(self.server.paths))
+
+    def test_circuit_breaker(self):
+        self._reply(body=b'cached')
+        self.client.get(self.url + '/a', 'github')
+        for _ in range(6):
+            self._reply(500)
+        self.assertEqual(500, self.client.get(self.url + '/b',
+                                              'github').status_code)
+        # The last successful response is served when requests fail.
+        self.assertEqual(b'cached', self.client.get(self.url + '/a',
+                                                    'github').content)
+        self.assertEqual(7, len(self.server.paths))
+
+        # The circuit is open, so requests fail fast.
+        self.assertEqual(b'cached', self.client.get(self.url + '/a',
+                                                    'github').content)
+        self.assertRaises(http_client.CircuitOpenError,
+                          self.client.get, self.url + '/b', 'github')
+        self.assertEqual(7, len(self.server.paths))
+        # Other targets are not affected.
+        self.client.get(self.url + '/b', 'openid')
+        self.assertEqual(8, len(self.server.paths))
+
+        # A trial request closes the circuit again.
+        self.now += 60
+        self.assertEqual(b'ok', self.client.get(self.url + '/b',
+                                                'github').content)
+        self.assertEqual('closed',
+                         self.client.get_metrics()['github']['circuit'])
+
+    def test_rate_limit(self):
+        reset = str(int(self.now) + 30)
+        self._reply(body=b'cached', headers={'X-RateLimit-Remaining': '1',
+                                             'X-RateLimit-Reset': reset})
+        self.client.get(self.url + '/a', 'github')
+        self._reply(headers={'X-RateLimit-Remaining': '0',
+                             'X-RateLimit-Reset': reset})
+        self.assertEqual(200, self.client.get(self.url + '/b',
+                                              'github').status_code)
+        self.assertEqual(0, self.client.get_metrics()['github'][
+            'rate_limit_remaining'])
+
+        # Requests are suspended until the rate limit is reset.
+        self.assertEqual(b'cached', self.client.get(self.url + '/a',
+                                                    'github').content)
+        self.assertRaises(http_client.CircuitOpenError,
+                          self.client.get, self.url + '/c', 'github')
+        self.assertEqual(2, len(self.server.paths))
+
+        self.now += 30
+        self._reply(403, headers={'X-RateLimit-Remaining': '0',
+                                  'X-RateLimit-Reset': str(int(self.now))})
+        self.assertEqual(b'cached', self.client.get(self.url + '/a',
+                                                    'github').content)
+        self._reply(403, headers={'X-RateLimit-Remaining': '0',
+                                  'X-RateLimit-Reset': str(int(self.now))})
+        self.assertEqual(403, self.client.get(self.url + '/c',
+                                              'github').status_code)
+
+    def test_metrics(self):
+        self._reply(500)
+        self._reply()
+        self.client.get(self.url, 'github')
+        self.assertRaises(requests.exceptions.ConnectionError,
+                          self.client.get, 'http://127.0.0.1:1', 'openid')
+
+        metrics = self.client.get_metrics()
+        self.assertEqual(2, metrics['github']['requests'])
+        self.assertEqual(1, metrics['github']['retries'])
+        self.assertEqual(0, metrics['github']['errors'])
+        self.assertEqual('closed', metrics['github']['circuit'])
+        self.assertEqual(3, metrics['openid']['requests'])
+        self.assertEqual(1, metrics['openid']['errors'])
+        self.assertIn('avg_seconds', metrics['openid'])
+        self.assertIn('max_seconds', metrics['openid'])
+
+    @mock.patch.object(http_client, '_client', None)
+    def test_get_client(self):
+        client = http_client.get_client()
+        self.assertIs(client, http_client.get_client())
+        self.assertEqual({'github': 10.0, 'openid': 10.0}, client.timeouts)
@@ -0,0 +1,109 @@
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the anonymous list page cache."""
+
+import datetime
+import os
+import shutil
+import tempfile
+
+import mock
+from oslo_config import fixture as config_fixture
+from oslotest import base
+
+from refstack.api import response_cache
+from refstack import cache
+
+
+class ResponseCacheTestCase(base.BaseTestCase):
+    """Test case for ResponseCache with both backends."""
+
+    def setUp(self):
+        super(ResponseCacheTestCase, self).setUp()
+        self.now = 1000.0
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.build = mock.Mock(side_effect=lambda page: {'page': page})
+
+    def _test_cache(self, page_cache, other_cache):
+        page = page_cache.get_or_set('results', {'page': '1', 'cpid': ''},
+                                     self.build, 1)
+        self.assertEqual({'page': 1}, page)
+        # Parameters are normalized.
+        self.assertEqual(page, page_cache.get_or_set(
+            'results', {'page': '1'}, self.build, 2))
+        self.assertEqual({'page': 2}, page_cache.get_or_set(
+            'results', {'page': '2'}, self.build, 2))
+        self.assertEqual({'page': 3}, page_cache.get_or_set(
+            'products', {'page': '1'}, self.build, 3))
+        self.assertEqual(3, self.build.call_count)
+
+        other_cache.invalidate('results')
+        self.assertEqual({'page': 4}, page_cache.get_or_set(
+            'results', {'page': '1'}, self.build, 4))
+        self.assertEqual({'page': 3}, page_cache.get_or_set(
+            'products', {'page': '1'}, self.build, 5))
+
+        self.now += 30
+        self.assertEqual({'page': 6}, page_cache.get_or_set(
+            'products', {'page': '1'}, self.build, 6))
+
+        self.assertEqual({'results': {'hits': 1, 'misses': 3,
+                                      'hit_ratio': 0.25},
+                          'products': {'hits': 1, 'misses': 2,
+                                       'hit_ratio': 1.0 / 3}},
+                         page_cache.get_metrics())
+
+    def test_memory_backend(self):
+        backend = cache.TTLCache(timer=lambda: self.now)
+        page_cache = response_cache.ResponseCache(backend, 30)
+        self._test_cache(page_cache, page_cache)
+
+    def test_file_backend(self):
+        # Processes sharing the directory share pages and invalidations.
+        page_cache, other_cache = [
+            response_cache.ResponseCache(response_cache.FileBackend(
+                self.tmp_dir, timer=lambda: self.now), 30)
+            for _ in range(2)]
+        self._test_cache(page_cache, other_cache)
+
+        # Dates are cached as rendered in responses.
+        date = datetime.datetime(2018, 1, 2, 3, 4, 5)
+        other_cache.get_or_set('vendors', {}, lambda: {'created_at': date})
+        self.assertEqual({'created_at': '2018-01-02 03:04:05'},
+                         page_cache.get_or_set('vendors', {}, self.build))
+
+        page_cache.backend.prune()
+        # Only the generations and the pages not expired yet are left.
+        self.assertEqual(5, len(os.listdir(self.tmp_dir)))
+
+    @mock.patch.object(response_cache, '_cache', None)
+    def test_get_cache(self):
+        conf = self.useFixture(config_fixture.Config()).conf
+        self.assertIsInstance(response_cache.get_cache().backend,
+                              cache.TTLCache)
+
+        with mock.patch.object(response_cache, '_cache', None):
+            conf.set_override('response_cache_backend', 'file', 'api')
+            conf.set_override('response_cache_path', self.tmp_dir, 'api')
+            self.assertEqual(self.tmp_dir,
+                             response_cache.get_cache().backend.path)
+
+        conf.set_override('response_cache_ttl', 0, 'api')
+        self.assertIsNone(response_cache.get_cache())
+        self.assertEqual({}, response_cache.get_metrics())
+        # Invalidating a disabled cache does nothing.
+        response_cache.invalidate(response_cache.RESULTS)
@@ -0,0 +1,99 @@
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for cookie sessions."""
+
+from cryptography import fernet
+from oslotest import base
+import webob
+
+from refstack.api import session
+
+
+class CookieSessionMiddlewareTestCase(base.BaseTestCase):
+    """Test case for CookieSessionMiddleware."""
+
+    def setUp(self):
+        super(CookieSessionMiddlewareTestCase, self).setUp()
+        self.key = fernet.Fernet.generate_key()
+        self.sessions = []
+        self.middleware = session.CookieSessionMiddleware(
+            self.app, [self.key], timeout=3600)
+
+    def app(self, environ, start_response):
+        user_session = environ[session.SESSION_ENV]
+        self.sessions.append(dict(user_session))
+        request = webob.Request(environ)
+        if request.path == '/login':
+            user_session['user_openid'] = 'openid'
+            user_session.save()
+        elif request.path == '/logout':
+            del user_session['user_openid']
+            user_session.save()
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+
+    def _request(self, path, cookie=None, middleware=None):
+        request = webob.Request.blank(path)
+        if cookie:
+            request.headers['Cookie'] = cookie
+        return request.get_response(middleware or self.middleware)
+
+    def _session_cookie(self, response):
+        return response.headers['Set-Cookie'].split(';')[0]
+
+    def test_session_round_trip(self):
+        response = self._request('/login')
+        self.assertEqual({}, self.sessions[-1])
+        set_cookie = response.headers['Set-Cookie']
+        self.assertIn('HttpOnly', set_cookie)
+        self.assertIn('Max-Age=3600', set_cookie)
+        self.assertNotIn('openid', set_cookie)
+
+        cookie = self._session_cookie(response)
+        response = self._request('/', cookie)
+        self.assertEqual({'user_openid': 'openid'}, self.sessions[-1])
+        # Unchanged sessions are not sent again.
+        self.assertNotIn('Set-Cookie', response.headers)
+
+        response = self._request('/logout', cookie)
+        self.assertIn('Max-Age=0', response.headers['Set-Cookie'])
+
+    def test_key_rotation(self):
+        cookie = self._session_cookie(self._request('/login'))
+
+        new_key = fernet.Fernet.generate_key()
+        rotated = session.CookieSessionMiddleware(
+            self.app, [new_key, self.key], timeout=3600)
+        self._request('/', cookie, rotated)
+        self.assertEqual({'user_openid': 'openid'}, self.sessions[-1])
+
+        # Sessions are lost once the old key is removed.
+        replaced = session.CookieSessionMiddleware(
+            self.app, [new_key], timeout=3600)
+        self._request('/', cookie, replaced)
+        self.assertEqual({}, self.sessions[-1])
+
+    def test_invalid_cookie(self):
+        self._request('/', 'refstack=invalid')
+        self.assertEqual({}, self.sessions[-1])
+        token = fernet.Fernet(self.key).encrypt(b'[1, 2]').decode('ascii')
+        self._request('/', 'refstack=%s' % token)
+        self.assertEqual({}, self.sessions[-1])
+
+    def test_secure_cookie(self):
+        self.middleware.secure = True
+        response = self._request('/login')
+        self.assertIn('secure', response.headers['Set-Cookie'].lower())
@@ -86,6 +86,9 @@ class TestResultValidatorTestCase(base.BaseTestCase):
     def setUp(self):
         super(TestResultValidatorTestCase, self).setUp()
         self.validator = validators.TestResultValidator()
+        patcher = mock.patch('refstack.db.get_pubkey', return_value=None)
+        self.mock_get_pubkey = patcher.start()
+        self.addCleanup(patcher.stop)
 
     def test_assert_id(self):
         value = self.validator.assert_id('12345678123456781234567812345678')
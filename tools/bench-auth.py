@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark of JWT token authentication.
+
+A token signed with the last of several public keys of a user is
+decoded repeatedly without caches, with the signing key selected by its
+key id, with cached parsed public keys only, and with cached verified
+tokens. No database is needed.
+"""
+
+from __future__ import print_function
+
+import argparse
+import base64
+import hashlib
+import time
+import timeit
+
+from cryptography.hazmat import backends
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives import serialization
+import jwt
+
+from refstack.api import app  # noqa
+from refstack.api import cache
+from refstack.api import constants as const
+from refstack.api import utils as api_utils
+from refstack import db
+
+
+class FakeRequest(object):
+    def __init__(self, token):
+        self.headers = {const.JWT_TOKEN_HEADER: 'Bearer %s' % token}
+
+
+def generate_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048,
+                                    backend=backends.default_backend())
+
+
+def to_pubkey(key_id, private_key):
+    pubkey_format, pubkey = private_key.public_key().public_bytes(
+        serialization.Encoding.OpenSSH,
+        serialization.PublicFormat.OpenSSH).decode('utf-8').split(' ')
+    return {'id': key_id, 'format': pubkey_format, 'pubkey': pubkey}
+
+
+def main():
+    parser = argparse.ArgumentParser('Benchmark JWT token authentication')
+    parser.add_argument('--keys', type=int, default=3,
+                        help='number of public keys of the user')
+    parser.add_argument('--requests', type=int, default=500,
+                        help='number of authenticated requests')
+    args = parser.parse_args()
+
+    private_keys = [generate_key() for _ in range(args.keys)]
+    pubkeys = [to_pubkey('key%d' % i, key)
+               for i, key in enumerate(private_keys)]
+
+    def get_user_pubkeys(openid, md5_hash=None):
+        return [pubkey for pubkey in pubkeys if md5_hash in (
+            None, hashlib.md5(base64.b64decode(pubkey['pubkey'])).hexdigest())]
+    db.get_user_pubkeys = get_user_pubkeys
+
+    pem_key = private_keys[-1].private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption())
+    token = jwt.encode({const.USER_OPENID: 'openid',
+                        'exp': int(time.time()) + 3600},
+                       key=pem_key, algorithm='RS256')
+    if isinstance(token, bytes):
+        token = token.decode('utf-8')
+    request = FakeRequest(token)
+    kid_request = FakeRequest(token)
+    kid_request.headers[const.JWT_KEY_ID_HEADER] = \
+        api_utils.get_pubkey_fingerprint(pubkeys[-1]['pubkey'])
+
+    def uncached():
+        cache.verified_tokens.clear()
+        cache.pem_pubkeys.clear()
+        return api_utils.decode_token(request)
+
+    def uncached_key_id():
+        cache.verified_tokens.clear()
+        cache.pem_pubkeys.clear()
+        return api_utils.decode_token(kid_request)
+
+    def cached_pubkeys():
+        cache.verified_tokens.clear()
+        return api_utils.decode_token(request)
+
+    def cached_tokens():
+        return api_utils.decode_token(request)
+
+    print('%d requests, %d public keys' % (args.requests, args.keys))
+    for name, func in (('no caches:       ', uncached),
+                       ('key id:          ', uncached_key_id),
+                       ('cached keys:     ', cached_pubkeys),
+                       ('cached tokens:   ', cached_tokens)):
+        func()
+        seconds = timeit.timeit(func, number=args.requests)
+        print('%s %.3fs (%.1fus per request)' % (
+            name, seconds, seconds * 1e6 / args.requests))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark of set-based and bitset-based compliance evaluation.
+
+Synthetic test runs are evaluated against a synthetic guideline target
+both with Python sets of test names and with the vectorized bitset path
+used by RefStack. No database is needed.
+"""
+
+from __future__ import print_function
+
+import argparse
+import random
+import timeit
+
+from refstack.api import compliance
+from refstack.db.sqlalchemy import api as db_api
+
+
+def generate(args):
+    rnd = random.Random(args.seed)
+    names = ['tempest.api.fake.test_%d' % i for i in range(args.names)]
+    name_bits = dict((name, bit) for bit, name in enumerate(names, 1))
+    required = rnd.sample(names, args.tests + args.aliases)
+    tests = [{name} for name in required[:args.tests]]
+    for i, name in enumerate(required[args.tests:]):
+        tests[i].add(name)
+    runs = [set(rnd.sample(names, args.passed)) | set(
+        rnd.sample(required, rnd.randint(0, len(required))))
+        for _ in range(args.runs)]
+    return name_bits, tests, runs
+
+
+def evaluate_sets(tests, runs):
+    return [sum(1 for test in tests if test.isdisjoint(run))
+            for run in runs]
+
+
+def evaluate_bitsets(compiled, bitsets):
+    matrix = compliance.to_bitset_matrix(bitsets)
+    return compiled.count_missing(matrix).tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        'Benchmark set-based and bitset-based compliance evaluation')
+    parser.add_argument('--runs', type=int, default=5000,
+                        help='number of test runs')
+    parser.add_argument('--names', type=int, default=20000,
+                        help='number of registered test names')
+    parser.add_argument('--passed', type=int, default=1500,
+                        help='number of random passed tests in a run')
+    parser.add_argument('--tests', type=int, default=300,
+                        help='number of required tests in the target')
+    parser.add_argument('--aliases', type=int, default=30,
+                        help='number of required tests with an alias')
+    parser.add_argument('--targets', type=int, default=10,
+                        help='number of evaluated targets')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    name_bits, tests, runs = generate(args)
+    bitsets = [db_api._encode_bitset(name_bits[name] for name in run)
+               for run in runs]
+    compiled = compliance.CompiledTarget(tests, name_bits)
+
+    if evaluate_sets(tests, runs) != evaluate_bitsets(compiled, bitsets):
+        raise SystemExit('Set-based and bitset-based results differ')
+
+    matrix = compliance.to_bitset_matrix(bitsets)
+    set_time = timeit.timeit(
+        lambda: evaluate_sets(tests, runs), number=args.targets)
+    matrix_time = timeit.timeit(
+        lambda: compliance.to_bitset_matrix(bitsets), number=1)
+    bitset_time = timeit.timeit(
+        lambda: compiled.count_missing(matrix), number=args.targets)
+
+    print('%d runs, %d targets of %d tests' % (args.runs, args.targets,
+                                               args.tests))
+    print('set-based:    %.3fs' % set_time)
+    print('bitset-based: %.3fs (+%.3fs to load the bitset matrix once)' % (
+        bitset_time, matrix_time))
+    print('speedup:      %.1fx' % (set_time / (bitset_time + matrix_time)))
+
+
+if __name__ == '__main__':
+    main()
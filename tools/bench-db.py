@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark of hot lookups of the DB API.
+
+A temporary SQLite database is filled with a few rows, then every lookup
+is run repeatedly with queries built and compiled on every call, as they
+used to be, and with the baked queries of the DB API, which are only
+executed. Results are converted just like in the DB API. SQLite answers
+these lookups quickly, so most of the time measured is spent in
+SQLAlchemy.
+"""
+
+from __future__ import print_function
+
+import argparse
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+import timeit
+
+from oslo_config import cfg
+import sqlalchemy
+
+from refstack.api import app  # noqa
+from refstack.api import constants as const
+from refstack.db.sqlalchemy import api
+from refstack.db.sqlalchemy import models
+
+
+def get_test_result(test_id):
+    session = api.get_session()
+    test_info = session.query(models.Test).filter_by(id=test_id).first()
+    return api._to_dict(test_info)
+
+
+def get_test_result_meta_key(test_id, key):
+    session = api.get_session()
+    meta_item = (session.query(models.TestMeta).filter_by(test_id=test_id)
+                 .filter_by(meta_key=key).first())
+    return meta_item.value
+
+
+def user_get(user_openid):
+    session = api.get_session()
+    return session.query(models.User).filter_by(openid=user_openid).first()
+
+
+def get_pubkey(key):
+    session = api.get_session()
+    md5_hash = hashlib.md5(base64.b64decode(key)).hexdigest()
+    return session.query(models.PubKey).filter_by(md5_hash=md5_hash).all()[0]
+
+
+def get_product(product_id):
+    session = api.get_session()
+    product = session.query(models.Product).filter_by(id=product_id).first()
+    return api._to_dict(product)
+
+
+def get_foundation_users():
+    session = api.get_session()
+    organization = (session.query(models.Organization.group_id)
+                    .filter_by(type=const.FOUNDATION).first())
+    users = (session.query(models.UserToGroup.user_openid)
+             .filter_by(group_id=organization.group_id))
+    return [user.user_openid for user in users]
+
+
+def setup_db(path):
+    cfg.CONF([], project='refstack', default_config_files=[])
+    cfg.CONF.set_override('connection', 'sqlite:///%s' % path, 'database')
+    engine = api.get_engine()
+
+    @sqlalchemy.event.listens_for(engine, 'connect')
+    def create_collation(dbapi_connection, connection_record):
+        # MySQL collation of test names.
+        dbapi_connection.create_collation(
+            'latin1_swedish_ci', lambda a, b: (a > b) - (a < b))
+
+    engine.dispose()
+    models.BASE.metadata.create_all(engine)
+
+    api.user_save({'openid': 'user', 'email': 'user@example.com',
+                   'fullname': 'User'})
+    pubkey = base64.b64encode(b'fake-key').decode('ascii')
+    api.store_pubkey({'openid': 'user', 'format': 'ssh-rsa',
+                      'pubkey': pubkey, 'comment': ''})
+    organization = api.add_organization({'name': 'Foundation'}, 'user')
+    session = api.get_session()
+    with session.begin():
+        (session.query(models.Organization)
+         .update({'type': const.FOUNDATION}))
+    product = api.add_product({'name': 'product', 'type': 0,
+                               'product_type': 0,
+                               'organization_id': organization['id']},
+                              'user')
+    test_id = api.store_test_results({'cpid': 'cpid', 'duration_seconds': 1,
+                                      'results': [],
+                                      'meta': {const.USER: 'user'}})
+    return test_id, pubkey, product['id']
+
+
+def main():
+    parser = argparse.ArgumentParser('Benchmark hot lookups of the DB API')
+    parser.add_argument('--calls', type=int, default=2000,
+                        help='number of calls of every lookup')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        test_id, pubkey, product_id = setup_db(
+            os.path.join(tmp_dir, 'refstack.db'))
+        lookups = (
+            ('get_test_result:         ',
+             lambda: get_test_result(test_id),
+             lambda: api.get_test_result(test_id)),
+            ('get_test_result_meta_key:',
+             lambda: get_test_result_meta_key(test_id, const.USER),
+             lambda: api.get_test_result_meta_key(test_id, const.USER)),
+            ('user_get:                ',
+             lambda: user_get('user'),
+             lambda: api.user_get('user')),
+            ('get_pubkey:              ',
+             lambda: get_pubkey(pubkey),
+             lambda: api.get_pubkey(pubkey)),
+            ('get_product:             ',
+             lambda: get_product(product_id),
+             lambda: api.get_product(product_id)),
+            ('get_foundation_users:    ',
+             get_foundation_users,
+             api.get_foundation_users),
+        )
+
+        print('%d calls of every lookup' % args.calls)
+        for name, built, baked in lookups:
+            times = []
+            for func in (built, baked):
+                func()
+                seconds = timeit.timeit(func, number=args.calls)
+                times.append(seconds * 1e6 / args.calls)
+            print('%s built %.1fus, baked %.1fus per call' % (
+                name, times[0], times[1]))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()